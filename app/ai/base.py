@@ -1,17 +1,139 @@
+import math
 import re
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, List, Optional, Union
+from .. import metrics
+
+TYPE_ABBREVIATIONS = {
+    "character varying": "varchar",
+    "varchar2": "varchar",
+    "nvarchar": "varchar",
+    "nvarchar2": "varchar",
+    "character": "char",
+    "nchar": "char",
+    "integer": "int",
+    "smallint": "int2",
+    "bigint": "int8",
+    "double precision": "float8",
+    "real": "float4",
+    "boolean": "bool",
+    "timestamp without time zone": "timestamp",
+    "timestamp with time zone": "timestamptz",
+    "time without time zone": "time",
+    "time with time zone": "timetz",
+    "datetime2": "datetime",
+}
+
+KEY_MARKERS = {"PRI": "PK", "UNI": "UQ"}
+
+def estimate_tokens(text: str) -> int:
+    return estimate_tokens_for_length(len(text))
+
+def estimate_tokens_for_length(length: int) -> int:
+    # Roughly four characters per token for BPE tokenizers on English/SQL text
+    return math.ceil(length / 4)
+
+class RenderedSchema:
+    def __init__(self, text: str, tokens: int, tables: int, omitted_tables: int):
+        self.text = text
+        self.tokens = tokens
+        self.tables = tables
+        self.omitted_tables = omitted_tables
 
 class BaseAIService:
+    # Label of this service's generations in the /metrics token histograms
+    provider = "unknown"
+
     def __init__(self, config: Dict[str, Any]):
         self.config = config
+        self.schema_token_budget = int(config.get("schema_token_budget", 8000))
         self._setup_services()
 
     def _setup_services(self):
         raise NotImplementedError("Subclasses must implement _setup_services")
 
+    async def close(self) -> None:
+        pass
+
+    async def stream_sql_query(self, natural_language: str, schema: Union[RenderedSchema, List[Dict[str, Any]]], databaseType: str) -> AsyncIterator[str]:
+        """Yields the raw model output in pieces as it is generated; pass the joined text to _clean_sql_query."""
+        yield await self.generate_sql_query(natural_language, schema, databaseType)
+
+    def render_schema(self, schema: List[Dict[str, Any]], token_budget: Optional[int] = None) -> RenderedSchema:
+        """Renders column rows as one compact `table(column type KEY, ...)` line per table.
+
+        Tables keep the order they appear in, which is also their priority: when the
+        text exceeds the token budget, types of non-key columns are dropped first and
+        then whole tables are dropped from the end until it fits.
+        """
+        budget = self.schema_token_budget if token_budget is None else token_budget
+        tables: Dict[str, List[Dict[str, Any]]] = {}
+        for row in schema:
+            tables.setdefault(self._qualified_table_name(row, schema), []).append(row)
+
+        for with_types in (True, False):
+            lines = [self._render_table(name, columns, with_types) for name, columns in tables.items()]
+            text = "\n".join(lines)
+            if budget <= 0 or estimate_tokens(text) <= budget:
+                return RenderedSchema(text, estimate_tokens(text), len(lines), 0)
+
+        footer = f"-- {len(lines)} more tables omitted"
+        kept, length = 0, len(footer)
+        for line in lines:
+            if kept and estimate_tokens_for_length(length + len(line) + 1) > budget:
+                break
+            kept += 1
+            length += len(line) + 1
+        omitted = len(lines) - kept
+        text = "\n".join(lines[:kept] + [f"-- {omitted} more tables omitted"])
+        return RenderedSchema(text, estimate_tokens(text), kept, omitted)
+
+    def _qualified_table_name(self, row: Dict[str, Any], schema: List[Dict[str, Any]]) -> str:
+        if row.get("schema_name") and row.get("schema_name") != schema[0].get("schema_name"):
+            return f"{row['schema_name']}.{row['table_name']}"
+        return row["table_name"]
+
+    def _render_table(self, name: str, columns: List[Dict[str, Any]], with_types: bool) -> str:
+        rendered = []
+        for column in columns:
+            markers = []
+            if KEY_MARKERS.get(column.get("column_key")):
+                markers.append(KEY_MARKERS[column["column_key"]])
+            if column.get("foreign_key"):
+                markers.append(f"FK>{column['foreign_key']}")
+            parts = [column["column_name"]]
+            if with_types or markers:
+                parts.append(self._abbreviate_type(column.get("data_type")))
+            rendered.append(" ".join(part for part in parts + markers if part))
+        return f"{name}({', '.join(rendered)})"
+
+    def _abbreviate_type(self, data_type: Optional[str]) -> str:
+        if not data_type:
+            return ""
+        data_type = str(data_type).lower()
+        return TYPE_ABBREVIATIONS.get(data_type, data_type)
+
+    def _observe_usage(self, prompt: str, prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None) -> None:
+        # Without a count from the model the prompt gets the same estimate as the schema budget
+        metrics.PROMPT_TOKENS.observe(prompt_tokens if prompt_tokens is not None else estimate_tokens(prompt), self.provider)
+        if completion_tokens is not None:
+            metrics.COMPLETION_TOKENS.observe(completion_tokens, self.provider)
+
+    def _build_prompt(self, natural_language: str, schema: Union[RenderedSchema, List[Dict[str, Any]]], databaseType: str) -> str:
+        if not isinstance(schema, RenderedSchema):
+            schema = self.render_schema(schema)
+        return f"""
+        You are a {databaseType} database expert. Do not respond with any information unrelated to databases or queries.
+        Use the following {databaseType} database schema when creating your answers, written as table(column type keys):
+        {schema.text}
+
+        Generate a valid {databaseType} SQL query that can be executed without errors against the schema for the following: {natural_language}
+
+        Return only the SQL query without any explanation and do not use markdown.
+        """
+
     def _clean_sql_query(self, query: str) -> str:
         query = re.sub(r'```sql\n?', '', query)
         query = re.sub(r'```\n?', '', query)
         query = re.sub(r'`', '', query)
         query = re.sub(r'\n', ' ', query)
-        return query.strip()
\ No newline at end of file
+        return query.strip()
@@ -1,10 +1,13 @@
 from mistralai import Mistral
-from .base import BaseAIService
-from typing import Dict, Any
-import json
+from .base import BaseAIService, RenderedSchema
+from .. import metrics
+import time
+from typing import Dict, Any, AsyncIterator, List, Union
 
 
 class MistralAIService(BaseAIService):
+    provider = "mistral"
+
     def _setup_services(self):
         self.api_key = self.config.get("mistral_api_key")
         if not self.api_key:
@@ -13,19 +16,36 @@ class MistralAIService(BaseAIService):
         self.model = self.config.get("mistral_model", "mistral-small-latest")
         self.client = Mistral(api_key=self.api_key)
 
-    async def generate_sql_query(self, natural_language: str, schema: Dict[str, Any], databaseType: str) -> str:
-        prompt = f"""
-        You are a {databaseType} database expert. Do not respond with any information unrelated to databases or queries.
-        Use the following {databaseType} database schema when creating your answers:
-        {json.dumps(schema, indent=2)}
+    async def generate_sql_query(self, natural_language: str, schema: Union[RenderedSchema, List[Dict[str, Any]]], databaseType: str) -> str:
+        prompt = self._build_prompt(natural_language, schema, databaseType)
+
+        try:
+            with metrics.span("llm"):
+                response = await self.client.chat.complete_async(
+                    model=self.model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    temperature=0.2
+                )
+            usage = response.usage
+            self._observe_usage(prompt, usage.prompt_tokens if usage else None, usage.completion_tokens if usage else None)
+
+            query_content = response.choices[0].message.content
+            return self._clean_sql_query(query_content)
 
-        Generate a valid {databaseType} SQL query that can be executed without errors against the schema for the following: {natural_language}
+        except Exception as e:
+            raise Exception(f"Failed to generate SQL query using Mistral client: {str(e)}")
 
-        Return only the SQL query without any explanation and do not use markdown.
-        """
+    async def stream_sql_query(self, natural_language: str, schema: Union[RenderedSchema, List[Dict[str, Any]]], databaseType: str) -> AsyncIterator[str]:
+        prompt = self._build_prompt(natural_language, schema, databaseType)
 
+        start, first_token, usage = time.perf_counter(), True, None
         try:
-            response = await self.client.chat.complete_async(
+            response = await self.client.chat.stream_async(
                 model=self.model,
                 messages=[
                     {
@@ -35,9 +55,19 @@ class MistralAIService(BaseAIService):
                 ],
                 temperature=0.2
             )
-
-            query_content = response.choices[0].message.content
-            return self._clean_sql_query(query_content)
+            async with response as events:
+                async for event in events:
+                    # Usage arrives with the last chunk
+                    usage = event.data.usage or usage
+                    content = event.data.choices[0].delta.content
+                    if isinstance(content, str) and content:
+                        if first_token:
+                            metrics.record("llm_first_token", time.perf_counter() - start)
+                            first_token = False
+                        yield content
+            self._observe_usage(prompt, usage.prompt_tokens if usage else None, usage.completion_tokens if usage else None)
 
         except Exception as e:
-            raise Exception(f"Failed to generate SQL query using Mistral client: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Failed to generate SQL query using Mistral client: {str(e)}")
+        finally:
+            metrics.record("llm", time.perf_counter() - start)
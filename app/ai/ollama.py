@@ -1,41 +1,108 @@
-from .base import BaseAIService
+from .base import BaseAIService, RenderedSchema
+from .. import metrics
+import asyncio
+import httpx
 import json
-import requests
-from typing import Dict, Any
+import time
+from typing import Dict, Any, AsyncIterator, List, Union
 
 
 class OllamaAIService(BaseAIService):
+    provider = "ollama"
+
     def _setup_services(self):
         self.ollama_endpoint = self.config.get("ollama_endpoint", "http://localhost:11434")
         self.model = self.config.get("ollama_model", "llama3.2")
+        self.max_concurrency = int(self.config.get("ollama_max_concurrency", 4))
+        # Generations can take minutes on a local model, so only connecting is kept short
+        self.client = httpx.AsyncClient(
+            base_url=self.ollama_endpoint,
+            timeout=httpx.Timeout(
+                float(self.config.get("ollama_read_timeout", 300)),
+                connect=float(self.config.get("ollama_connect_timeout", 5))
+            ),
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+                keepalive_expiry=float(self.config.get("ollama_keepalive", 60))
+            )
+        )
+        # Requests beyond the limit wait here rather than in the connection pool, where
+        # they would count against the pool timeout
+        self._slots = asyncio.Semaphore(self.max_concurrency)
 
-    async def generate_sql_query(self, natural_language: str, schema: Dict[str, Any], databaseType: str) -> str:
-        prompt = f"""
-        You are a {databaseType} database expert. Do not respond with any information unrelated to databases or queries.
-        Use the following {databaseType} database schema when creating your answers:
-        {json.dumps(schema, indent=2)}
-        
-        Generate a valid {databaseType} SQL query that can be executed without errors against the schema for the following: {natural_language}
-        
-        Return only the SQL query without any explanation and do not use markdown.
-        """
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def generate_sql_query(self, natural_language: str, schema: Union[RenderedSchema, List[Dict[str, Any]]], databaseType: str) -> str:
+        prompt = self._build_prompt(natural_language, schema, databaseType)
 
         try:
-            response = requests.post(
-                f"{self.ollama_endpoint}/api/chat",
-                json={
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
+            with metrics.span("llm"):
+                async with self._slots:
+                    response = await self.client.post(
+                        "/api/chat",
+                        json={
+                            "model": self.model,
+                            "messages": [
+                                {
+                                    "role": "user",
+                                    "content": prompt
+                                }
+                            ],
+                            "stream": False
                         }
-                    ],
-                    "stream": False
-                }
-            )
+                    )
             response.raise_for_status()
             result = response.json()
+            self._observe_usage(prompt, result.get("prompt_eval_count"), result.get("eval_count"))
             return self._clean_sql_query(result["message"]["content"])
+        except httpx.TimeoutException as e:
+            raise Exception(f"Failed to generate SQL query: Ollama request timed out ({type(e).__name__})")
+        except Exception as e:
+            raise Exception(f"Failed to generate SQL query: {str(e)}")
+
+    async def stream_sql_query(self, natural_language: str, schema: Union[RenderedSchema, List[Dict[str, Any]]], databaseType: str) -> AsyncIterator[str]:
+        prompt = self._build_prompt(natural_language, schema, databaseType)
+
+        start, first_token = time.perf_counter(), True
+        try:
+            async with self._slots:
+                async with self.client.stream(
+                    "POST",
+                    "/api/chat",
+                    json={
+                        "model": self.model,
+                        "messages": [
+                            {
+                                "role": "user",
+                                "content": prompt
+                            }
+                        ],
+                        "stream": True
+                    }
+                ) as response:
+                    response.raise_for_status()
+                    # One JSON object per line until the one marked done
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise Exception(chunk["error"])
+                        content = chunk.get("message", {}).get("content")
+                        if content:
+                            if first_token:
+                                metrics.record("llm_first_token", time.perf_counter() - start)
+                                first_token = False
+                            yield content
+                        if chunk.get("done"):
+                            # The final chunk carries the token counts
+                            self._observe_usage(prompt, chunk.get("prompt_eval_count"), chunk.get("eval_count"))
+                            break
+        except httpx.TimeoutException as e:
+            raise Exception(f"Failed to generate SQL query: Ollama request timed out ({type(e).__name__})")
         except Exception as e:
-            raise Exception(f"Failed to generate SQL query: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Failed to generate SQL query: {str(e)}")
+        finally:
+            metrics.record("llm", time.perf_counter() - start)
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+# Comparison operators and signs change what a question asks for, so they survive as
+# words when the rest of the punctuation is dropped; longer operators are matched first
+OPERATOR_WORDS = [
+    (r">=", " gte "), (r"<=", " lte "), (r"<>|!=", " ne "), (r"=", " eq "), (r">", " gt "), (r"<", " lt "),
+    (r"!(?=\w)", " not "), (r"(?<![\w.])-(?=\d)", " neg "),
+]
+
+def spell_operators(question: str) -> str:
+    for pattern, word in OPERATOR_WORDS:
+        question = re.sub(pattern, word, question)
+    return question
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"[^\w\s]", " ", spell_operators(question.lower()))
+    return " ".join(question.split())
+
+class QueryCache:
+    """LRU cache of generated SQL keyed by normalized question, database type and prompt schema.
+
+    When QUERY_CACHE_PATH is set, entries are also written to a SQLite file, from a
+    thread so the event loop never waits on it, and the most recent ones are loaded
+    back on startup.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, path: Optional[str] = None):
+        self.max_entries = max_entries or int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))
+        self.path = path if path is not None else os.getenv("QUERY_CACHE_PATH", "")
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache (key TEXT PRIMARY KEY, sql_query TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT key, sql_query FROM query_cache ORDER BY stored_at DESC LIMIT ?", (self.max_entries,)
+            ).fetchall()
+            for key, sql_query in reversed(rows):
+                self._entries[key] = sql_query
+
+    @staticmethod
+    def key(natural_language: str, database_type: str, schema_text: str) -> str:
+        schema_hash = hashlib.sha256(schema_text.encode()).hexdigest()
+        return hashlib.sha256(
+            f"{database_type}\n{normalize_question(natural_language)}\n{schema_hash}".encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            sql_query = self._entries.get(key)
+            if sql_query is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return sql_query
+
+    async def put(self, key: str, sql_query: str) -> None:
+        with self._lock:
+            self._entries[key] = sql_query
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        if self._db is not None:
+            await asyncio.to_thread(self._write, key, sql_query, evicted)
+
+    def _write(self, key: str, sql_query: str, evicted: List[str]) -> None:
+        with self._disk_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_cache (key, sql_query, stored_at) VALUES (?, ?, ?)",
+                (key, sql_query, time.time())
+            )
+            self._db.executemany("DELETE FROM query_cache WHERE key = ?", [(key,) for key in evicted])
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "persistent": self._db is not None
+        }
@@ -0,0 +1,159 @@
+import math
+import os
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set
+
+STOPWORDS = {
+    "a", "all", "an", "and", "are", "at", "be", "by", "did", "do", "does", "each", "for", "from",
+    "get", "give", "has", "have", "how", "in", "is", "list", "many", "me", "much", "of", "on",
+    "or", "per", "show", "that", "the", "their", "there", "to", "was", "were", "what", "which",
+    "who", "with",
+}
+
+# Table name terms count this many times, so a match on the table itself outranks a column match
+TABLE_NAME_WEIGHT = 3
+
+def singularize(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("sses", "xes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def split_identifier(identifier: str) -> List[str]:
+    """Splits snake_case, camelCase and free text into lower-case, singularised terms."""
+    spaced = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(identifier))
+    terms = []
+    for word in re.split(r"[^A-Za-z0-9]+", spaced):
+        word = word.lower()
+        if not word or word in STOPWORDS:
+            continue
+        terms.append(singularize(word))
+    return terms
+
+class SchemaIndex:
+    """BM25 index with one document per table, built from its table and column names."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.rows: Dict[str, List[Dict[str, Any]]] = {}
+        self.terms: Dict[str, Set[str]] = {}
+        self.references: Dict[str, Set[str]] = {}
+        self.referenced_by: Dict[str, Set[str]] = {}
+        self.total_length = 0
+
+    def add_table(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        if table in self.rows:
+            self.remove_table(table)
+        terms = split_identifier(table) * TABLE_NAME_WEIGHT
+        for row in rows:
+            terms.extend(split_identifier(row["column_name"]))
+            terms.append(str(row["column_name"]).lower())
+        frequencies = Counter(terms)
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[table] = frequency
+        self.terms[table] = set(frequencies)
+        self.lengths[table] = len(terms)
+        self.total_length += len(terms)
+        self.rows[table] = rows
+        self.references[table] = {
+            str(row["foreign_key"]).rsplit(".", 1)[0] for row in rows if row.get("foreign_key")
+        }
+        for referenced in self.references[table]:
+            self.referenced_by.setdefault(referenced, set()).add(table)
+
+    def remove_table(self, table: str) -> None:
+        for term in self.terms.pop(table):
+            documents = self.postings[term]
+            del documents[table]
+            if not documents:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(table)
+        del self.rows[table]
+        for referenced in self.references.pop(table):
+            self.referenced_by[referenced].discard(table)
+
+    def neighbours(self, table: str) -> Set[str]:
+        return self.references.get(table, set()) | self.referenced_by.get(table, set())
+
+    def search(self, question: str, top_k: int) -> List[str]:
+        if not self.lengths:
+            return []
+        average_length = self.total_length / len(self.lengths)
+        scores: Dict[str, float] = {}
+        for term in set(split_identifier(question)):
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(1 + (len(self.lengths) - len(documents) + 0.5) / (len(documents) + 0.5))
+            for table, frequency in documents.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[table] / average_length)
+                scores[table] = scores.get(table, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores, key=lambda table: (-scores[table], table))
+        return ranked[:top_k]
+
+class SchemaRetriever:
+    """Keeps a SchemaIndex per connection and prunes schemas to the tables relevant to a question.
+
+    The index is rebuilt incrementally: when a new schema snapshot arrives only tables
+    whose column rows changed are re-indexed.
+    """
+
+    def __init__(self, top_k: Optional[int] = None, max_tables: Optional[int] = None, min_tables: Optional[int] = None, max_entries: int = 256):
+        self.top_k = top_k or int(os.getenv("SCHEMA_RETRIEVAL_TOP_K", "8"))
+        self.max_tables = max_tables or int(os.getenv("SCHEMA_RETRIEVAL_MAX_TABLES", "20"))
+        self.min_tables = min_tables if min_tables is not None else int(os.getenv("SCHEMA_RETRIEVAL_MIN_TABLES", "50"))
+        self.max_entries = max_entries
+        self._indexes: "OrderedDict[Hashable, SchemaIndex]" = OrderedDict()
+        self._snapshots: Dict[Hashable, List[Dict[str, Any]]] = {}
+
+    def select(self, key: Hashable, schema: List[Dict[str, Any]], question: str) -> List[Dict[str, Any]]:
+        index = self._index_for(key, schema)
+        if len(index.rows) <= self.min_tables:
+            return schema
+
+        selected = index.search(question, self.top_k)
+        if not selected:
+            return schema
+        for table in list(selected):
+            for neighbour in sorted(index.neighbours(table)):
+                if len(selected) >= self.max_tables:
+                    break
+                if neighbour in index.rows and neighbour not in selected:
+                    selected.append(neighbour)
+        return [row for table in selected for row in index.rows[table]]
+
+    def invalidate(self, key: Hashable) -> None:
+        self._indexes.pop(key, None)
+        self._snapshots.pop(key, None)
+
+    def _index_for(self, key: Hashable, schema: List[Dict[str, Any]]) -> SchemaIndex:
+        index = self._indexes.get(key)
+        if index is not None and self._snapshots.get(key) is schema:
+            self._indexes.move_to_end(key)
+            return index
+
+        tables: Dict[str, List[Dict[str, Any]]] = {}
+        for row in schema:
+            tables.setdefault(row["table_name"], []).append(row)
+        if index is None:
+            index = SchemaIndex()
+        for table in [table for table in index.rows if table not in tables]:
+            index.remove_table(table)
+        for table, rows in tables.items():
+            if index.rows.get(table) != rows:
+                index.add_table(table, rows)
+
+        self._indexes[key] = index
+        self._snapshots[key] = schema
+        self._indexes.move_to_end(key)
+        while len(self._indexes) > self.max_entries:
+            evicted, _ = self._indexes.popitem(last=False)
+            self._snapshots.pop(evicted, None)
+        return index
@@ -0,0 +1,195 @@
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Hashable, List, Optional, Tuple
+import numpy as np
+
+from .query_cache import spell_operators
+from .retrieval import singularize, split_identifier
+
+# Filler words on top of the retrieval stopwords that never change what SQL is needed
+FILLER_WORDS = {"any", "been", "during", "every", "that", "these", "those", "who", "whose"}
+
+# Whole-word features are added on top of character n-grams with this weight, so that
+# "active" vs "inactive" or "most" vs "least" outweighs their shared n-grams
+WORD_WEIGHT = 2.0
+
+OPERATORS = {"gte", "lte", "ne", "eq", "gt", "lt"}
+GROUPING_WORDS = {"per", "by", "each"}
+
+def extract_literals(question: str) -> FrozenSet[str]:
+    """Numbers with their sign, quoted strings and comparison operators, which must match exactly for two questions to share SQL."""
+    quoted = re.findall(r"'([^']*)'|\"([^\"]*)\"", question)
+    unquoted = re.sub(r"'[^']*'|\"[^\"]*\"", " ", question)
+    numbers = re.findall(r"(?:(?<![\w.])-)?\d+(?:\.\d+)?", unquoted)
+    operators = [f"op:{operator}" for operator in spell_operators(unquoted).split() if operator in OPERATORS]
+    return frozenset([value.lower() for pair in quoted for value in pair if value] + numbers + operators)
+
+def question_words(question: str) -> FrozenSet[str]:
+    """Every word of the question, lower-cased and singularised, stopwords included."""
+    return frozenset(singularize(word.lower()) for word in re.findall(r"[A-Za-z0-9]+", question))
+
+def value_words(question: str) -> FrozenSet[str]:
+    """Words that name a value rather than a concept: single letters and capitalised words.
+
+    "starts with A" and "starts with B", or "customers in NY" and "customers in LA",
+    differ only in these, and the n-grams barely see them. The first word is only
+    taken when it is an acronym or starts a run of capitalised words ("New York
+    customers"), since any question may start with a capital. The article "a" is not
+    a value.
+    """
+    unquoted = re.sub(r"'[^']*'|\"[^\"]*\"", " ", question)
+    words = re.findall(r"[A-Za-z]+", unquoted)
+    values = []
+    for index, word in enumerate(words):
+        if len(word) == 1 and word != "a" and (index > 0 or word.isupper() and len(words) > 1 and words[1][0].isupper()):
+            values.append(word.lower())
+        elif len(word) > 1 and word[0].isupper():
+            starts_run = len(words) > 1 and words[1][0].isupper()
+            if index > 0 or word.isupper() or starts_run:
+                values.append(singularize(word.lower()))
+    return frozenset(values)
+
+def grouping_terms(question: str) -> FrozenSet[str]:
+    """What a question breaks its answer down by, the term after "per", "by" or "each".
+
+    Word order is otherwise invisible to the bag of n-grams, and "customers per store"
+    and "stores per customer" need different SQL.
+    """
+    words = re.findall(r"[A-Za-z0-9]+", question.lower())
+    terms = []
+    for index, word in enumerate(words[:-1]):
+        if word in GROUPING_WORDS:
+            following = [term for term in words[index + 1:] if term not in ("a", "an", "the")]
+            terms += [f"per:{term}" for term in split_identifier(following[0])[:1]] if following else []
+    return frozenset(terms)
+
+class ConnectionVectors:
+    """Fixed-size matrix of hashed n-gram term frequencies for one connection."""
+
+    def __init__(self, max_entries: int, dimensions: int):
+        self.tf = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self.df = np.zeros(dimensions, dtype=np.float32)
+        self.last_used = np.zeros(max_entries, dtype=np.float64)
+        self.sql_queries: List[Optional[str]] = [None] * max_entries
+        self.scopes: List[Optional[str]] = [None] * max_entries
+        self.literals: List[Optional[FrozenSet[str]]] = [None] * max_entries
+        self.values: List[Optional[FrozenSet[str]]] = [None] * max_entries
+        self.words: List[Optional[FrozenSet[str]]] = [None] * max_entries
+        self.count = 0
+
+class SemanticQueryCache:
+    """Returns SQL generated for an earlier question that is a near-duplicate of the new one.
+
+    Questions are reduced to singularised content words and embedded locally as TF-IDF
+    weighted character n-grams plus whole words, hashed into SEMANTIC_CACHE_DIMENSIONS
+    buckets. Each connection keeps at most SEMANTIC_CACHE_MAX_ENTRIES vectors in a
+    preallocated float32 matrix, so memory is bounded by
+    max_connections * max_entries * dimensions * 4 bytes.
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        dimensions: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        ngram_range: Tuple[int, int] = (3, 4)
+    ):
+        self.threshold = threshold if threshold is not None else float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "256"))
+        self.dimensions = dimensions or int(os.getenv("SEMANTIC_CACHE_DIMENSIONS", "1024"))
+        self.max_connections = max_connections or int(os.getenv("SEMANTIC_CACHE_MAX_CONNECTIONS", "64"))
+        self.ngram_range = ngram_range
+        self._connections: "OrderedDict[Hashable, ConnectionVectors]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def vectorize(self, question: str) -> np.ndarray:
+        words = [word for word in split_identifier(question) if word not in FILLER_WORDS]
+        text = f" {' '.join(words)} "
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        buckets = [
+            zlib.crc32(text[start:start + size].encode()) % self.dimensions
+            for size in range(self.ngram_range[0], self.ngram_range[1] + 1)
+            for start in range(len(text) - size + 1)
+        ]
+        if buckets:
+            np.add.at(vector, buckets, 1.0)
+        vector = np.log1p(vector)
+        for word in words:
+            vector[zlib.crc32(f"word:{word}".encode()) % self.dimensions] += WORD_WEIGHT
+        return vector
+
+    def lookup(self, key: Hashable, question: str, scope: str) -> Optional[Tuple[str, float]]:
+        vectors = self._connections.get(key)
+        if not self.enabled or vectors is None or vectors.count == 0:
+            self.misses += 1
+            return None
+        self._connections.move_to_end(key)
+
+        count = vectors.count
+        idf = np.log((1 + count) / (1 + vectors.df)) + 1
+        matrix = vectors.tf[:count] * idf
+        query = self.vectorize(question) * idf
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        similarities = matrix @ query / np.maximum(norms, 1e-12)
+
+        literals = extract_literals(question) | grouping_terms(question)
+        values, words = value_words(question), question_words(question)
+        for slot in np.argsort(-similarities):
+            if similarities[slot] < self.threshold:
+                break
+            # Values count whatever their case on the other side: "New York" matches "new york"
+            same_values = values <= vectors.words[slot] and vectors.values[slot] <= words
+            if vectors.scopes[slot] == scope and vectors.literals[slot] == literals and same_values:
+                self.hits += 1
+                vectors.last_used[slot] = time.monotonic()
+                return vectors.sql_queries[slot], float(similarities[slot])
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, question: str, scope: str, sql_query: str) -> None:
+        if not self.enabled:
+            return
+        vectors = self._connections.get(key)
+        if vectors is None:
+            vectors = ConnectionVectors(self.max_entries, self.dimensions)
+            self._connections[key] = vectors
+            while len(self._connections) > self.max_connections:
+                self._connections.popitem(last=False)
+        self._connections.move_to_end(key)
+
+        if vectors.count < self.max_entries:
+            slot = vectors.count
+            vectors.count += 1
+        else:
+            slot = int(np.argmin(vectors.last_used))
+            vectors.df -= vectors.tf[slot] > 0
+        vectors.tf[slot] = self.vectorize(question)
+        vectors.df += vectors.tf[slot] > 0
+        vectors.last_used[slot] = time.monotonic()
+        vectors.sql_queries[slot] = sql_query
+        vectors.scopes[slot] = scope
+        vectors.literals[slot] = extract_literals(question) | grouping_terms(question)
+        vectors.values[slot] = value_words(question)
+        vectors.words[slot] = question_words(question)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._connections.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "connections": len(self._connections),
+            "entries": sum(vectors.count for vectors in self._connections.values()),
+            "threshold": self.threshold,
+            "memory_bytes": sum(vectors.tf.nbytes for vectors in self._connections.values())
+        }
@@ -1,7 +1,8 @@
 import streamlit as st
+import pandas as pd
 import requests
 import json
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Tuple
 import os
 from dotenv import load_dotenv
 from auth_frontend import show_auth_page
@@ -36,13 +37,21 @@ def save_connection_string(database_type: str, name: str, connection_string: str
         st.error(f"Failed to save connection string: {str(e)}")
         return False
 
-def connect_to_database(db_type: str, connection_string: str) -> bool:
+def connect_to_database(db_type: str = None, connection_string: str = None, connection_string_id: int = None, page_size: int = None, result_cache_ttl: float = None) -> bool:
     try:
         response = requests.post(
             f"{API_BASE_URL}/connect",
-            json={"db_type": db_type, "connection_string": connection_string}
+            headers={"Authorization": f"Bearer {st.session_state.token}"},
+            json={
+                "db_type": db_type,
+                "connection_string": connection_string,
+                "connection_string_id": connection_string_id,
+                "page_size": page_size,
+                "result_cache_ttl": result_cache_ttl
+            }
         )
         response.raise_for_status()
+        st.session_state.connection_id = response.json()["connection_id"]
         return True
     except Exception as e:
         st.error(f"Failed to connect: {str(e)}")
@@ -50,8 +59,13 @@ def connect_to_database(db_type: str, connection_string: str) -> bool:
 
 def disconnect_from_database() -> bool:
     try:
-        response = requests.post(f"{API_BASE_URL}/disconnect")
+        response = requests.post(
+            f"{API_BASE_URL}/disconnect",
+            headers={"Authorization": f"Bearer {st.session_state.token}"},
+            json={"connection_id": st.session_state.connection_id}
+        )
         response.raise_for_status()
+        st.session_state.connection_id = None
         return True
     except Exception as e:
         st.error(f"Failed to disconnect: {str(e)}")
@@ -59,25 +73,114 @@ def disconnect_from_database() -> bool:
 
 def get_schema() -> List[Dict[str, Any]]:
     try:
-        response = requests.get(f"{API_BASE_URL}/schema")
+        response = requests.get(
+            f"{API_BASE_URL}/schema",
+            headers={"Authorization": f"Bearer {st.session_state.token}"},
+            params={"connection_id": st.session_state.connection_id}
+        )
         response.raise_for_status()
         return response.json()["schema"]
     except Exception as e:
         st.error(f"Failed to get schema: {str(e)}")
         return []
 
-def execute_query(natural_language: str) -> Dict[str, Any]:
+def read_server_sent_events(response: requests.Response) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+def execute_query(natural_language: str, confirmation_token: str = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    try:
+        with requests.post(
+            f"{API_BASE_URL}/query/stream",
+            headers={"Authorization": f"Bearer {st.session_state.token}"},
+            params={"format": "columnar"},
+            json={
+                "natural_language": natural_language,
+                "connection_id": st.session_state.connection_id,
+                "confirmation_token": confirmation_token
+            },
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            yield from read_server_sent_events(response)
+    except Exception as e:
+        st.error(f"Failed to execute query: {str(e)}")
+
+def fetch_next_page(continuation_token: str) -> Dict[str, Any]:
     try:
         response = requests.post(
-            f"{API_BASE_URL}/query",
-            json={"natural_language": natural_language}
+            f"{API_BASE_URL}/query/page",
+            headers={"Authorization": f"Bearer {st.session_state.token}"},
+            params={"format": "columnar"},
+            json={"connection_id": st.session_state.connection_id, "continuation_token": continuation_token}
         )
         response.raise_for_status()
         return response.json()
     except Exception as e:
-        st.error(f"Failed to execute query: {str(e)}")
+        st.error(f"Failed to load more rows: {str(e)}")
         return {}
 
+def result_cache_caption(result: Dict[str, Any]) -> str:
+    if result.get("result_cache") == "hit":
+        return f"Result cache: hit, {result['result_age']:.0f}s old"
+    return f"Result cache: {result.get('result_cache')}"
+
+def show_result(result: Dict[str, Any]):
+    st.subheader("Generated SQL Query")
+    st.code(result["sql_query"], language="sql")
+    st.caption(f"SQL cache: {result.get('cache', 'miss')}")
+    st.subheader("Results")
+    if result.get("result_cache"):
+        st.caption(result_cache_caption(result))
+    st.dataframe(result["frame"])
+
+def run_query(natural_language: str, confirmation_token: str = None):
+    st.subheader("Generated SQL Query")
+    sql_placeholder = st.empty()
+    cache_placeholder = st.empty()
+    st.subheader("Results")
+    result_cache_placeholder = st.empty()
+    results_placeholder = st.empty()
+
+    st.session_state.pending_confirmation = None
+    generated, columns, batches, result = "", [], [], {}
+    for event, data in execute_query(natural_language, confirmation_token):
+        if event == "token":
+            generated += data["text"]
+            sql_placeholder.code(generated, language="sql")
+        elif event == "sql":
+            result.update(sql_query=data["sql_query"], cache=data.get("cache", "miss"))
+            sql_placeholder.code(data["sql_query"], language="sql")
+            cache_placeholder.caption(f"SQL cache: {result['cache']}")
+        elif event == "columns":
+            columns = data["columns"]
+            results_placeholder.dataframe(pd.DataFrame(columns=columns))
+        elif event == "rows":
+            batches.append(pd.DataFrame(data["rows"], columns=columns))
+            results_placeholder.dataframe(pd.concat(batches, ignore_index=True))
+        elif event == "done":
+            result.update(
+                frame=pd.concat(batches, ignore_index=True) if batches else pd.DataFrame(columns=columns),
+                next_page=data.get("next_page"),
+                result_cache=data.get("result_cache"),
+                result_age=data.get("result_age")
+            )
+            if result["result_cache"]:
+                result_cache_placeholder.caption(result_cache_caption(result))
+            st.session_state.last_result = result
+        elif event == "confirm":
+            st.session_state.pending_confirmation = {"natural_language": natural_language, **data}
+        elif event == "error":
+            st.error(f"Failed to execute query: {data['detail']}")
+
 def main():
     st.title("DB Chat")
     
@@ -85,6 +188,8 @@ def main():
         st.session_state.token = None
     if "username" not in st.session_state:
         st.session_state.username = None
+    if "connection_id" not in st.session_state:
+        st.session_state.connection_id = None
     
     if not st.session_state.token:
         show_auth_page()
@@ -94,17 +199,22 @@ def main():
     if st.sidebar.button("Logout"):
         st.session_state.token = None
         st.session_state.username = None
+        st.session_state.connection_id = None
+        st.session_state.last_result = None
+        st.session_state.pending_confirmation = None
         st.rerun()
     
     with st.sidebar:
         st.header("Database Connection")
+        page_size = int(st.number_input("Rows per page", min_value=0, value=1000, step=100, help="0 returns every row"))
+        result_cache_ttl = float(st.number_input("Result cache TTL (seconds)", min_value=0, value=0, step=30, help="0 doesn't cache results"))
         
         connection_strings = get_connection_strings()
         if connection_strings:
             st.subheader("Saved Connections")
             for conn in connection_strings:
                 if st.button(f"Connect to {conn['name']}"):
-                    if connect_to_database(conn['database_type'], conn["connection_string"]):
+                    if connect_to_database(connection_string_id=conn["id"], page_size=page_size, result_cache_ttl=result_cache_ttl):
                         st.success("Connected successfully!")
         
         st.subheader("New Connection")
@@ -122,7 +232,7 @@ def main():
         col1, col2 = st.columns(2)
         with col1:
             if st.button("Connect"):
-                if connect_to_database(db_type, connection_string):
+                if connect_to_database(db_type, connection_string, page_size=page_size, result_cache_ttl=result_cache_ttl):
                     st.success("Connected successfully!")
         with col2:
             if st.button("Save Connection"):
@@ -147,15 +257,26 @@ def main():
     
     if st.button("Execute Query"):
         if natural_language:
-            result = execute_query(natural_language)
-            if result:
-                st.subheader("Generated SQL Query")
-                st.code(result["sql_query"], language="sql")
-                
-                st.subheader("Results")
-                st.dataframe(result["results"])
+            run_query(natural_language)
         else:
             st.warning("Please enter a question first")
+    elif st.session_state.get("last_result"):
+        show_result(st.session_state.last_result)
+
+    pending = st.session_state.get("pending_confirmation")
+    if pending:
+        st.warning(pending["message"])
+        st.code(pending["sql_query"], language="sql")
+        if st.button("Run anyway"):
+            run_query(pending["natural_language"], pending["confirmation_token"])
+
+    result = st.session_state.get("last_result")
+    if result and result.get("next_page") and st.button("Load more rows"):
+        page = fetch_next_page(result["next_page"])
+        if page:
+            result["frame"] = pd.concat([result["frame"], pd.DataFrame(page["rows"], columns=page["columns"])], ignore_index=True)
+            result["next_page"] = page.get("next_page")
+            st.rerun()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,17 +1,35 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Awaitable, List, Optional, Set, Tuple
+import asyncio
+import datetime as dt
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
+from jose import JWTError, jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 
 from app.ai.mistral import MistralAIService
 
+from .supportedDBs.base import ConfirmationRequired, QueryRejected
 from .supportedDBs.manager import DatabaseManagerService
+from .supportedDBs.schema_cache import SchemaCache
+from .supportedDBs.result_cache import CachedResult, ResultCache
+from .supportedDBs import pagination
 from .ai.ollama import OllamaAIService
-from . import models, schemas, auth
+from .ai.base import RenderedSchema
+from .ai.retrieval import SchemaRetriever
+from .ai.query_cache import QueryCache
+from .ai.semantic_cache import SemanticQueryCache
+from .singleflight import SingleFlight
+from .query_registry import QueryRegistry, RunningQuery
+from . import models, schemas, auth, result_formats, metrics
 from .database import engine, get_db
 
 # Load environment variables
@@ -27,54 +45,102 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Initialize services
 db_manager = DatabaseManagerService()
-# ai_service = OllamaAIService({
-#     "ollama_endpoint": os.getenv("OLLAMA_ENDPOINT", "http://localhost:11434"),
-#     "ollama_model": os.getenv("OLLAMA_MODEL", "llama3.2")
-# })
-
-ai_service = MistralAIService({
-    "mistral_api_key": os.getenv("MISTRAL_KEY"),
-    "mistral_model": os.getenv("MISTRAL_MODEL", "mistral-large-latest")
-})
-
-models.Base.metadata.create_all(bind=engine)
+schema_cache = SchemaCache()
+result_cache = ResultCache()
+schema_retriever = SchemaRetriever()
+query_cache = QueryCache()
+semantic_cache = SemanticQueryCache()
+sql_generation_flights = SingleFlight()
+query_registry = QueryRegistry()
+QUERY_STREAM_CHUNK_ROWS = int(os.getenv("QUERY_STREAM_CHUNK_ROWS", "500"))
+QUERY_PAGE_TOKEN_TTL = int(os.getenv("QUERY_PAGE_TOKEN_TTL", "3600"))
+QUERY_DISCONNECT_POLL = float(os.getenv("QUERY_DISCONNECT_POLL", "0.5"))
+if os.getenv("AI_PROVIDER", "mistral").lower() == "ollama":
+    ai_service = OllamaAIService({
+        "ollama_endpoint": os.getenv("OLLAMA_ENDPOINT", "http://localhost:11434"),
+        "ollama_model": os.getenv("OLLAMA_MODEL", "llama3.2"),
+        "ollama_connect_timeout": float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5")),
+        "ollama_read_timeout": float(os.getenv("OLLAMA_READ_TIMEOUT", "300")),
+        "ollama_max_concurrency": int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4")),
+        "schema_token_budget": int(os.getenv("SCHEMA_PROMPT_TOKEN_BUDGET", "8000"))
+    })
+else:
+    ai_service = MistralAIService({
+        "mistral_api_key": os.getenv("MISTRAL_KEY"),
+        "mistral_model": os.getenv("MISTRAL_MODEL", "mistral-large-latest"),
+        "schema_token_budget": int(os.getenv("SCHEMA_PROMPT_TOKEN_BUDGET", "8000"))
+    })
 
 class ConnectionRequest(BaseModel):
-    db_type: str
-    connection_string: str
+    db_type: Optional[str] = None
+    connection_string: Optional[str] = None
+    connection_string_id: Optional[int] = None
+    page_size: Optional[int] = None
+    # Seconds results are cached on this connection, None uses DB_RESULT_CACHE_TTL
+    result_cache_ttl: Optional[float] = None
+
+class DisconnectRequest(BaseModel):
+    connection_id: str
 
 class QueryRequest(BaseModel):
     natural_language: str
+    connection_id: str
+    # From a 409 response, runs the query despite its estimate being over a DB_CONFIRM_* threshold
+    confirmation_token: Optional[str] = None
+    # Optional client-chosen id for /query/{query_id}/cancel, generated when missing
+    query_id: Optional[str] = None
+
+class PageRequest(BaseModel):
+    connection_id: str
+    continuation_token: str
+    query_id: Optional[str] = None
+
+async def _get_connection_string(db: AsyncSession, connection_string_id: int, user_id: int) -> Optional[models.ConnectionString]:
+    result = await db.execute(select(models.ConnectionString).where(
+        models.ConnectionString.id == connection_string_id,
+        models.ConnectionString.user_id == user_id
+    ))
+    return result.scalars().first()
+
+def _hashing_busy(e: auth.PasswordHashingBusy) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
 
 @app.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = (await db.execute(select(models.User).where(models.User.email == user.email))).scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+    db_user = (await db.execute(select(models.User).where(models.User.username == user.username))).scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already taken")
-    
-    hashed_password = auth.get_password_hash(user.password)
+
+    try:
+        hashed_password = await auth.password_hasher.hash(user.password)
+    except auth.PasswordHashingBusy as e:
+        raise _hashing_busy(e)
     db_user = models.User(
         email=user.email,
         username=user.username,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user, ["connection_strings"])
     return db_user
 
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     token_request: schemas.TokenRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = auth.authenticate_user(db, token_request.username, token_request.password)
+    try:
+        user = await auth.authenticate_user(db, token_request.username, token_request.password)
+    except auth.PasswordHashingBusy as e:
+        raise _hashing_busy(e)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -88,101 +154,741 @@ def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/connection-strings/", response_model=schemas.ConnectionString)
-def create_connection_string(
+async def create_connection_string(
     connection_string: schemas.ConnectionStringCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
 ):
     db_connection_string = models.ConnectionString(
         **connection_string.dict(),
         user_id=current_user.id
     )
     db.add(db_connection_string)
-    db.commit()
-    db.refresh(db_connection_string)
+    await db.commit()
     return db_connection_string
 
 @app.get("/connection-strings/", response_model=list[schemas.ConnectionString])
-def read_connection_strings(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+async def read_connection_strings(
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
 ):
-    return db.query(models.ConnectionString).filter(
+    result = await db.execute(select(models.ConnectionString).where(
         models.ConnectionString.user_id == current_user.id
-    ).all()
+    ))
+    return result.scalars().all()
 
 @app.get("/connection-strings/{connection_string_id}", response_model=schemas.ConnectionString)
-def read_connection_string(
+async def read_connection_string(
     connection_string_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
 ):
-    connection_string = db.query(models.ConnectionString).filter(
-        models.ConnectionString.id == connection_string_id,
-        models.ConnectionString.user_id == current_user.id
-    ).first()
+    connection_string = await _get_connection_string(db, connection_string_id, current_user.id)
     if connection_string is None:
         raise HTTPException(status_code=404, detail="Connection string not found")
     return connection_string
 
 @app.delete("/connection-strings/{connection_string_id}")
-def delete_connection_string(
+async def delete_connection_string(
     connection_string_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
 ):
-    connection_string = db.query(models.ConnectionString).filter(
-        models.ConnectionString.id == connection_string_id,
-        models.ConnectionString.user_id == current_user.id
-    ).first()
+    connection_string = await _get_connection_string(db, connection_string_id, current_user.id)
     if connection_string is None:
         raise HTTPException(status_code=404, detail="Connection string not found")
-    db.delete(connection_string)
-    db.commit()
+    await db.delete(connection_string)
+    await db.commit()
     return {"message": "Connection string deleted successfully"}
 
 @app.post("/connect")
-async def connect(request: ConnectionRequest):
+async def connect(
+    request: ConnectionRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
+):
+    db_type, connection_string = request.db_type, request.connection_string
+    if request.connection_string_id is not None:
+        saved = await _get_connection_string(db, request.connection_string_id, current_user.id)
+        if saved is None:
+            raise HTTPException(status_code=404, detail="Connection string not found")
+        db_type, connection_string = saved.database_type, saved.connection_string
+    elif not db_type or not connection_string:
+        raise HTTPException(status_code=400, detail="Provide either connection_string_id or db_type and connection_string")
+
     try:
-        service = db_manager.get_service(request.db_type)
-        await service.connect(request.connection_string)
-        return {"message": "Connected successfully"}
+        connection_id = db_manager.connection_key(db_type, connection_string, request.connection_string_id)
+        await db_manager.connect(current_user.id, connection_id, db_type, connection_string, request.page_size, request.result_cache_ttl)
+        return {"message": "Connected successfully", "connection_id": connection_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/disconnect")
-async def disconnect():
+async def disconnect(
+    request: DisconnectRequest,
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
+):
     try:
-        service = db_manager.get_current_service()
-        await service.disconnect()
+        await db_manager.disconnect(current_user.id, request.connection_id)
+        schema_cache.invalidate((current_user.id, request.connection_id))
+        schema_retriever.invalidate((current_user.id, request.connection_id))
+        semantic_cache.invalidate((current_user.id, request.connection_id))
         return {"message": "Disconnected successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/schema")
-async def get_schema():
+async def get_schema(
+    connection_id: str,
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
+):
+    try:
+        service = await db_manager.get_connection(current_user.id, connection_id)
+        schema = await schema_cache.get((current_user.id, connection_id), service)
+        return {"schema": schema}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/schema/refresh")
+async def refresh_schema(
+    connection_id: str,
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
+):
     try:
-        service = db_manager.get_current_service()
-        schema = await service.get_schema()
+        service = await db_manager.get_connection(current_user.id, connection_id)
+        schema = await schema_cache.refresh((current_user.id, connection_id), service)
         return {"schema": schema}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/schema/cache-stats")
+async def get_schema_cache_stats(current_user: auth.CurrentUser = Depends(auth.get_current_user)):
+    return schema_cache.stats()
+
+@app.get("/query/cache-stats")
+async def get_query_cache_stats(current_user: auth.CurrentUser = Depends(auth.get_current_user)):
+    return {
+        "exact": query_cache.stats(),
+        "semantic": semantic_cache.stats(),
+        "generation": sql_generation_flights.stats(),
+        "results": result_cache.stats()
+    }
+
+async def _prepare_query(request: QueryRequest, current_user: auth.CurrentUser) -> Tuple[Any, List[Dict[str, Any]], RenderedSchema, str, str]:
+    service = await db_manager.get_connection(current_user.id, request.connection_id)
+    with metrics.span("schema"):
+        schema = await schema_cache.get((current_user.id, request.connection_id), service)
+    with metrics.span("retrieval"):
+        schema = schema_retriever.select((current_user.id, request.connection_id), schema, request.natural_language)
+        rendered_schema = ai_service.render_schema(schema)
+    cache_key = query_cache.key(request.natural_language, service.database_type(), rendered_schema.text)
+    schema_scope = query_cache.key("", service.database_type(), rendered_schema.text)
+    return service, schema, rendered_schema, cache_key, schema_scope
+
+def _cached_sql(request: QueryRequest, current_user: auth.CurrentUser, cache_key: str, schema_scope: str) -> Tuple[Optional[str], str, Optional[float]]:
+    sql_query = query_cache.get(cache_key)
+    if sql_query is not None:
+        return sql_query, "hit", None
+    similar = semantic_cache.lookup((current_user.id, request.connection_id), request.natural_language, schema_scope)
+    if similar is not None:
+        return similar[0], "semantic_hit", similar[1]
+    return None, "miss", None
+
+async def _remember_sql(request: QueryRequest, current_user: auth.CurrentUser, cache_key: str, schema_scope: str, sql_query: str) -> None:
+    await query_cache.put(cache_key, sql_query)
+    semantic_cache.put((current_user.id, request.connection_id), request.natural_language, schema_scope, sql_query)
+
+async def _sql_for(request: QueryRequest, current_user: auth.CurrentUser, service, rendered_schema: RenderedSchema, cache_key: str, schema_scope: str) -> Tuple[str, str, Optional[float]]:
+    sql_query, cache_status, similarity = _cached_sql(request, current_user, cache_key, schema_scope)
+    if sql_query is None:
+        # Identical questions arriving together share one LLM call
+        with metrics.span("sql_generation"):
+            sql_query = await sql_generation_flights.do(
+                cache_key,
+                lambda: ai_service.generate_sql_query(request.natural_language, rendered_schema, service.database_type())
+            )
+        await _remember_sql(request, current_user, cache_key, schema_scope, sql_query)
+    return sql_query, cache_status, similarity
+
+# Only values json can't encode natively (dates, decimals, ...) go through FastAPI's encoder
+_json_encoder = json.JSONEncoder(default=jsonable_encoder)
+
+def _to_json(data: Any) -> str:
+    return _json_encoder.encode(data)
+
+def _server_sent_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {_to_json(data)}\n\n"
+
+def _query_metadata(sql_query: str, cache_status: str, similarity: Optional[float], rendered_schema: RenderedSchema) -> Dict[str, Any]:
+    return {
+        "sql_query": sql_query,
+        "cache": cache_status,
+        "cache_similarity": similarity,
+        "schema_tokens": rendered_schema.tokens,
+        "schema_tables_omitted": rendered_schema.omitted_tables
+    }
+
+def _result_format(requested: Optional[str], http_request: Request, allowed: List[str]) -> str:
+    try:
+        return result_formats.negotiate_format(requested, http_request.headers.get("accept"), allowed)
+    except Exception as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+async def _next_rows(batches: AsyncIterator[Tuple[List[str], List[tuple]]]) -> List[tuple]:
+    batch = await anext(batches, None)
+    return batch[1] if batch is not None else []
+
+async def _single_batch(columns: List[str], rows: List[tuple]) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+    yield columns, rows
+
+def _row_payload(columns: List[str], rows: List[tuple], result_format: str) -> List[Any]:
+    if result_format == result_formats.COLUMNAR:
+        return rows
+    return [dict(zip(columns, row)) for row in rows]
+
+def _unique_columns(schema: List[Dict[str, Any]], sql_query: str) -> Set[str]:
+    """Lower-cased name of the single-column primary key of the one table the query reads, if it provably is one.
+
+    A key is only unique in the result of a plain single-table read; joins, grouping and
+    the like make the caller fall back to offset paging.
+    """
+    source = pagination.single_table(sql_query)
+    if source is None:
+        return set()
+    schema_name, table = (part.lower() if part else None for part in source)
+    primary_keys: Dict[Tuple[str, str], List[str]] = {}
+    for row in schema:
+        if row.get("column_key") != "PRI" or str(row["table_name"]).lower() != table:
+            continue
+        if schema_name is not None and str(row.get("schema_name", "")).lower() != schema_name:
+            continue
+        primary_keys.setdefault((str(row.get("schema_name")), str(row["table_name"])), []).append(str(row["column_name"]).lower())
+    # A name shared by tables in several schemas is ambiguous without a qualifier
+    if len(primary_keys) != 1:
+        return set()
+    columns = next(iter(primary_keys.values()))
+    return {columns[0]} if len(columns) == 1 else set()
+
+def _keyset_order(sql_query: str, columns: List[str], unique_columns: Set[str]) -> Optional[Dict[str, Any]]:
+    # Keyset pagination is only exact when the query is ordered by one unique output column
+    if pagination.has_row_limit(sql_query):
+        return None
+    order = pagination.order_key(pagination.split_order_by(sql_query)[1])
+    if order is None or order[0].lower() not in unique_columns:
+        return None
+    column = next((column for column in columns if column.lower() == order[0].lower()), None)
+    return {"key": column, "descending": order[1]} if column else None
+
+def _page_statement(service, sql_query: str, page_size: int, offset: int = 0, keyset: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+    # One row past the page tells whether there is a next one without a COUNT(*)
+    if keyset:
+        return service.keyset_query(sql_query, keyset["key"], keyset["descending"], page_size + 1), {"after": keyset["after"]}
+    return service.page_query(sql_query, page_size + 1, offset), None
+
+def _next_position(sql_query: str, columns: List[str], rows: List[tuple], page_size: int, offset: int = 0, keyset: Optional[Dict[str, Any]] = None, unique_columns: Set[str] = frozenset()) -> Tuple[List[tuple], Optional[Dict[str, Any]]]:
+    """Trims the rows of a page statement to the page and returns them with the position of the next page, if any."""
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    order = keyset or _keyset_order(sql_query, columns, unique_columns)
+    if order:
+        after = rows[-1][columns.index(order["key"])]
+        if isinstance(after, (int, str, dt.date)) and not isinstance(after, bool):
+            return rows, {"key": order["key"], "descending": order["descending"], "after": jsonable_encoder(after)}
+    return rows, {"offset": offset + page_size}
+
+async def _read_all(batches: AsyncIterator[Tuple[List[str], List[tuple]]]) -> Tuple[List[str], List[tuple]]:
+    columns, rows = [], []
+    async for columns, batch in batches:
+        rows.extend(batch)
+    return columns, rows
+
+async def _cached_result(scope: Tuple[int, str], cache_key: str, ttl: float, metadata: Dict[str, Any]) -> Optional[CachedResult]:
+    """Looks a statement up in the result cache and reports `result_cache` (hit, miss or off) and `result_age` in metadata."""
+    if ttl <= 0:
+        metadata.update(result_cache="off", result_age=None)
+        return None
+    with metrics.span("result_cache"):
+        cached = await result_cache.get(cache_key, schema_cache.table_versions(scope))
+    metadata.update(result_cache="hit" if cached else "miss", result_age=round(cached.age(), 3) if cached else None)
+    return cached
+
+async def _caching(scope: Tuple[int, str], cache_key: str, statement: str, ttl: float, batches: AsyncIterator[Tuple[List[str], List[tuple]]]) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+    """Passes batches through and caches the result once it is read to the end, unless it outgrows RESULT_CACHE_MAX_ROWS."""
+    columns, rows = [], []
+    try:
+        async for columns, batch in batches:
+            if rows is not None:
+                rows.extend(batch)
+                if len(rows) > result_cache.max_rows:
+                    rows = None
+            yield columns, batch
+        if rows is not None:
+            await result_cache.put(cache_key, statement, columns, rows, ttl, schema_cache.table_versions(scope))
+    finally:
+        await batches.aclose()
+
+def _page_token(current_user: auth.CurrentUser, connection_id: str, sql_query: str, page_size: int, position: Dict[str, Any]) -> str:
+    # Signed rather than stored so any worker can serve the next page; there is no
+    # "sub" claim, so the token can never pass as an access token
+    return jwt.encode({
+        "user_id": current_user.id,
+        "connection_id": connection_id,
+        "sql_query": sql_query,
+        "page_size": page_size,
+        **position,
+        "exp": dt.datetime.utcnow() + timedelta(seconds=QUERY_PAGE_TOKEN_TTL)
+    }, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+
+def _sql_digest(sql_query: str) -> str:
+    return hashlib.sha256(sql_query.encode()).hexdigest()
+
+def _confirmation_token(current_user: auth.CurrentUser, connection_id: str, sql_query: str) -> str:
+    # Bound to the exact SQL, so a confirmation never carries over to a regenerated query
+    return jwt.encode({
+        "user_id": current_user.id,
+        "connection_id": connection_id,
+        "confirm_sql": _sql_digest(sql_query),
+        "exp": dt.datetime.utcnow() + timedelta(seconds=QUERY_PAGE_TOKEN_TTL)
+    }, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+
+def _is_confirmed(token: Optional[str], current_user: auth.CurrentUser, connection_id: str, sql_query: str) -> bool:
+    if not token:
+        return False
+    try:
+        claims = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    except JWTError:
+        return False
+    return (
+        claims.get("user_id") == current_user.id
+        and claims.get("connection_id") == connection_id
+        and claims.get("confirm_sql") == _sql_digest(sql_query)
+    )
+
+def _rejection(e: QueryRejected, current_user: auth.CurrentUser, connection_id: str, sql_query: str) -> Dict[str, Any]:
+    """Body of a cost gate refusal; a confirmation_token is only offered when confirming is allowed."""
+    detail = {"message": str(e), "sql_query": sql_query, "estimate": e.estimate}
+    if isinstance(e, ConfirmationRequired):
+        detail["confirmation_token"] = _confirmation_token(current_user, connection_id, sql_query)
+    return detail
+
+def _rejection_status(e: QueryRejected) -> int:
+    return status.HTTP_409_CONFLICT if isinstance(e, ConfirmationRequired) else status.HTTP_422_UNPROCESSABLE_ENTITY
+
+def _read_page_token(token: str, current_user: auth.CurrentUser, connection_id: str) -> Dict[str, Any]:
+    try:
+        page = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    except JWTError:
+        raise Exception("Invalid or expired continuation token")
+    if page.get("user_id") != current_user.id or page.get("connection_id") != connection_id:
+        raise Exception("Continuation token does not belong to this connection")
+    return page
+
+async def _result_batches(
+    current_user: auth.CurrentUser,
+    connection_id: str,
+    service,
+    sql_query: str,
+    metadata: Dict[str, Any],
+    unique_columns: Set[str] = frozenset(),
+    page: Optional[Dict[str, Any]] = None,
+    confirmed: bool = False,
+    query_id: Optional[str] = None
+) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+    """Row batches for a query, limited to one page when paging applies.
+
+    Paging applies to SELECT statements when the connection's page size is positive;
+    metadata then gets `page_size` and a `next_page` continuation token (None on the
+    last page). Otherwise the result is streamed whole from the cursor. The statement
+    that runs first goes through the connection's cost gate, whose estimate is put in
+    metadata as `estimate`; continuation pages were accepted with the first one.
+
+    SELECT results are served from and stored in the result cache when the connection
+    has a result cache TTL; metadata gets `result_cache` and `result_age` either way.
+    Cache hits skip the cost gate as they don't reach the database.
+    """
+    page_size = page["page_size"] if page else service.default_page_size()
+    paged = page_size > 0 and pagination.is_select(sql_query)
+    if paged:
+        query = pagination.strip_statement(sql_query)
+        offset = page.get("offset", 0) if page else 0
+        keyset = page if page and "key" in page else None
+        # The paged statement is what runs, and a LIMIT can make a costly query cheap
+        statement, params = _page_statement(service, query, page_size, offset, keyset)
+    else:
+        statement, params = sql_query, None
+
+    scope = (current_user.id, connection_id)
+    ttl = service.default_result_cache_ttl() if pagination.is_select(sql_query) else 0
+    cache_key = result_cache.key(scope, statement, params)
+    cached = await _cached_result(scope, cache_key, ttl, metadata)
+    if page is None:
+        metadata["estimate"] = await service.check_cost(statement, params, confirmed=confirmed) if cached is None else None
+
+    if not paged:
+        if cached is not None:
+            return _single_batch(cached.columns, cached.rows)
+        batches = service.stream_rows(statement, batch_size=QUERY_STREAM_CHUNK_ROWS, timeout=service.statement_timeout(), query_id=query_id)
+        return _caching(scope, cache_key, statement, ttl, batches) if ttl > 0 else batches
+
+    if cached is not None:
+        columns, rows = cached.columns, cached.rows
+    else:
+        batches = service.stream_rows(statement, params, timeout=service.statement_timeout(), query_id=query_id)
+        columns, rows = await _read_all(_caching(scope, cache_key, statement, ttl, batches) if ttl > 0 else batches)
+    rows, position = _next_position(query, columns, rows, page_size, offset, keyset, unique_columns)
+    metadata["page_size"] = page_size
+    metadata["next_page"] = _page_token(current_user, connection_id, sql_query, page_size, position) if position else None
+    return _single_batch(columns, rows)
+
+def _register_query(current_user: auth.CurrentUser, connection_id: str, query_id: Optional[str]) -> RunningQuery:
+    try:
+        return query_registry.register(current_user.id, connection_id, query_id)
+    except Exception as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+async def _tracked(running: RunningQuery, batches: AsyncIterator[Tuple[List[str], List[tuple]]]) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+    """Passes batches through and ends the query's registration once they are exhausted or closed."""
+    try:
+        async for batch in batches:
+            yield batch
+    finally:
+        query_registry.unregister(running)
+        await batches.aclose()
+
+async def _until_disconnected(http_request: Request, work: Awaitable[Any]) -> Any:
+    """Awaits work, cancelling it, and with it any statement it runs, if the client goes away first.
+
+    Streaming responses get this from Starlette; buffered ones would otherwise run to
+    completion for nobody.
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while not task.done():
+            await asyncio.wait([task], timeout=QUERY_DISCONNECT_POLL)
+            if not task.done() and await http_request.is_disconnected():
+                raise Exception("Client disconnected")
+        return task.result()
+    finally:
+        task.cancel()
+
+async def _result_response(result_format: str, metadata: Dict[str, Any], batches: AsyncIterator[Tuple[List[str], List[tuple]]]):
+    """Renders row batches in the negotiated format; the first batch is read before responding so SQL errors are still a 400."""
+    columns, first_rows = await anext(batches)
+    if result_format == result_formats.RECORDS:
+        with metrics.span("serialize"):
+            results = _row_payload(columns, first_rows, result_format)
+        async for _, rows in batches:
+            with metrics.span("serialize"):
+                results.extend(_row_payload(columns, rows, result_format))
+        # Encoded here rather than by FastAPI so that the time shows up as a stage
+        with metrics.span("serialize"):
+            return Response(_to_json({**metadata, "results": results}), media_type="application/json")
+
+    types = result_formats.column_types(columns, first_rows)
+    if result_format == result_formats.ARROW:
+        schema = result_formats.arrow_schema(columns, types, first_rows, metadata)
+
+    async def columnar_body() -> AsyncIterator[str]:
+        yield _to_json({**metadata, "columns": columns, "types": types})[:-1] + ', "rows": ['
+        rows, separator = first_rows, ""
+        try:
+            while rows:
+                with metrics.span("serialize"):
+                    chunk = separator + _to_json(rows)[1:-1]
+                yield chunk
+                separator = ","
+                rows = await _next_rows(batches)
+            yield "]}"
+        except Exception as e:
+            yield f"], \"error\": {_to_json(str(e))}}}"
+        finally:
+            await batches.aclose()
+
+    async def arrow_body() -> AsyncIterator[bytes]:
+        # Schema message, one record batch message per cursor batch, then the end marker.
+        # An error mid-stream aborts the response, so clients see a truncated stream
+        try:
+            yield schema.serialize().to_pybytes()
+            rows = first_rows
+            while rows:
+                with metrics.span("serialize"):
+                    chunk = result_formats.arrow_batch(schema, rows).serialize().to_pybytes()
+                yield chunk
+                rows = await _next_rows(batches)
+            yield result_formats.ARROW_STREAM_END
+        finally:
+            await batches.aclose()
+
+    body = columnar_body() if result_format == result_formats.COLUMNAR else arrow_body()
+    return StreamingResponse(body, media_type=result_formats.MEDIA_TYPES[result_format])
+
 @app.post("/query")
-async def execute_query(request: QueryRequest):
-    try:
-        service = db_manager.get_current_service()
-        schema = await service.get_schema()
-        sql_query = await ai_service.generate_sql_query(request.natural_language, schema, service.database_type)
-        results = await service.execute_query(sql_query)
-        
-        return {
-            "sql_query": sql_query,
-            "results": results
-        }
+async def execute_query(
+    request: QueryRequest,
+    http_request: Request,
+    result_format: Optional[str] = Query(None, alias="format"),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
+):
+    """Runs a question and returns the SQL with the first page of its result.
+
+    The result format is chosen by the `format` query parameter or the Accept header:
+    `records` (default, a list of row objects), `columnar` (column names and inferred
+    types once, rows as arrays) or `arrow` (an Arrow IPC stream whose schema metadata
+    holds the SQL and cache fields). Columnar and Arrow are written straight from
+    cursor batches. Pass `next_page` to /query/page for the following page.
+
+    The response carries the `query_id` under which the query can be cancelled while it
+    runs; clients that want to cancel before the response arrives pass their own. A
+    client disconnecting cancels the query as well.
+
+    When the cost gate is configured the planner's estimate is returned as `estimate`.
+    Queries over a DB_MAX_* limit get a 422; over a DB_CONFIRM_* threshold a 409 whose
+    `confirmation_token`, sent back with the same question, runs the query anyway.
+    """
+    result_format = _result_format(result_format, http_request, [result_formats.RECORDS, result_formats.COLUMNAR, result_formats.ARROW])
+    running = _register_query(current_user, request.connection_id, request.query_id)
+
+    async def run():
+        service, schema, rendered_schema, cache_key, schema_scope = await _prepare_query(request, current_user)
+        running.check()
+        sql_query, cache_status, similarity = await _sql_for(request, current_user, service, rendered_schema, cache_key, schema_scope)
+        running.begin(service, sql_query)
+        metadata = {"query_id": running.query_id, **_query_metadata(sql_query, cache_status, similarity, rendered_schema)}
+        confirmed = _is_confirmed(request.confirmation_token, current_user, request.connection_id, sql_query)
+        batches = await _result_batches(
+            current_user, request.connection_id, service, sql_query, metadata, _unique_columns(schema, sql_query),
+            confirmed=confirmed, query_id=running.query_id
+        )
+        return await _result_response(result_format, metadata, _tracked(running, batches))
+
+    try:
+        return await _until_disconnected(http_request, run())
+    except QueryRejected as e:
+        query_registry.unregister(running)
+        raise HTTPException(status_code=_rejection_status(e), detail=_rejection(e, current_user, request.connection_id, running.sql_query))
+    except Exception as e:
+        query_registry.unregister(running)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/query/page")
+async def execute_query_page(
+    request: PageRequest,
+    http_request: Request,
+    result_format: Optional[str] = Query(None, alias="format"),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
+):
+    """Returns the page of a previous /query result named by its continuation token, in any /query format."""
+    result_format = _result_format(result_format, http_request, [result_formats.RECORDS, result_formats.COLUMNAR, result_formats.ARROW])
+    running = _register_query(current_user, request.connection_id, request.query_id)
+
+    async def run():
+        page = _read_page_token(request.continuation_token, current_user, request.connection_id)
+        service = await db_manager.get_connection(current_user.id, request.connection_id)
+        running.begin(service, page["sql_query"])
+        metadata = {"query_id": running.query_id, "sql_query": page["sql_query"]}
+        batches = await _result_batches(current_user, request.connection_id, service, page["sql_query"], metadata, page=page, query_id=running.query_id)
+        return await _result_response(result_format, metadata, _tracked(running, batches))
+
+    try:
+        return await _until_disconnected(http_request, run())
     except Exception as e:
+        query_registry.unregister(running)
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/query/stream")
+async def execute_query_stream(
+    request: QueryRequest,
+    http_request: Request,
+    result_format: Optional[str] = Query(None, alias="format"),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
+):
+    """Server-sent events variant of /query.
+
+    Emits `token` events with raw model output while SQL is generated (none on a cache
+    hit, or when /query or another stream is already generating the same query), one
+    `sql` event with the cleaned query, `rows` events of up to QUERY_STREAM_CHUNK_ROWS
+    rows, then `done` with the row count and, when the result is paged, `page_size`
+    and `next_page`. With the `columnar` format a `columns` event with names and types
+    precedes the rows, which are then arrays. Failures after the stream has started
+    arrive as an `error` event. A query stopped by the cost gate ends with a `confirm`
+    event carrying a `confirmation_token`, or an `error` event with the estimate when
+    it is over a hard limit. The first event, `query`, carries the `query_id` for
+    /query/{query_id}/cancel.
+    """
+    result_format = _result_format(result_format, http_request, [result_formats.RECORDS, result_formats.COLUMNAR])
+    running = _register_query(current_user, request.connection_id, request.query_id)
+    try:
+        service, schema, rendered_schema, cache_key, schema_scope = await _prepare_query(request, current_user)
+    except Exception as e:
+        query_registry.unregister(running)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events() -> AsyncIterator[str]:
+        batches = None
+        try:
+            yield _server_sent_event("query", {"query_id": running.query_id})
+            running.check()
+            sql_query, cache_status, similarity = _cached_sql(request, current_user, cache_key, schema_scope)
+            if sql_query is None:
+                tokens: asyncio.Queue = asyncio.Queue()
+
+                async def generate() -> str:
+                    pieces = []
+                    try:
+                        async for piece in ai_service.stream_sql_query(request.natural_language, rendered_schema, service.database_type()):
+                            pieces.append(piece)
+                            tokens.put_nowait(piece)
+                    finally:
+                        tokens.put_nowait(None)
+                    return ai_service._clean_sql_query("".join(pieces))
+
+                # Registered under the same key as /query, so identical questions share one
+                # LLM call whichever endpoint asks first; only the one that started it sees tokens
+                generation, leader = sql_generation_flights.start(cache_key, generate)
+                while leader and (piece := await tokens.get()) is not None:
+                    yield _server_sent_event("token", {"text": piece})
+                sql_query = await asyncio.shield(generation)
+                await _remember_sql(request, current_user, cache_key, schema_scope, sql_query)
+            running.begin(service, sql_query)
+            yield _server_sent_event("sql", _query_metadata(sql_query, cache_status, similarity, rendered_schema))
+
+            paging: Dict[str, Any] = {}
+            confirmed = _is_confirmed(request.confirmation_token, current_user, request.connection_id, sql_query)
+            batches = await _result_batches(
+                current_user, request.connection_id, service, sql_query, paging, _unique_columns(schema, sql_query),
+                confirmed=confirmed, query_id=running.query_id
+            )
+            row_count = 0
+            async for columns, rows in batches:
+                if result_format == result_formats.COLUMNAR and row_count == 0:
+                    yield _server_sent_event("columns", {"columns": columns, "types": result_formats.column_types(columns, rows)})
+                for start in range(0, len(rows), QUERY_STREAM_CHUNK_ROWS):
+                    chunk = rows[start:start + QUERY_STREAM_CHUNK_ROWS]
+                    row_count += len(chunk)
+                    with metrics.span("serialize"):
+                        event = _server_sent_event("rows", {"rows": _row_payload(columns, chunk, result_format)})
+                    yield event
+            yield _server_sent_event("done", {"row_count": row_count, **paging})
+        except QueryRejected as e:
+            detail = _rejection(e, current_user, request.connection_id, running.sql_query)
+            if isinstance(e, ConfirmationRequired):
+                yield _server_sent_event("confirm", detail)
+            else:
+                message = detail.pop("message")
+                yield _server_sent_event("error", {"detail": message, **detail})
+        except Exception as e:
+            yield _server_sent_event("error", {"detail": str(e)})
+        finally:
+            # Also reached when Starlette cancels the stream because the client left
+            query_registry.unregister(running)
+            if batches is not None:
+                await batches.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/ndjson")
+async def execute_query_ndjson(
+    request: QueryRequest,
+    http_request: Request,
+    result_format: Optional[str] = Query(None, alias="format"),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user)
+):
+    """Streams the whole result as newline-delimited JSON read through a server-side cursor.
+
+    Meant for exports, so it is not paged. The first line holds the SQL and cache
+    fields, every following line is one row: an object, or an array with the
+    `columnar` format, whose first line then also carries the column names and types.
+    Memory use stays at about one batch of QUERY_STREAM_CHUNK_ROWS rows regardless of
+    the result size. Errors after the first batch arrive as a final {"error": ...} line.
+    The cost gate, statement timeout and cancellation apply as on /query; the header
+    line carries the `query_id`.
+    """
+    result_format = _result_format(result_format, http_request, [result_formats.RECORDS, result_formats.COLUMNAR])
+    running = _register_query(current_user, request.connection_id, request.query_id)
+
+    async def start():
+        service, schema, rendered_schema, cache_key, schema_scope = await _prepare_query(request, current_user)
+        running.check()
+        sql_query, cache_status, similarity = await _sql_for(request, current_user, service, rendered_schema, cache_key, schema_scope)
+        running.begin(service, sql_query)
+        confirmed = _is_confirmed(request.confirmation_token, current_user, request.connection_id, sql_query)
+        estimate = await service.check_cost(sql_query, confirmed=confirmed)
+        running.check()
+        batches = _tracked(running, service.stream_rows(
+            sql_query, batch_size=QUERY_STREAM_CHUNK_ROWS, timeout=service.statement_timeout(), query_id=running.query_id
+        ))
+        # Fetch the first batch before responding so that SQL errors are still a 400
+        columns, first_rows = await anext(batches)
+        header = {"query_id": running.query_id, **_query_metadata(sql_query, cache_status, similarity, rendered_schema), "estimate": estimate}
+        return header, batches, columns, first_rows
+
+    try:
+        header, batches, columns, first_rows = await _until_disconnected(http_request, start())
+    except QueryRejected as e:
+        query_registry.unregister(running)
+        raise HTTPException(status_code=_rejection_status(e), detail=_rejection(e, current_user, request.connection_id, running.sql_query))
+    except Exception as e:
+        query_registry.unregister(running)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def lines() -> AsyncIterator[str]:
+        if result_format == result_formats.COLUMNAR:
+            header.update(columns=columns, types=result_formats.column_types(columns, first_rows))
+        try:
+            yield _to_json(header) + "\n"
+            rows = first_rows
+            while rows:
+                with metrics.span("serialize"):
+                    chunk = "".join(_to_json(row) + "\n" for row in _row_payload(columns, rows, result_format))
+                yield chunk
+                rows = await _next_rows(batches)
+        except Exception as e:
+            yield _to_json({"error": str(e)}) + "\n"
+        finally:
+            await batches.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/query/running")
+async def list_running_queries(current_user: auth.CurrentUser = Depends(auth.get_current_user)):
+    """The current user's in-flight queries, oldest first."""
+    return {"queries": [running.describe() for running in query_registry.running(current_user.id)]}
+
+@app.post("/query/{query_id}/cancel")
+async def cancel_query(query_id: str, current_user: auth.CurrentUser = Depends(auth.get_current_user)):
+    """Cancels an in-flight query with the database's native cancel.
+
+    The statement is stopped on the server and its connection returns to the pool; the
+    request that ran it fails with the cancellation error. A query still generating its
+    SQL is stopped before it reaches the database.
+    """
+    try:
+        cancelled = await query_registry.cancel(current_user.id, query_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="No running query with this id")
+    return {"query_id": query_id, "cancelled": True}
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus histograms of request, stage, pool wait, row and token figures."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("shutdown")
+async def dispose_connections():
+    await db_manager.dispose_all()
+    await ai_service.close()
+    auth.password_hasher.shutdown()
+    await engine.dispose()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
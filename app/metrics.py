@@ -0,0 +1,128 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+class Histogram:
+    """Prometheus histogram with fixed buckets, one series per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        # Label values -> [count per bucket (the last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labelvalues, counts, total in series:
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labelvalues)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = ",".join(labels + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+REQUEST_SECONDS = Histogram("dbchat_request_duration_seconds", "Time to handle an HTTP request, including streamed bodies.", LATENCY_BUCKETS, ("method", "endpoint", "status"))
+STAGE_SECONDS = Histogram("dbchat_stage_duration_seconds", "Time spent per request in each stage of query handling.", LATENCY_BUCKETS, ("stage",))
+POOL_WAIT_SECONDS = Histogram("dbchat_db_pool_wait_seconds", "Time from asking for a database connection to holding one.", LATENCY_BUCKETS, ("db_type",))
+RESULT_ROWS = Histogram("dbchat_db_result_rows", "Rows read per generated statement.", COUNT_BUCKETS, ("db_type",))
+PROMPT_TOKENS = Histogram("dbchat_llm_prompt_tokens", "Prompt tokens per SQL generation, as reported by the model or estimated.", TOKEN_BUCKETS, ("provider",))
+COMPLETION_TOKENS = Histogram("dbchat_llm_completion_tokens", "Generated tokens per SQL generation, when the model reports them.", TOKEN_BUCKETS, ("provider",))
+HISTOGRAMS = [REQUEST_SECONDS, STAGE_SECONDS, POOL_WAIT_SECONDS, RESULT_ROWS, PROMPT_TOKENS, COMPLETION_TOKENS]
+
+# Stage name -> seconds spent in it by the current request, set by MetricsMiddleware
+_stage_totals: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stage_totals", default=None)
+
+def record(stage: str, seconds: float) -> None:
+    """Adds seconds to a stage of the current request; outside a request it is observed right away."""
+    totals = _stage_totals.get()
+    if totals is None:
+        STAGE_SECONDS.observe(seconds, stage)
+    else:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def render() -> str:
+    return "\n".join(line for histogram in HISTOGRAMS for line in histogram.render()) + "\n"
+
+def _server_timing(totals: Dict[str, float], elapsed: float) -> bytes:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()]
+    return ", ".join(entries + [f"total;dur={elapsed * 1000:.1f}"]).encode()
+
+class MetricsMiddleware:
+    """Times every HTTP request and collects the stage spans recorded while it runs.
+
+    Stage totals are observed once per request when the response is finished, so a
+    stage entered per batch still counts as one observation. With SERVER_TIMING on,
+    the stages completed before the response starts are sent in a Server-Timing
+    header; for streamed responses that leaves out the rows that follow.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        totals: Dict[str, float] = {}
+        token = _stage_totals.set(totals)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if SERVER_TIMING:
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", _server_timing(totals, time.perf_counter() - start))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _stage_totals.reset(token)
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], endpoint, str(status_code))
+            for stage, seconds in totals.items():
+                STAGE_SECONDS.observe(seconds, stage)
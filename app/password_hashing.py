@@ -0,0 +1,66 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from passlib.context import CryptContext
+
+from . import metrics
+
+T = TypeVar("T")
+
+class PasswordHashingBusy(Exception):
+    """Raised instead of queueing when the password hashing pool is full."""
+
+class PasswordHasher:
+    """Runs a CryptContext's hashing and verification in a dedicated, bounded thread pool.
+
+    bcrypt releases the GIL while it works, so threads use every core without the
+    pickling of a process pool, and a login storm can only occupy these workers instead
+    of the threadpool every sync endpoint shares. At most max_queue calls wait for a
+    worker; more raise PasswordHashingBusy right away so callers can answer 503.
+    """
+
+    def __init__(self, context: CryptContext, workers: Optional[int] = None, max_queue: Optional[int] = None):
+        self.context = context
+        self.workers = workers or int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("PASSWORD_HASH_MAX_QUEUE", str(self.workers * 8)))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PasswordHashingBusy("Too many password checks in progress, try again shortly")
+            self._pending += 1
+        # Released when the work finishes, not when the caller stops waiting for it
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._release)
+        with metrics.span("password_hash"):
+            return await asyncio.wrap_future(future)
+
+    def _release(self, future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Whether password matches, and a new hash when the stored one uses outdated settings."""
+        return await self._run(self.context.verify_and_update, password, hashed_password)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,73 @@
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+class RunningQuery:
+    def __init__(self, query_id: str, user_id: int, connection_id: str):
+        self.query_id = query_id
+        self.user_id = user_id
+        self.connection_id = connection_id
+        self.service: Any = None
+        self.sql_query: Optional[str] = None
+        self.started = time.time()
+        self.cancelled = False
+
+    def check(self) -> None:
+        """Raises if the query was cancelled; called between the stages of a request."""
+        if self.cancelled:
+            raise Exception("Query was cancelled")
+
+    def begin(self, service: Any, sql_query: str) -> None:
+        """Called once the SQL is known, right before it runs; a query cancelled earlier never starts."""
+        self.check()
+        self.service = service
+        self.sql_query = sql_query
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "query_id": self.query_id,
+            "connection_id": self.connection_id,
+            "sql_query": self.sql_query,
+            "started": self.started,
+            "running_for": time.time() - self.started
+        }
+
+class QueryRegistry:
+    """In-flight query executions per user, so they can be listed and cancelled.
+
+    An entry lives from the moment a request starts (including SQL generation) until its
+    response is finished. Cancelling marks the entry and asks the connection's service to
+    stop the statement with the dialect's native cancel.
+    """
+
+    def __init__(self):
+        self._queries: Dict[Tuple[int, str], RunningQuery] = {}
+
+    def register(self, user_id: int, connection_id: str, query_id: Optional[str] = None) -> RunningQuery:
+        # Clients may pick the id up front, to cancel a request whose response hasn't arrived yet
+        query_id = query_id or uuid.uuid4().hex
+        if (user_id, query_id) in self._queries:
+            raise Exception(f"Query {query_id} is already running")
+        running = RunningQuery(query_id, user_id, connection_id)
+        self._queries[(user_id, query_id)] = running
+        return running
+
+    def unregister(self, running: RunningQuery) -> None:
+        if self._queries.get((running.user_id, running.query_id)) is running:
+            del self._queries[(running.user_id, running.query_id)]
+        if running.service is not None:
+            # A cancel recorded for a statement that never ran mustn't stop a later query reusing the id
+            running.service.forget_cancel(running.query_id)
+
+    def running(self, user_id: int) -> List[RunningQuery]:
+        return [running for (owner, _), running in self._queries.items() if owner == user_id]
+
+    async def cancel(self, user_id: int, query_id: str) -> bool:
+        running = self._queries.get((user_id, query_id))
+        if running is None:
+            return False
+        running.cancelled = True
+        if running.service is not None:
+            # Recorded by the service even when the statement hasn't started yet
+            await running.service.cancel(query_id)
+        return True
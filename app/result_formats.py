@@ -0,0 +1,132 @@
+import datetime
+import decimal
+import json
+from typing import Any, List, Optional, Sequence
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+RECORDS = "records"
+COLUMNAR = "columnar"
+ARROW = "arrow"
+
+MEDIA_TYPES = {
+    RECORDS: "application/json",
+    COLUMNAR: "application/vnd.dbchat.columnar+json",
+    ARROW: "application/vnd.apache.arrow.stream",
+}
+
+# End-of-stream marker of the Arrow IPC streaming format
+ARROW_STREAM_END = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+def negotiate_format(requested: Optional[str], accept: Optional[str], allowed: Sequence[str]) -> str:
+    """Picks the result format from the `format` query parameter, else the Accept header, else records."""
+    if requested:
+        if requested not in allowed:
+            raise Exception(f"Unsupported result format '{requested}', expected one of: {', '.join(allowed)}")
+        return requested
+    for media_range in (accept or "").split(","):
+        media_type = media_range.split(";")[0].strip()
+        for result_format in allowed:
+            if MEDIA_TYPES[result_format] == media_type:
+                return result_format
+    return RECORDS
+
+def value_type(value: Any) -> str:
+    # bool before int and datetime before date: both are subclasses
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, (float, decimal.Decimal)):
+        return "number"
+    if isinstance(value, datetime.datetime):
+        return "datetime"
+    if isinstance(value, datetime.date):
+        return "date"
+    if isinstance(value, datetime.time):
+        return "time"
+    if isinstance(value, datetime.timedelta):
+        return "duration"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "binary"
+    return "string"
+
+def column_types(columns: List[str], rows: List[tuple]) -> List[str]:
+    """Infers each column's type from its non-null values in the given rows.
+
+    A column mixing integers and other numbers (Oracle NUMBER, SQLite) is a number, any
+    other mix a string, as is a column with only nulls.
+    """
+    types = []
+    for index in range(len(columns)):
+        seen = {value_type(row[index]) for row in rows if row[index] is not None}
+        if len(seen) == 1:
+            types.append(seen.pop())
+        elif seen == {"integer", "number"}:
+            types.append("number")
+        else:
+            types.append("string")
+    return types
+
+def arrow_type(column_type: str, timezone_aware: bool = False):
+    return {
+        "boolean": pa.bool_(),
+        "integer": pa.int64(),
+        "number": pa.float64(),
+        "datetime": pa.timestamp("us", tz="UTC" if timezone_aware else None),
+        "date": pa.date32(),
+        "time": pa.time64("us"),
+        "duration": pa.duration("us"),
+        "binary": pa.binary(),
+    }.get(column_type, pa.string())
+
+def arrow_schema(columns: List[str], types: List[str], rows: List[tuple], metadata: dict):
+    if pa is None:
+        raise Exception("Arrow results require the pyarrow package")
+    fields = []
+    for index, (column, column_type) in enumerate(zip(columns, types)):
+        sample = next((row[index] for row in rows if row[index] is not None), None)
+        timezone_aware = isinstance(sample, datetime.datetime) and sample.tzinfo is not None
+        fields.append(pa.field(column, arrow_type(column_type, timezone_aware)))
+    return pa.schema(fields, metadata={key: value if isinstance(value, str) else json.dumps(value) for key, value in metadata.items()})
+
+def _as_integer(value: Any) -> Optional[int]:
+    if isinstance(value, (int, float, decimal.Decimal)) and value == value and value % 1 == 0 and -2**63 <= value < 2**63:
+        return int(value)
+    return None
+
+def _as_float(value: Any) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float, decimal.Decimal)) else None
+
+def arrow_batch(schema, rows: List[tuple]):
+    """Encodes rows with the schema inferred from the first batch.
+
+    The schema can't change once the stream has started, so a later value that doesn't
+    fit its column's type (2.5 in an integer column) is sent as null rather than
+    cutting the response off.
+    """
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in rows]
+        if pa.types.is_integer(field.type):
+            values = [_as_integer(value) if value is not None else None for value in values]
+        elif pa.types.is_floating(field.type):
+            values = [_as_float(value) if value is not None else None for value in values]
+        elif pa.types.is_string(field.type):
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        try:
+            array = pa.array(values, type=field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+            array = pa.array([_fitting(value, field.type) for value in values], type=field.type)
+        arrays.append(array)
+    return pa.record_batch(arrays, schema=schema)
+
+def _fitting(value: Any, arrow_type) -> Any:
+    try:
+        pa.scalar(value, type=arrow_type)
+        return value
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        return None
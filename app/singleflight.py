@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """Coalesces identical concurrent calls into one in-flight task.
+
+    The first caller for a key starts the work; callers arriving while it runs await the
+    same task and receive its result or its exception. The work runs as its own task, so
+    a caller that is cancelled (e.g. a disconnected client) does not cancel it for the
+    others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        task, _ = self.start(key, factory)
+        return await asyncio.shield(task)
+
+    def start(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> Tuple["asyncio.Future[T]", bool]:
+        """The task for key, started from factory unless one is in flight, and whether this call started it.
+
+        For callers that consume side effects of the work as it runs (streamed output)
+        when they lead, and only its result otherwise. Await the task through
+        asyncio.shield, as do() does.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task, False
+        task = asyncio.ensure_future(factory())
+        self._calls[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        self.started += 1
+        return task, True
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls)
+        }
@@ -1,7 +1,27 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
-from sqlalchemy import create_engine, text
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, Optional, Callable, Set, Tuple
+import asyncio
+import contextvars
+import functools
+import hashlib
+import os
+import time
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
+from . import pagination
+from .. import metrics
+
+class QueryRejected(Exception):
+    """Raised by the cost gate when a query's EXPLAIN estimate is over a DB_MAX_* limit."""
+    def __init__(self, message: str, estimate: Dict[str, Optional[float]]):
+        super().__init__(message)
+        self.estimate = estimate
+
+class ConfirmationRequired(QueryRejected):
+    """Raised by the cost gate when a query's estimate is over a DB_CONFIRM_* threshold and it was not confirmed."""
+    pass
 
 class DatabaseService(ABC):
     @property
@@ -19,37 +39,391 @@ class DatabaseService(ABC):
         pass
     
     @abstractmethod
-    async def execute_query(self, query: str) -> List[Dict[str, Any]]:
+    async def execute_query(self, query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         pass
     
     @abstractmethod
-    async def get_schema(self) -> List[Dict[str, Any]]:
+    def stream_rows(self, query: str, params: Optional[Dict[str, Any]] = None, batch_size: Optional[int] = None, timeout: Optional[int] = None, query_id: Optional[str] = None) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+        """Yields (column names, row tuples) batches; an empty result yields one batch without rows.
+
+        A timeout in seconds makes the database cancel the statement once it runs longer.
+        With a query_id the statement can be stopped from elsewhere with cancel().
+        """
+        pass
+
+    @abstractmethod
+    async def cancel(self, query_id: str) -> bool:
+        """Stops the statement running for query_id; False if there is none."""
+        pass
+
+    @abstractmethod
+    def stream_query(self, query: str, params: Optional[Dict[str, Any]] = None, batch_size: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yields the result rows in batches without holding the whole result in memory."""
+        pass
+
+    @abstractmethod
+    async def explain(self, query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Optional[float]]]:
+        """The planner's estimated {"cost", "rows"} for query without running it, None if the dialect can't tell."""
+        pass
+
+    @abstractmethod
+    async def check_cost(self, query: str, params: Optional[Dict[str, Any]] = None, confirmed: bool = False) -> Optional[Dict[str, Optional[float]]]:
+        """Pre-flight cost gate: raises QueryRejected or ConfirmationRequired, else returns the estimate."""
+        pass
+
+    @abstractmethod
+    def page_query(self, query: str, limit: int, offset: int = 0) -> str:
+        """Wraps a SELECT so that it returns at most limit rows starting at offset."""
+        pass
+
+    @abstractmethod
+    def keyset_query(self, query: str, column: str, descending: bool, limit: int) -> str:
+        """Rewrites a SELECT ordered by column to return the next limit rows after the :after parameter."""
+        pass
+
+    @abstractmethod
+    async def get_schema(self, tables: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Returns one row per column, restricted to the given table names when provided."""
+        pass
+
+    @abstractmethod
+    async def get_schema_fingerprint(self) -> Optional[str]:
+        """Cheap probe whose value changes whenever the schema returned by get_schema may have changed."""
+        pass
+
+    @abstractmethod
+    async def get_table_versions(self) -> Optional[Dict[str, str]]:
+        """Maps each table name to a value that changes whenever that table's DDL changes."""
         pass
 
 class BaseDatabaseService(DatabaseService):
+    # Catalog query returning object counts / DDL timestamps, see get_schema_fingerprint
+    schema_fingerprint_query: Optional[str] = None
+    # Catalog query returning (table_name, version) rows, see get_table_versions
+    table_versions_query: Optional[str] = None
+
     def __init__(self):
         self._engine: Engine = None
         self._connection_string: str = None
+        self._executor: ThreadPoolExecutor = None
+        # Unpooled engine for cancel statements, which can't wait for a pool the
+        # statements they stop may be exhausting
+        self._cancel_engine: Engine = None
+        # Cancel handles of statements started with a query_id, see cancel()
+        self._running: Dict[str, Any] = {}
+        self._cancelled: Set[str] = set()
+        # Streams still reading from the engine and calls submitted to the executor, see
+        # in_use; retire() disconnects once both are over
+        self.active_streams = 0
+        self.active_calls = 0
+        self._retired = False
+        self._disconnecting: Optional[asyncio.Future] = None
+        # Rows per page for generated queries on this connection, None uses DB_PAGE_SIZE
+        self.page_size: Optional[int] = None
+        # Seconds results of this connection are cached, None uses DB_RESULT_CACHE_TTL
+        self.result_cache_ttl: Optional[float] = None
 
     def database_type(self) -> str: 
         raise NotImplementedError("Database type must be implemented by specific database service") 
 
+    def _pool_setting(self, name: str, default: int) -> int:
+        # DB_POOL_SIZE applies to every dialect, DB_POOL_SIZE_POSTGRES overrides it for one
+        value = os.getenv(f"DB_{name}_{self.database_type().upper()}", os.getenv(f"DB_{name}"))
+        return int(value) if value else default
+
+    def default_page_size(self) -> int:
+        return self.page_size if self.page_size is not None else self._pool_setting("PAGE_SIZE", 1000)
+
+    def default_result_cache_ttl(self) -> float:
+        return self.result_cache_ttl if self.result_cache_ttl is not None else self._pool_setting("RESULT_CACHE_TTL", 0)
+
+    def statement_timeout(self) -> int:
+        """Seconds generated statements may run before the database cancels them, 0 for no limit."""
+        return self._pool_setting("STATEMENT_TIMEOUT", 60)
+
+    def _engine_options(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self._pool_setting("POOL_SIZE", 5),
+            "max_overflow": self._pool_setting("MAX_OVERFLOW", 10),
+            "pool_timeout": self._pool_setting("POOL_TIMEOUT", 30),
+            "pool_recycle": self._pool_setting("POOL_RECYCLE", 1800),
+            "pool_pre_ping": True,
+        }
+
     async def connect(self, connection_string: str) -> None:
+        options = self._engine_options()
         self._connection_string = connection_string
-        self._engine = create_engine(connection_string)
+        self._engine = create_engine(connection_string, **options)
+        self._cancel_engine = create_engine(connection_string, poolclass=NullPool)
+        # One worker per pooled connection: the drivers are blocking, so every database
+        # call runs here instead of on the event loop, and never waits on a worker
+        # without also being able to get a connection
+        workers = self._pool_setting("EXECUTOR_WORKERS", options["pool_size"] + options["max_overflow"])
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{self.database_type()}-db")
     
+    async def check_connection(self) -> None:
+        """Opens and returns one pooled connection, raising if the database can't be reached or refuses the credentials."""
+        await self._run_blocking(self._open_and_close)
+
+    def _open_and_close(self) -> None:
+        with self._engine.connect():
+            pass
+
     async def disconnect(self) -> None:
         if self._engine:
-            self._engine.dispose()
+            engine, executor = self._engine, self._executor
             self._engine = None
+            self._executor = None
+            self._cancel_engine.dispose()
+            await asyncio.get_running_loop().run_in_executor(executor, engine.dispose)
+            executor.shutdown(wait=False)
+
+    def _submit(self, function: Callable, *args) -> asyncio.Future:
+        if not self._engine:
+            raise Exception("Not connected to database")
+        # Run in a copy of the caller's context so spans recorded by the worker count
+        # towards the request that is waiting on it
+        context = contextvars.copy_context()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(context.run, function, *args))
+        self.active_calls += 1
+        future.add_done_callback(self._call_done)
+        return future
+
+    def _call_done(self, future: asyncio.Future) -> None:
+        self.active_calls -= 1
+        self._disconnect_if_retired()
+
+    @property
+    def in_use(self) -> bool:
+        """Whether a stream or an executor call is using the engine, so disconnecting would break it."""
+        return self.active_streams > 0 or self.active_calls > 0
+
+    def _disconnect_if_retired(self) -> None:
+        if self._retired and not self.in_use:
+            self._retired = False
+            # Kept referenced, the event loop only holds tasks weakly
+            self._disconnecting = asyncio.ensure_future(self.disconnect())
+
+    async def _run_blocking(self, function: Callable, *args) -> Any:
+        return await self._submit(function, *args)
     
-    async def execute_query(self, query: str) -> List[Dict[str, Any]]:
+    def _statement(self, query: str, params: Optional[Dict[str, Any]]):
+        statement = text(query)
+        if params:
+            # List parameters are rendered as IN (...) lists
+            statement = statement.bindparams(
+                *[bindparam(name, expanding=True) for name, value in params.items() if isinstance(value, (list, tuple))]
+            )
+        return statement
+
+    async def execute_query(self, query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         if not self._engine:
             raise Exception("Not connected to database")
-        
-        with self._engine.connect() as connection:
-            result = connection.execute(text(query))
+        return await self._run_blocking(self._execute, self._statement(query, params), params or {}, time.perf_counter())
+
+    def _execute(self, statement, params: Dict[str, Any], submitted: float) -> List[Dict[str, Any]]:
+        with self._checkout(submitted) as connection, metrics.span("db_execute"):
+            result = connection.execute(statement, params)
             return [dict(zip(result.keys(), row)) for row in result]
-    
-    async def get_schema(self) -> List[Dict[str, Any]]:
-        raise NotImplementedError("Schema retrieval must be implemented by specific database service") 
\ No newline at end of file
+
+    def _checkout(self, submitted: float):
+        # Timed from submission: there is one worker per pooled connection, so waiting
+        # for a worker is where requests queue for the pool
+        connection = self._engine.connect()
+        waited = time.perf_counter() - submitted
+        metrics.POOL_WAIT_SECONDS.observe(waited, self.database_type())
+        metrics.record("db_pool_wait", waited)
+        return connection
+
+    def _set_statement_timeout(self, connection, seconds: int) -> None:
+        # Runs on the connection before the statement; dialects without one run unlimited
+        pass
+
+    def _clear_statement_timeout(self, connection) -> None:
+        # Undoes _set_statement_timeout before the connection goes back to the pool
+        pass
+
+    def _cancel_handle(self, connection) -> Any:
+        """What _cancel needs to stop a statement on this connection; must not block."""
+        return None
+
+    def _cancel(self, handle: Any) -> None:
+        # Dialects without a native cancel stop at the next batch instead
+        pass
+
+    async def stream_rows(self, query: str, params: Optional[Dict[str, Any]] = None, batch_size: Optional[int] = None, timeout: Optional[int] = None, query_id: Optional[str] = None) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+        if not self._engine:
+            raise Exception("Not connected to database")
+        batch_size = batch_size or self._pool_setting("STREAM_YIELD_PER", 1000)
+        statement = self._statement(query, params)
+        # Each blocking step is kept in pending, and shielded so that interrupting the
+        # generator doesn't mark it done while a worker is still busy on the connection
+        connection, handle, pending = None, None, None
+        row_count = None
+        self.active_streams += 1
+        try:
+            pending = self._submit(self._checkout, time.perf_counter())
+            connection = await asyncio.shield(pending)
+            handle = self._cancel_handle(connection)
+            if query_id:
+                self._running[query_id] = handle
+                # A cancel that arrived before the handle was registered had nothing to interrupt
+                if query_id in self._cancelled:
+                    raise Exception("Query was cancelled")
+            if timeout:
+                pending = self._submit(self._set_statement_timeout, connection, timeout)
+                await asyncio.shield(pending)
+            # Server-side cursor where the driver has one (psycopg2, pymysql); pyodbc and
+            # cx_Oracle fetch from the server in batches anyway, and yield_per makes
+            # SQLAlchemy buffer no more than one batch either way
+            streaming = connection.execution_options(stream_results=True, yield_per=batch_size)
+            if query_id in self._cancelled:
+                raise Exception("Query was cancelled")
+            pending = self._submit(streaming.execute, statement, params or {})
+            with metrics.span("db_execute"):
+                result = await asyncio.shield(pending)
+            columns = list(result.keys())
+            batches = result.partitions(batch_size)
+            row_count = 0
+            while True:
+                if query_id in self._cancelled:
+                    raise Exception("Query was cancelled")
+                pending = self._submit(next, batches, None)
+                with metrics.span("db_fetch"):
+                    rows = await asyncio.shield(pending)
+                if rows is None:
+                    break
+                row_count += len(rows)
+                yield columns, [tuple(row) for row in rows]
+            if row_count == 0:
+                yield columns, []
+        finally:
+            if row_count is not None:
+                metrics.RESULT_ROWS.observe(row_count, self.database_type())
+            if query_id:
+                self._running.pop(query_id, None)
+                self._cancelled.discard(query_id)
+            # Shielded: a disconnected client cancels this task again at every await, and
+            # the connection still has to go back to the pool
+            await asyncio.shield(asyncio.ensure_future(self._release(connection, handle, pending, timeout)))
+            self.active_streams -= 1
+            self._disconnect_if_retired()
+
+    async def _release(self, connection, handle: Any, pending: Optional[asyncio.Future], timeout: Optional[int]) -> None:
+        if pending is not None and not pending.done():
+            # Interrupted mid-call: stop the statement on the server so the worker and
+            # the connection are freed now rather than when it would have finished
+            if handle is not None:
+                try:
+                    await asyncio.to_thread(self._cancel, handle)
+                except Exception:
+                    pass
+            await asyncio.wait([pending])
+        if pending is not None and not pending.cancelled() and pending.exception() is None and connection is None:
+            connection = pending.result()
+        if connection is None:
+            return
+        # Not through the executor, which is gone if the service was disconnected meanwhile
+        try:
+            if timeout:
+                await asyncio.to_thread(self._clear_statement_timeout, connection)
+        finally:
+            await asyncio.to_thread(connection.close)
+
+    async def retire(self) -> None:
+        """Disconnects now, or once the last stream and executor call using the engine have ended."""
+        if self.in_use:
+            self._retired = True
+        else:
+            await self.disconnect()
+
+    async def cancel(self, query_id: str) -> bool:
+        """Stops the statement running under query_id; whether it had started.
+
+        The id is recorded either way, so a statement that starts afterwards is stopped
+        before it executes. forget_cancel drops the record once the query is over.
+        """
+        self._cancelled.add(query_id)
+        if query_id not in self._running:
+            return False
+        handle = self._running[query_id]
+        if handle is not None:
+            # Off the executor: its workers may all be busy with the statements to stop
+            await asyncio.to_thread(self._cancel, handle)
+        return True
+
+    def forget_cancel(self, query_id: str) -> None:
+        self._cancelled.discard(query_id)
+
+    async def stream_query(self, query: str, params: Optional[Dict[str, Any]] = None, batch_size: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        async for columns, rows in self.stream_rows(query, params, batch_size):
+            if rows:
+                yield [dict(zip(columns, row)) for row in rows]
+
+    async def explain(self, query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Optional[float]]]:
+        with metrics.span("db_explain"):
+            return await self._run_blocking(self._explain, query, params or {})
+
+    def _explain(self, query: str, params: Dict[str, Any]) -> Optional[Dict[str, Optional[float]]]:
+        # Dialects without an EXPLAIN implementation skip the cost gate
+        return None
+
+    async def check_cost(self, query: str, params: Optional[Dict[str, Any]] = None, confirmed: bool = False) -> Optional[Dict[str, Optional[float]]]:
+        """EXPLAINs query and compares the estimate with the DB_MAX_* and DB_CONFIRM_* thresholds.
+
+        Over DB_MAX_COST or DB_MAX_ROWS the query is rejected outright; over DB_CONFIRM_COST
+        or DB_CONFIRM_ROWS it needs confirmed=True. Costs are in the dialect's own planner
+        units, so they are usually set per dialect (DB_MAX_COST_POSTGRES). Nothing is
+        explained while every threshold is 0, the default.
+        """
+        limits = {name: self._pool_setting(name, 0) for name in ("MAX_COST", "MAX_ROWS", "CONFIRM_COST", "CONFIRM_ROWS")}
+        if not any(limits.values()):
+            return None
+        estimate = await self.explain(query, params)
+        if estimate is None:
+            return None
+
+        def over(kind: str, limit: int) -> bool:
+            return limit > 0 and estimate.get(kind) is not None and estimate[kind] > limit
+
+        for kind in ("cost", "rows"):
+            limit = limits[f"MAX_{kind.upper()}"]
+            if over(kind, limit):
+                raise QueryRejected(f"Query rejected: estimated {kind} {estimate[kind]:,.0f} exceeds the limit of {limit}", estimate)
+        for kind in ("cost", "rows"):
+            limit = limits[f"CONFIRM_{kind.upper()}"]
+            if over(kind, limit) and not confirmed:
+                raise ConfirmationRequired(f"Estimated {kind} {estimate[kind]:,.0f} is above {limit}, confirm to run the query", estimate)
+        return estimate
+
+    def _quote(self, identifier: str) -> str:
+        return self._engine.dialect.identifier_preparer.quote(identifier)
+
+    def page_query(self, query: str, limit: int, offset: int = 0) -> str:
+        # Clauses go on a new line so a trailing -- comment in the query can't swallow them
+        if pagination.has_row_limit(query):
+            return f"SELECT * FROM ({query}\n) AS page LIMIT {limit} OFFSET {offset}"
+        return f"{query}\nLIMIT {limit} OFFSET {offset}"
+
+    def keyset_query(self, query: str, column: str, descending: bool, limit: int) -> str:
+        body, _ = pagination.split_order_by(query)
+        key = f"page.{self._quote(column)}"
+        return (
+            f"SELECT * FROM ({body}\n) AS page WHERE {key} {'<' if descending else '>'} :after "
+            f"ORDER BY {key} {'DESC' if descending else 'ASC'} LIMIT {limit}"
+        )
+
+    async def get_schema(self, tables: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError("Schema retrieval must be implemented by specific database service")
+
+    async def get_schema_fingerprint(self) -> Optional[str]:
+        if not self.schema_fingerprint_query:
+            return None
+        rows = await self.execute_query(self.schema_fingerprint_query)
+        return hashlib.sha256(repr([tuple(row.values()) for row in rows]).encode()).hexdigest()
+
+    async def get_table_versions(self) -> Optional[Dict[str, str]]:
+        if not self.table_versions_query:
+            return None
+        rows = await self.execute_query(self.table_versions_query)
+        return {row["table_name"]: str(row["version"]) for row in rows}
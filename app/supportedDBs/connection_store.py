@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+class ConnectionBinding:
+    """What /connect established for a user and connection key, enough for any worker to rebuild the engine."""
+
+    def __init__(self, db_type: str, connection_string: str, page_size: Optional[int] = None, result_cache_ttl: Optional[float] = None):
+        self.db_type = db_type
+        self.connection_string = connection_string
+        self.page_size = page_size
+        self.result_cache_ttl = result_cache_ttl
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "db_type": self.db_type,
+            "connection_string": self.connection_string,
+            "page_size": self.page_size,
+            "result_cache_ttl": self.result_cache_ttl
+        })
+
+    @classmethod
+    def from_json(cls, data: str) -> "ConnectionBinding":
+        return cls(**json.loads(data))
+
+class ConnectionStore(ABC):
+    """Where connection bindings live, shared by every worker that serves the same users.
+
+    Bindings expire ttl seconds after they were last read, so abandoned sessions don't
+    pile up. A Redis implementation would keep each binding as a JSON string under
+    "dbchat:connection:{user_id}:{key}", written with SET ... EX ttl, read with GET
+    (plus EXPIRE to slide the TTL) and removed with DEL.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("CONNECTION_STORE_TTL", "86400"))
+
+    @abstractmethod
+    async def get(self, user_id: int, key: str) -> Optional[ConnectionBinding]:
+        """The binding, or None if there is none or it expired."""
+        pass
+
+    @abstractmethod
+    async def put(self, user_id: int, key: str, binding: ConnectionBinding) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, user_id: int, key: str) -> bool:
+        """Removes the binding; whether there was one."""
+        pass
+
+class MemoryConnectionStore(ConnectionStore):
+    """Bindings in this process only; enough for a single worker."""
+
+    def __init__(self, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self._bindings: Dict[Tuple[int, str], Tuple[ConnectionBinding, float]] = {}
+
+    async def get(self, user_id: int, key: str) -> Optional[ConnectionBinding]:
+        entry = self._bindings.get((user_id, key))
+        if entry is None or entry[1] <= time.time():
+            self._bindings.pop((user_id, key), None)
+            return None
+        self._bindings[(user_id, key)] = (entry[0], time.time() + self.ttl)
+        return entry[0]
+
+    async def put(self, user_id: int, key: str, binding: ConnectionBinding) -> None:
+        self._bindings[(user_id, key)] = (binding, time.time() + self.ttl)
+
+    async def delete(self, user_id: int, key: str) -> bool:
+        return self._bindings.pop((user_id, key), None) is not None
+
+class SQLiteConnectionStore(ConnectionStore):
+    """Bindings in a SQLite file, shared by the workers and restarts of one host.
+
+    The file is opened in WAL mode so reads, which happen on every request, never wait
+    for another worker's write. Queries run in a thread so a busy file never stalls the
+    event loop.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.path = path
+        # Bindings hold connection strings with their passwords: readable by the owner only.
+        # SQLite creates the WAL and shared memory files with the same permissions
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS connection_bindings ("
+                "user_id INTEGER NOT NULL, key TEXT NOT NULL, binding TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (user_id, key))"
+            )
+            self._db.commit()
+
+    async def get(self, user_id: int, key: str) -> Optional[ConnectionBinding]:
+        return await asyncio.to_thread(self._get, user_id, key)
+
+    async def put(self, user_id: int, key: str, binding: ConnectionBinding) -> None:
+        await asyncio.to_thread(self._put, user_id, key, binding)
+
+    async def delete(self, user_id: int, key: str) -> bool:
+        return await asyncio.to_thread(self._delete, user_id, key)
+
+    def _get(self, user_id: int, key: str) -> Optional[ConnectionBinding]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT binding, expires_at FROM connection_bindings WHERE user_id = ? AND key = ? AND expires_at > ?",
+                (user_id, key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            # Sliding expiry, written at most once per half TTL to keep reads read-only
+            if row[1] - now < self.ttl / 2:
+                self._db.execute(
+                    "UPDATE connection_bindings SET expires_at = ? WHERE user_id = ? AND key = ?",
+                    (now + self.ttl, user_id, key)
+                )
+                self._db.commit()
+        return ConnectionBinding.from_json(row[0])
+
+    def _put(self, user_id: int, key: str, binding: ConnectionBinding) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM connection_bindings WHERE expires_at <= ?", (now,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO connection_bindings (user_id, key, binding, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, key, binding.to_json(), now + self.ttl)
+            )
+            self._db.commit()
+
+    def _delete(self, user_id: int, key: str) -> bool:
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM connection_bindings WHERE user_id = ? AND key = ?", (user_id, key)).rowcount
+            self._db.commit()
+        return deleted > 0
+
+def create_connection_store(url: Optional[str] = None) -> ConnectionStore:
+    """The store named by CONNECTION_STORE: "memory" (default) or "sqlite:///path/to/file.db"."""
+    url = url if url is not None else os.getenv("CONNECTION_STORE", "memory")
+    if url in ("", "memory"):
+        return MemoryConnectionStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteConnectionStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported connection store: {url}")
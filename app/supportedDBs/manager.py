@@ -1,29 +1,142 @@
-from typing import Dict, Type
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Type, Tuple, Optional
 from .base import DatabaseService
+from .connection_store import ConnectionBinding, ConnectionStore, create_connection_store
 from .mysql import MySQLDatabaseService
 from .sqlserver import SQLServerDatabaseService
 from .postgres import PostgresDatabaseService
 from .oracle import OracleDatabaseService
 
+class RegisteredConnection:
+    def __init__(self, service: DatabaseService, db_type: str, connection_string: str):
+        self.service = service
+        self.db_type = db_type
+        self.connection_string = connection_string
+        self.last_used = time.monotonic()
+
+    @property
+    def busy(self) -> bool:
+        # A query, schema read or stream still using the engine; disposing it would break them
+        return self.service.in_use
+
 class DatabaseManagerService:
-    def __init__(self):
+    """Keeps one connected service (and its pooled engine) per user and connection.
+
+    What /connect established is stored as a binding in a connection store shared by
+    every worker (see connection_store.py), and each worker builds its own service from
+    the binding the first time a request for it arrives. Entries are keyed by (user id,
+    connection key) so users never overwrite each other's connection, and reconnecting
+    to the same database reuses the warm pool. Idle local services are disposed after
+    DB_ENGINE_IDLE_TTL seconds and the least recently used one is disposed once more
+    than DB_MAX_ENGINES are open; their bindings stay, so they are rebuilt on demand.
+    Services with a query or stream in flight are never evicted, and one that is
+    disconnected or replaced is disposed when the last of them ends.
+    """
+
+    def __init__(self, max_engines: Optional[int] = None, idle_ttl: Optional[float] = None, store: Optional[ConnectionStore] = None):
         self._services: Dict[str, Type[DatabaseService]] = {
             "mysql": MySQLDatabaseService,
             "sqlserver": SQLServerDatabaseService,
             "postgres": PostgresDatabaseService,
             "oracle": OracleDatabaseService
         }
-        self._current_service: DatabaseService = None
-    
+        self.max_engines = max_engines or int(os.getenv("DB_MAX_ENGINES", "32"))
+        self.idle_ttl = idle_ttl if idle_ttl is not None else float(os.getenv("DB_ENGINE_IDLE_TTL", "1800"))
+        self.store = store or create_connection_store()
+        self._connections: "OrderedDict[Tuple[int, str], RegisteredConnection]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
     def get_service(self, db_type: str) -> DatabaseService:
         if db_type.lower() not in self._services:
             raise ValueError(f"Unsupported database type: {db_type}")
-        
+
         service_class = self._services[db_type.lower()]
-        self._current_service = service_class()
-        return self._current_service
-    
-    def get_current_service(self) -> DatabaseService:
-        if not self._current_service:
-            raise Exception("No database service is currently active")
-        return self._current_service 
\ No newline at end of file
+        return service_class()
+
+    @staticmethod
+    def connection_key(db_type: str, connection_string: str, connection_string_id: Optional[int] = None) -> str:
+        if connection_string_id is not None:
+            return f"saved-{connection_string_id}"
+        digest = hashlib.sha256(f"{db_type.lower()}|{connection_string}".encode()).hexdigest()
+        return f"adhoc-{digest[:16]}"
+
+    async def connect(self, user_id: int, key: str, db_type: str, connection_string: str, page_size: Optional[int] = None, result_cache_ttl: Optional[float] = None) -> DatabaseService:
+        binding = ConnectionBinding(db_type.lower(), connection_string, page_size, result_cache_ttl)
+        async with self._lock:
+            service = await self._materialize(user_id, key, binding)
+            # Stored once a connection has been opened, so other workers never see a
+            # binding with a bad host or password
+            await self.store.put(user_id, key, binding)
+            return service
+
+    async def get_connection(self, user_id: int, key: str) -> DatabaseService:
+        binding = await self.store.get(user_id, key)
+        async with self._lock:
+            if binding is None:
+                # Disconnected through another worker, or expired
+                entry = self._connections.pop((user_id, key), None)
+                if entry:
+                    await entry.service.retire()
+                raise Exception(f"No active database connection for '{key}'")
+            return await self._materialize(user_id, key, binding)
+
+    async def disconnect(self, user_id: int, key: str) -> None:
+        removed = await self.store.delete(user_id, key)
+        async with self._lock:
+            entry = self._connections.pop((user_id, key), None)
+            if entry:
+                await entry.service.retire()
+        if not removed and not entry:
+            raise Exception(f"No active database connection for '{key}'")
+
+    async def dispose_all(self) -> None:
+        """Disposes this worker's services; the bindings stay for other workers and restarts."""
+        async with self._lock:
+            while self._connections:
+                _, entry = self._connections.popitem(last=False)
+                await entry.service.disconnect()
+
+    async def _materialize(self, user_id: int, key: str, binding: ConnectionBinding) -> DatabaseService:
+        """This worker's service for binding, reusing the one already built from the same database."""
+        await self._evict_idle()
+        entry = self._connections.get((user_id, key))
+        if entry and entry.db_type == binding.db_type and entry.connection_string == binding.connection_string:
+            entry.last_used = time.monotonic()
+            self._connections.move_to_end((user_id, key))
+            entry.service.page_size = binding.page_size
+            entry.service.result_cache_ttl = binding.result_cache_ttl
+            return entry.service
+        if entry:
+            del self._connections[(user_id, key)]
+            await entry.service.retire()
+
+        service = self.get_service(binding.db_type)
+        await service.connect(binding.connection_string)
+        # connect() only builds the engine, which is lazy
+        try:
+            await service.check_connection()
+        except Exception:
+            await service.disconnect()
+            raise
+        service.page_size = binding.page_size
+        service.result_cache_ttl = binding.result_cache_ttl
+        self._connections[(user_id, key)] = RegisteredConnection(service, binding.db_type, binding.connection_string)
+        # Least recently used first; while every other service is streaming the limit is exceeded instead
+        evictable = [other for other, entry in self._connections.items() if not entry.busy and other != (user_id, key)]
+        for evicted_key in evictable[:max(len(self._connections) - self.max_engines, 0)]:
+            evicted = self._connections.pop(evicted_key)
+            await evicted.service.disconnect()
+        return service
+
+    async def _evict_idle(self) -> None:
+        if self.idle_ttl <= 0:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        expired = [key for key, entry in self._connections.items() if entry.last_used < cutoff and not entry.busy]
+        for key in expired:
+            entry = self._connections.pop(key)
+            await entry.service.disconnect()
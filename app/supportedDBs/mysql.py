@@ -1,26 +1,103 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
+import json
 from .base import BaseDatabaseService
 
+def _plan_values(node: Any, key: str) -> Iterator[Any]:
+    """Every value stored under key anywhere in an EXPLAIN FORMAT=JSON plan."""
+    if isinstance(node, dict):
+        for name, value in node.items():
+            if name == key:
+                yield value
+            else:
+                yield from _plan_values(value, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _plan_values(item, key)
+
 class MySQLDatabaseService(BaseDatabaseService):
-    async def get_schema(self) -> List[Dict[str, Any]]:
+    schema_fingerprint_query = """
+    SELECT
+        (SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE()) as table_count,
+        (SELECT MAX(CREATE_TIME) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE()) as last_created,
+        (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = DATABASE()) as column_count
+    """
+
+    table_versions_query = """
+    SELECT
+        TABLE_NAME as table_name,
+        CONCAT_WS(':', CREATE_TIME, UPDATE_TIME) as version
+    FROM INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = DATABASE()
+    """
+
+    async def get_schema(self, tables: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         if not self._engine:
             raise Exception("Not connected to database")
         
-        schema_query = """
+        table_filter = "AND c.TABLE_NAME IN :tables" if tables is not None else ""
+        schema_query = f"""
         SELECT 
-            TABLE_SCHEMA as schema_name,
-            TABLE_NAME as table_name,
-            COLUMN_NAME as column_name,
-            DATA_TYPE as data_type,
-            IS_NULLABLE as is_nullable,
-            COLUMN_KEY as column_key
-        FROM INFORMATION_SCHEMA.COLUMNS
-        WHERE TABLE_SCHEMA = DATABASE()
-        ORDER BY TABLE_NAME, ORDINAL_POSITION
+            c.TABLE_SCHEMA as schema_name,
+            c.TABLE_NAME as table_name,
+            c.COLUMN_NAME as column_name,
+            c.DATA_TYPE as data_type,
+            c.IS_NULLABLE as is_nullable,
+            CASE
+                WHEN c.COLUMN_KEY = '' AND fk.foreign_key IS NOT NULL THEN 'MUL'
+                ELSE c.COLUMN_KEY
+            END as column_key,
+            fk.foreign_key,
+            ix.index_names
+        FROM INFORMATION_SCHEMA.COLUMNS c
+        LEFT JOIN (
+            SELECT
+                TABLE_NAME,
+                COLUMN_NAME,
+                MIN(CONCAT(REFERENCED_TABLE_NAME, '.', REFERENCED_COLUMN_NAME)) as foreign_key
+            FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND REFERENCED_TABLE_NAME IS NOT NULL
+            GROUP BY TABLE_NAME, COLUMN_NAME
+        ) fk ON fk.TABLE_NAME = c.TABLE_NAME AND fk.COLUMN_NAME = c.COLUMN_NAME
+        LEFT JOIN (
+            SELECT
+                TABLE_NAME,
+                COLUMN_NAME,
+                GROUP_CONCAT(DISTINCT INDEX_NAME ORDER BY INDEX_NAME) as index_names
+            FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+            GROUP BY TABLE_NAME, COLUMN_NAME
+        ) ix ON ix.TABLE_NAME = c.TABLE_NAME AND ix.COLUMN_NAME = c.COLUMN_NAME
+        WHERE c.TABLE_SCHEMA = DATABASE()
+        {table_filter}
+        ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
         """
         
-        return await self.execute_query(schema_query)
+        return await self.execute_query(schema_query, {"tables": tables} if tables is not None else None)
     
+    def _explain(self, query: str, params: Dict[str, Any]) -> Optional[Dict[str, Optional[float]]]:
+        with self._engine.connect() as connection:
+            plan = json.loads(connection.execute(self._statement(f"EXPLAIN FORMAT=JSON {query}", params), params).scalar())
+        cost = plan.get("query_block", {}).get("cost_info", {}).get("query_cost")
+        # The innermost table of a join produces the most rows; its estimate stands for the result
+        rows = [float(value) for value in _plan_values(plan, "rows_produced_per_join")]
+        return {"cost": float(cost) if cost is not None else None, "rows": max(rows) if rows else None}
+
+    def _set_statement_timeout(self, connection, seconds: int) -> None:
+        # max_execution_time only applies to read-only SELECT statements
+        connection.exec_driver_sql(f"SET SESSION max_execution_time = {int(seconds * 1000)}")
+
+    def _clear_statement_timeout(self, connection) -> None:
+        connection.exec_driver_sql("SET SESSION max_execution_time = DEFAULT")
+
+    def _cancel_handle(self, connection) -> Any:
+        return connection.connection.dbapi_connection.thread_id()
+
+    def _cancel(self, thread_id: int) -> None:
+        # KILL QUERY stops the statement and leaves the connection usable
+        with self._cancel_engine.connect() as connection:
+            connection.exec_driver_sql(f"KILL QUERY {int(thread_id)}")
+
     async def connect(self, connection_string: str) -> None:
         # Ensure MySQL specific connection string format
         if not connection_string.startswith("mysql+pymysql://"):
@@ -1,37 +1,135 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import uuid
+from sqlalchemy import text
 from .base import BaseDatabaseService
+from . import pagination
 
 class OracleDatabaseService(BaseDatabaseService):
-    async def get_schema(self) -> List[Dict[str, Any]]:
+    schema_fingerprint_query = """
+    SELECT
+        (SELECT COUNT(*) FROM user_objects WHERE object_type IN ('TABLE', 'VIEW')) as table_count,
+        (SELECT MAX(last_ddl_time) FROM user_objects WHERE object_type IN ('TABLE', 'VIEW')) as last_ddl_time,
+        (SELECT COUNT(*) FROM user_tab_columns) as column_count
+    FROM dual
+    """
+
+    table_versions_query = """
+    SELECT
+        object_name as table_name,
+        TO_CHAR(MAX(last_ddl_time), 'YYYY-MM-DD HH24:MI:SS') as version
+    FROM user_objects
+    WHERE object_type IN ('TABLE', 'VIEW')
+    GROUP BY object_name
+    """
+
+    def page_query(self, query: str, limit: int, offset: int = 0) -> str:
+        fetch = f"OFFSET {offset} ROWS FETCH NEXT {limit} ROWS ONLY"
+        if pagination.has_row_limit(query):
+            return f"SELECT * FROM ({query}\n) page {fetch}"
+        return f"{query}\n{fetch}"
+
+    def keyset_query(self, query: str, column: str, descending: bool, limit: int) -> str:
+        body, _ = pagination.split_order_by(query)
+        key = f"page.{self._quote(column)}"
+        return (
+            f"SELECT * FROM ({body}\n) page WHERE {key} {'<' if descending else '>'} :after "
+            f"ORDER BY {key} {'DESC' if descending else 'ASC'} FETCH FIRST {limit} ROWS ONLY"
+        )
+
+    async def get_schema(self, tables: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         if not self._engine:
             raise Exception("Not connected to database")
         
-        schema_query = """
+        table_filter = "WHERE c.table_name IN :tables" if tables is not None else ""
+        schema_query = f"""
         SELECT 
-            owner as schema_name,
-            table_name,
-            column_name,
-            data_type,
-            nullable as is_nullable,
-            CASE WHEN column_name IN (
-                SELECT column_name 
-                FROM all_cons_columns 
-                WHERE constraint_name IN (
-                    SELECT constraint_name 
-                    FROM all_constraints 
-                    WHERE constraint_type = 'P'
-                    AND table_name = t.table_name
-                )
-            ) THEN 'PRI' ELSE '' END as column_key
-        FROM all_tab_columns t
-        WHERE owner = USER
-        ORDER BY table_name, column_id
+            USER as schema_name,
+            c.table_name,
+            c.column_name,
+            c.data_type,
+            CASE WHEN c.nullable = 'Y' THEN 'YES' ELSE 'NO' END as is_nullable,
+            CASE
+                WHEN k.is_primary = 1 THEN 'PRI'
+                WHEN k.is_unique = 1 THEN 'UNI'
+                WHEN k.foreign_key IS NOT NULL OR ix.index_names IS NOT NULL THEN 'MUL'
+                ELSE ''
+            END as column_key,
+            k.foreign_key,
+            ix.index_names
+        FROM user_tab_columns c
+        LEFT JOIN (
+            SELECT
+                cc.table_name,
+                cc.column_name,
+                MAX(CASE WHEN con.constraint_type = 'P' THEN 1 ELSE 0 END) as is_primary,
+                MAX(CASE WHEN con.constraint_type = 'U' AND keys.key_count = 1 THEN 1 ELSE 0 END) as is_unique,
+                MIN(CASE WHEN con.constraint_type = 'R' THEN rc.table_name || '.' || rc.column_name END) as foreign_key
+            FROM user_cons_columns cc
+            JOIN user_constraints con ON con.constraint_name = cc.constraint_name
+            JOIN (
+                SELECT constraint_name, COUNT(*) as key_count
+                FROM user_cons_columns
+                GROUP BY constraint_name
+            ) keys ON keys.constraint_name = cc.constraint_name
+            LEFT JOIN all_cons_columns rc
+                ON rc.owner = con.r_owner
+                AND rc.constraint_name = con.r_constraint_name
+                AND rc.position = cc.position
+            WHERE con.constraint_type IN ('P', 'U', 'R')
+            GROUP BY cc.table_name, cc.column_name
+        ) k ON k.table_name = c.table_name AND k.column_name = c.column_name
+        LEFT JOIN (
+            SELECT
+                table_name,
+                column_name,
+                LISTAGG(index_name, ',') WITHIN GROUP (ORDER BY index_name) as index_names
+            FROM user_ind_columns
+            GROUP BY table_name, column_name
+        ) ix ON ix.table_name = c.table_name AND ix.column_name = c.column_name
+        {table_filter}
+        ORDER BY c.table_name, c.column_id
         """
         
-        return await self.execute_query(schema_query)
+        return await self.execute_query(schema_query, {"tables": tables} if tables is not None else None)
     
+    def _explain(self, query: str, params: Dict[str, Any]) -> Optional[Dict[str, Optional[float]]]:
+        # EXPLAIN PLAN takes no bind values, binds in the query are planned as unknown
+        statement_id = uuid.uuid4().hex[:30]
+        with self._engine.connect() as connection:
+            connection.exec_driver_sql(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {query}")
+            plan = connection.execute(
+                text("SELECT cost, cardinality FROM plan_table WHERE statement_id = :statement_id AND id = 0"),
+                {"statement_id": statement_id}
+            ).first()
+            connection.execute(text("DELETE FROM plan_table WHERE statement_id = :statement_id"), {"statement_id": statement_id})
+            connection.commit()
+        if plan is None:
+            return None
+        return {
+            "cost": float(plan[0]) if plan[0] is not None else None,
+            "rows": float(plan[1]) if plan[1] is not None else None
+        }
+
+    def _set_statement_timeout(self, connection, seconds: int) -> None:
+        # call_timeout bounds each round trip; when it expires the driver breaks the
+        # call and the server aborts the statement
+        connection.connection.dbapi_connection.call_timeout = int(seconds * 1000)
+
+    def _clear_statement_timeout(self, connection) -> None:
+        connection.connection.dbapi_connection.call_timeout = 0
+
+    def _cancel_handle(self, connection) -> Any:
+        return connection.connection.dbapi_connection
+
+    def _cancel(self, dbapi_connection) -> None:
+        # cx_Oracle's Connection.cancel() breaks the running call from another thread
+        dbapi_connection.cancel()
+
     async def connect(self, connection_string: str) -> None:
         # Ensure Oracle specific connection string format
         if not connection_string.startswith("oracle+cx_oracle://"):
             connection_string = f"oracle+cx_oracle://{connection_string}"
-        await super().connect(connection_string) 
\ No newline at end of file
+        await super().connect(connection_string) 
+
+    def database_type(self) -> str: 
+        return "oracle"
@@ -0,0 +1,113 @@
+import re
+from typing import Optional, Tuple
+
+def mask_sql(query: str) -> str:
+    """Blanks out literals, quoted identifiers, comments and everything inside parentheses.
+
+    The result has the same length as the query, so keywords found in it are at the top
+    level of the statement and their positions can be used to slice the original.
+    """
+    masked = []
+    depth = 0
+    index = 0
+    while index < len(query):
+        char = query[index]
+        if query.startswith("--", index):
+            end = query.find("\n", index)
+            end = len(query) if end == -1 else end
+        elif query.startswith("/*", index):
+            end = query.find("*/", index + 2)
+            end = len(query) if end == -1 else end + 2
+        elif char in "'\"`[":
+            closing = "]" if char == "[" else char
+            end = index + 1
+            while end < len(query):
+                if query[end] == closing:
+                    # Doubled quotes are escapes inside the literal
+                    if closing != "]" and query.startswith(closing * 2, end):
+                        end += 2
+                        continue
+                    break
+                end += 1
+            end = min(end + 1, len(query))
+        else:
+            if char == ")":
+                depth = max(depth - 1, 0)
+            masked.append(char if depth == 0 else " ")
+            if char == "(":
+                depth += 1
+            index += 1
+            continue
+        masked.append(" " * (end - index))
+        index = end
+    return "".join(masked)
+
+def strip_statement(query: str) -> str:
+    return query.strip().rstrip(";").strip()
+
+def is_select(query: str) -> bool:
+    return re.match(r"\s*\(*\s*(select|with)\b", mask_sql(query), re.IGNORECASE) is not None
+
+def has_row_limit(query: str) -> bool:
+    return re.search(
+        r"\blimit\b|\bfetch\s+(first|next)\b|\boffset\s+\S+\s+rows?\b|\bselect\s+(distinct\s+|all\s+)?top\b|\brownum\b",
+        mask_sql(query),
+        re.IGNORECASE
+    ) is not None
+
+def has_distinct(query: str) -> bool:
+    return re.search(r"\bselect\s+distinct\b", mask_sql(query), re.IGNORECASE) is not None
+
+def has_set_operation(query: str) -> bool:
+    return re.search(r"\b(union|intersect|except|minus)\b", mask_sql(query), re.IGNORECASE) is not None
+
+def single_table(query: str) -> Optional[Tuple[Optional[str], str]]:
+    """(schema or None, table) when the statement reads plain rows of exactly one table.
+
+    None for joins, comma joins, derived tables, CTEs, set operations and grouping, where
+    a key that is unique in its table need not be unique in the result.
+    """
+    masked = mask_sql(query)
+    if re.match(r"\s*\(*\s*with\b", masked, re.IGNORECASE) or has_set_operation(query):
+        return None
+    if re.search(r"\b(join|group\s+by|having)\b", masked, re.IGNORECASE):
+        return None
+    match = re.search(r"\bfrom\b(?P<source>.*?)(?=\b(?:where|order\s+by|limit|offset|fetch|window|for)\b|$)", masked, re.IGNORECASE | re.DOTALL)
+    if not match:
+        return None
+    # Quoted names are blanked by mask_sql, so only plain identifiers can match
+    source = re.fullmatch(
+        r"\s*(?:(?P<schema>[\w$#]+)\.)?(?P<table>[\w$#]+)(?:\s+(?:as\s+)?(?!(?:where|order|limit)\b)[\w$#]+)?\s*",
+        match.group("source"),
+        re.IGNORECASE
+    )
+    if not source:
+        return None
+    return source.group("schema"), source.group("table")
+
+def split_order_by(query: str) -> Tuple[str, Optional[str]]:
+    """Splits off a trailing top-level ORDER BY clause: (query without it, clause or None)."""
+    matches = list(re.finditer(r"\border\s+by\b", mask_sql(query), re.IGNORECASE))
+    if not matches:
+        return query, None
+    start = matches[-1].start()
+    return query[:start].rstrip(), query[matches[-1].end():].strip()
+
+def order_key(order_clause: Optional[str]) -> Optional[Tuple[str, bool]]:
+    """(column name, descending) when the ORDER BY is a single plain column, else None."""
+    if not order_clause:
+        return None
+    match = re.fullmatch(
+        r'(?:[\w$#]+\.|"[^"]+"\.|`[^`]+`\.|\[[^\]]+\]\.)*(?P<column>[\w$#]+|"[^"]+"|`[^`]+`|\[[^\]]+\])(?:\s+(?P<direction>asc|desc))?',
+        order_clause.strip(),
+        re.IGNORECASE
+    )
+    if not match:
+        return None
+    column = match.group("column").strip('"`[]')
+    return column, (match.group("direction") or "").lower() == "desc"
+
+def insert_after_select(query: str, clause: str) -> str:
+    """Inserts clause right after the first top-level SELECT [DISTINCT|ALL]."""
+    match = re.search(r"\bselect\s+((distinct|all)\s+)?", mask_sql(query), re.IGNORECASE)
+    return f"{query[:match.end()]}{clause} {query[match.end():]}"
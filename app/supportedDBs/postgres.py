@@ -1,34 +1,126 @@
-from typing import List, Dict, Any
-from .base import BaseDatabaseService
+from typing import List, Dict, Any, Optional
+import json
 from sqlalchemy import text
+from .base import BaseDatabaseService
 
 class PostgresDatabaseService(BaseDatabaseService):
-    async def get_schema(self) -> List[Dict[str, Any]]:
+    schema_fingerprint_query = """
+    SELECT
+        (SELECT count(*) FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'v', 'm', 'f') AND a.attnum > 0) as column_count,
+        (SELECT max(a.xmin::text::bigint) FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'v', 'm', 'f')) as column_xmin,
+        (SELECT count(*) FROM pg_constraint con
+            JOIN pg_namespace n ON n.oid = con.connamespace
+            WHERE n.nspname = current_schema()) as constraint_count,
+        (SELECT max(con.xmin::text::bigint) FROM pg_constraint con
+            JOIN pg_namespace n ON n.oid = con.connamespace
+            WHERE n.nspname = current_schema()) as constraint_xmin
+    """
+
+    table_versions_query = """
+    SELECT
+        c.relname as table_name,
+        concat_ws(':', c.xmin::text, att.column_xmin, att.column_count, con.constraint_xmin) as version
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN (
+        SELECT attrelid, max(xmin::text::bigint) as column_xmin, count(*) as column_count
+        FROM pg_attribute
+        WHERE attnum > 0
+        GROUP BY attrelid
+    ) att ON att.attrelid = c.oid
+    LEFT JOIN (
+        SELECT conrelid, max(xmin::text::bigint) as constraint_xmin
+        FROM pg_constraint
+        GROUP BY conrelid
+    ) con ON con.conrelid = c.oid
+    WHERE n.nspname = current_schema()
+    AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+    """
+
+    async def get_schema(self, tables: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         if not self._engine:
             raise Exception("Not connected to database")
         
-        schema_query = """
+        table_filter = "AND c.relname IN :tables" if tables is not None else ""
+        schema_query = f"""
         SELECT 
-            table_schema as schema_name,
-            table_name,
-            column_name,
-            data_type,
-            is_nullable,
-            CASE WHEN column_name IN (
-                SELECT column_name 
-                FROM information_schema.key_column_usage 
-                WHERE table_schema = current_schema()
-                AND table_name = t.table_name
-            ) THEN 'PRI' ELSE '' END as column_key
-        FROM information_schema.columns t
-        WHERE table_schema = current_schema()
-        ORDER BY table_name, ordinal_position
+            n.nspname as schema_name,
+            c.relname as table_name,
+            a.attname as column_name,
+            format_type(a.atttypid, NULL) as data_type,
+            CASE WHEN a.attnotnull THEN 'NO' ELSE 'YES' END as is_nullable,
+            CASE
+                WHEN k.is_primary THEN 'PRI'
+                WHEN k.is_unique THEN 'UNI'
+                WHEN k.foreign_key IS NOT NULL OR ix.index_names IS NOT NULL THEN 'MUL'
+                ELSE ''
+            END as column_key,
+            k.foreign_key,
+            ix.index_names
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        LEFT JOIN (
+            SELECT
+                con.conrelid,
+                keys.attnum,
+                bool_or(con.contype = 'p') as is_primary,
+                bool_or(con.contype = 'u' AND cardinality(con.conkey) = 1) as is_unique,
+                min(rc.relname || '.' || ra.attname) FILTER (WHERE con.contype = 'f') as foreign_key
+            FROM pg_constraint con
+            JOIN pg_namespace cn ON cn.oid = con.connamespace
+            CROSS JOIN LATERAL unnest(con.conkey, con.confkey) as keys(attnum, referenced_attnum)
+            LEFT JOIN pg_class rc ON rc.oid = con.confrelid
+            LEFT JOIN pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = keys.referenced_attnum
+            WHERE cn.nspname = current_schema()
+            AND con.contype IN ('p', 'u', 'f')
+            GROUP BY con.conrelid, keys.attnum
+        ) k ON k.conrelid = c.oid AND k.attnum = a.attnum
+        LEFT JOIN (
+            SELECT
+                i.indrelid,
+                keys.attnum,
+                string_agg(ic.relname, ',' ORDER BY ic.relname) as index_names
+            FROM pg_index i
+            JOIN pg_class ic ON ic.oid = i.indexrelid
+            JOIN pg_namespace tn ON tn.oid = ic.relnamespace
+            CROSS JOIN LATERAL unnest(i.indkey::int2[]) as keys(attnum)
+            WHERE tn.nspname = current_schema()
+            GROUP BY i.indrelid, keys.attnum
+        ) ix ON ix.indrelid = c.oid AND ix.attnum = a.attnum
+        WHERE n.nspname = current_schema()
+        AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+        {table_filter}
+        ORDER BY c.relname, a.attnum
         """
         
-        with self._engine.connect() as connection:
-            result = connection.execute(text(schema_query))
-            return [dict(zip(result.keys(), row)) for row in result]
+        return await self.execute_query(schema_query, {"tables": tables} if tables is not None else None)
     
+    def _explain(self, query: str, params: Dict[str, Any]) -> Optional[Dict[str, Optional[float]]]:
+        with self._engine.connect() as connection:
+            plan = connection.execute(self._statement(f"EXPLAIN (FORMAT JSON) {query}", params), params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        top = plan[0]["Plan"]
+        return {"cost": float(top["Total Cost"]), "rows": float(top["Plan Rows"])}
+
+    def _set_statement_timeout(self, connection, seconds: int) -> None:
+        # SET LOCAL ends with the transaction, which is rolled back when the connection is returned
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(seconds * 1000)}")
+
+    def _cancel_handle(self, connection) -> Any:
+        return connection.connection.dbapi_connection.get_backend_pid()
+
+    def _cancel(self, backend_pid: int) -> None:
+        with self._cancel_engine.connect() as connection:
+            connection.execute(text("SELECT pg_cancel_backend(:pid)"), {"pid": backend_pid})
+
     async def connect(self, connection_string: str) -> None:
         # Ensure PostgreSQL specific connection string format
         if not connection_string.startswith("postgresql+psycopg2://"):
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+def normalize_sql(query: str) -> str:
+    """Collapses whitespace outside string literals and quoted identifiers and drops a trailing semicolon."""
+    parts = re.split(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""", query.strip().rstrip(";").strip())
+    # Odd parts are the literals themselves and are kept byte for byte
+    return "".join(part if index % 2 else " ".join(part.split()) for index, part in enumerate(parts))
+
+def referenced_tables(query: str, table_versions: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """The entries of table_versions whose table name appears as a word in query."""
+    if not table_versions:
+        return {}
+    words = set(re.findall(r"[\w$#]+", query.lower()))
+    return {table: version for table, version in table_versions.items() if table.lower() in words}
+
+class CachedResult:
+    def __init__(self, columns: List[str], rows: List[tuple], stored_at: float):
+        self.columns = columns
+        self.rows = rows
+        self.stored_at = stored_at
+
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+class _Entry:
+    def __init__(self, data: bytes, tables: Dict[str, str], stored_at: float, expires_at: float):
+        self.data = data
+        self.tables = tables
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+class ResultCache:
+    """LRU cache of query results keyed by connection and normalized SQL.
+
+    Results are kept pickled, so memory is bounded by RESULT_CACHE_MAX_BYTES; results of
+    more than RESULT_CACHE_MAX_ROWS rows are not cached. Entries evicted from memory spill
+    to a SQLite file when RESULT_CACHE_PATH is set, bounded by RESULT_CACHE_DISK_MAX_BYTES.
+    Every entry expires after the TTL it was stored with, and records the version of each
+    table its SQL mentions: when the connection's table version probe later reports a
+    different version for one of them, the entry is dropped instead of served. Pickling
+    and disk I/O run in a thread, off the event loop.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, max_rows: Optional[int] = None, path: Optional[str] = None, disk_max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes or int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.max_rows = max_rows or int(os.getenv("RESULT_CACHE_MAX_ROWS", "10000"))
+        self.path = path if path is not None else os.getenv("RESULT_CACHE_PATH", "")
+        self.disk_max_bytes = disk_max_bytes or int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # Guards the SQLite connection, and the running total of the file's result bytes
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.spilled = 0
+        if self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                "key TEXT PRIMARY KEY, data BLOB NOT NULL, tables TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS result_cache_used_at ON result_cache (used_at)")
+            self._db.execute("DELETE FROM result_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+            # Counted once here, then kept up to date as entries are written and removed
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM result_cache").fetchone()[0]
+
+    @staticmethod
+    def key(scope: Hashable, query: str, params: Optional[Dict[str, Any]] = None) -> str:
+        return hashlib.sha256(f"{scope!r}\n{normalize_sql(query)}\n{sorted((params or {}).items())!r}".encode()).hexdigest()
+
+    async def get(self, key: str, table_versions: Optional[Dict[str, str]] = None) -> Optional[CachedResult]:
+        """The cached result for key, unless it expired or a table it read has a new version."""
+        return await asyncio.to_thread(self._get, key, table_versions)
+
+    async def put(self, key: str, query: str, columns: List[str], rows: List[tuple], ttl: float, table_versions: Optional[Dict[str, str]] = None) -> None:
+        if ttl <= 0 or len(rows) > self.max_rows:
+            return
+        await asyncio.to_thread(self._put, key, query, columns, rows, ttl, table_versions)
+
+    def _get(self, key: str, table_versions: Optional[Dict[str, str]]) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry.data)
+        if entry is None:
+            entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.time() or self._changed(entry, table_versions):
+                self.misses += 1
+                self.invalidations += 1
+                return None
+            self.hits += 1
+            spilled = self._remember(key, entry)
+        self._spill(spilled)
+        columns, rows = pickle.loads(entry.data)
+        return CachedResult(columns, rows, entry.stored_at)
+
+    def _put(self, key: str, query: str, columns: List[str], rows: List[tuple], ttl: float, table_versions: Optional[Dict[str, str]]) -> None:
+        data = pickle.dumps((columns, rows), protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous.data)
+            spilled = self._remember(key, _Entry(data, referenced_tables(query, table_versions), now, now + ttl))
+        self._spill(spilled)
+
+    @staticmethod
+    def _changed(entry: _Entry, table_versions: Optional[Dict[str, str]]) -> bool:
+        # Without a probe result there is nothing to compare, the TTL alone applies
+        if table_versions is None:
+            return False
+        return any(table_versions.get(table) != version for table, version in entry.tables.items())
+
+    def _remember(self, key: str, entry: _Entry) -> List[Tuple[str, _Entry]]:
+        """Keeps entry in memory; returns the entries evicted to make room, for _spill."""
+        self._entries[key] = entry
+        self._bytes += len(entry.data)
+        spilled: List[Tuple[str, _Entry]] = []
+        while self._bytes > self.max_bytes and self._entries:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.data)
+            spilled.append((evicted_key, evicted))
+        return spilled
+
+    def _spill(self, entries: List[Tuple[str, _Entry]]) -> None:
+        if not entries or self._db is None:
+            return
+        now = time.time()
+        with self._disk_lock:
+            for key, entry in entries:
+                if entry.expires_at <= now:
+                    continue
+                # A copy already on disk is replaced, so its bytes stop counting
+                replaced = self._db.execute("SELECT LENGTH(data) FROM result_cache WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO result_cache (key, data, tables, stored_at, expires_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, entry.data, json.dumps(entry.tables), entry.stored_at, entry.expires_at, now)
+                )
+                self._disk_bytes += len(entry.data) - (replaced[0] if replaced else 0)
+            self.spilled += len(entries)
+            # Least recently spilled entries go first once the file is over its budget
+            while self._disk_bytes > self.disk_max_bytes:
+                oldest = self._db.execute("SELECT key, LENGTH(data) FROM result_cache ORDER BY used_at LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                self._db.execute("DELETE FROM result_cache WHERE key = ?", (oldest[0],))
+                self._disk_bytes -= oldest[1]
+            self._db.commit()
+
+    def _load(self, key: str) -> Optional[_Entry]:
+        # Entries read back from disk move to memory, so the file only holds spilled ones
+        if self._db is None:
+            return None
+        with self._disk_lock:
+            row = self._db.execute("SELECT data, tables, stored_at, expires_at FROM result_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+            self._db.commit()
+            self._disk_bytes -= len(row[0])
+        return _Entry(row[0], json.loads(row[1]), row[2], row[3])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "spilled": self.spilled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "disk_bytes": self._disk_bytes,
+            "persistent": self._db is not None
+        }
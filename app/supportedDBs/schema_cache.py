@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+from .base import DatabaseService
+from ..singleflight import SingleFlight
+
+class CachedSchema:
+    def __init__(self, schema: List[Dict[str, Any]], fingerprint: Optional[str], table_versions: Optional[Dict[str, str]]):
+        self.schema = schema
+        self.fingerprint = fingerprint
+        self.table_versions = table_versions
+        self.loaded_at = time.monotonic()
+        self.validated_at = self.loaded_at
+
+class SchemaCache:
+    """Per-connection cache in front of DatabaseService.get_schema.
+
+    A cached schema is served as-is for SCHEMA_CACHE_TTL seconds. After that the
+    dialect's fingerprint probe is run and, when it changed, only the tables whose
+    catalog version changed are re-read and merged into the cached snapshot; when no
+    table's version changed, or the entry is older than SCHEMA_CACHE_MAX_AGE, the
+    whole schema is re-read.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_age: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("SCHEMA_CACHE_TTL", "60"))
+        self.max_age = max_age if max_age is not None else float(os.getenv("SCHEMA_CACHE_MAX_AGE", "3600"))
+        self.max_entries = max_entries or int(os.getenv("SCHEMA_CACHE_MAX_ENTRIES", "256"))
+        self._entries: "OrderedDict[Hashable, CachedSchema]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.incremental_refreshes = 0
+        self.tables_reloaded = 0
+        self._flights = SingleFlight()
+        # Changed tables re-read per get_schema call
+        self.tables_per_read = 500
+
+    async def get(self, key: Hashable, service: DatabaseService) -> List[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry and now - entry.validated_at < self.ttl:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry.schema
+
+        # Concurrent misses for the same connection share one probe/reload
+        return await self._flights.do(key, lambda: self._revalidate(key, service))
+
+    async def refresh(self, key: Hashable, service: DatabaseService) -> List[Dict[str, Any]]:
+        return await self._flights.do(("refresh", key), lambda: self._reload(key, service))
+
+    async def _revalidate(self, key: Hashable, service: DatabaseService) -> List[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        fingerprint = None
+        if entry and now - entry.loaded_at < self.max_age and entry.fingerprint is not None:
+            try:
+                fingerprint = await service.get_schema_fingerprint()
+            except Exception:
+                fingerprint = None
+            if fingerprint == entry.fingerprint:
+                self.hits += 1
+                self.revalidations += 1
+                entry.validated_at = time.monotonic()
+                self._entries.move_to_end(key)
+                return entry.schema
+
+        self.misses += 1
+        if entry and now - entry.loaded_at < self.max_age and entry.table_versions is not None:
+            return await self._refresh_changed_tables(key, service, entry, fingerprint)
+        return await self._reload(key, service, await self._probe(service, fingerprint))
+
+    async def _reload(self, key: Hashable, service: DatabaseService, probe: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        fingerprint, table_versions = probe or await self._probe(service)
+        schema = await service.get_schema()
+        return await self._store(key, CachedSchema(schema, fingerprint, table_versions))
+
+    async def _refresh_changed_tables(self, key: Hashable, service: DatabaseService, entry: CachedSchema, fingerprint: Optional[str] = None) -> List[Dict[str, Any]]:
+        fingerprint, table_versions = await self._probe(service, fingerprint)
+        if table_versions is None:
+            return await self._reload(key, service, (fingerprint, None))
+
+        changed = [table for table, version in table_versions.items() if entry.table_versions.get(table) != version]
+        dropped = set(entry.table_versions) - set(table_versions)
+        if not changed and not dropped:
+            # The fingerprint moved for something table versions don't track (a column
+            # type or constraint on some dialects), so nothing narrower can be trusted
+            return await self._reload(key, service, (fingerprint, table_versions))
+        reloaded = []
+        # In chunks: Oracle takes at most 1000 items in an IN list, SQL Server 2100 parameters
+        for start in range(0, len(changed), self.tables_per_read):
+            reloaded += await service.get_schema(tables=changed[start:start + self.tables_per_read])
+
+        stale = set(changed) | dropped
+        columns_by_table: Dict[str, List[Dict[str, Any]]] = {}
+        for row in entry.schema:
+            if row["table_name"] not in stale:
+                columns_by_table.setdefault(row["table_name"], []).append(row)
+        for row in reloaded:
+            columns_by_table.setdefault(row["table_name"], []).append(row)
+        schema = [row for table in sorted(columns_by_table) for row in columns_by_table[table]]
+
+        self.incremental_refreshes += 1
+        self.tables_reloaded += len(changed)
+        refreshed = CachedSchema(schema, fingerprint, table_versions)
+        refreshed.loaded_at = entry.loaded_at
+        return await self._store(key, refreshed)
+
+    async def _probe(self, service: DatabaseService, fingerprint: Optional[str] = None):
+        # Probes are best effort; without them the cache falls back to full reloads. A
+        # fingerprint the caller already read is not queried again
+        if fingerprint is None:
+            try:
+                fingerprint = await service.get_schema_fingerprint()
+            except Exception:
+                fingerprint = None
+        try:
+            table_versions = await service.get_table_versions()
+        except Exception:
+            table_versions = None
+        return fingerprint, table_versions
+
+    async def _store(self, key: Hashable, entry: CachedSchema) -> List[Dict[str, Any]]:
+        async with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry.schema
+
+    def table_versions(self, key: Hashable) -> Optional[Dict[str, str]]:
+        """Table versions from the last probe of the cached schema, without probing again."""
+        entry = self._entries.get(key)
+        return entry.table_versions if entry else None
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "incremental_refreshes": self.incremental_refreshes,
+            "tables_reloaded": self.tables_reloaded,
+            "entries": len(self._entries),
+            "coalesced": self._flights.coalesced,
+            "ttl": self.ttl,
+            "max_age": self.max_age
+        }
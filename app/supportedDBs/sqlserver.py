@@ -1,35 +1,159 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from xml.etree import ElementTree
+from sqlalchemy import event
 from .base import BaseDatabaseService
+from . import pagination
 
 class SQLServerDatabaseService(BaseDatabaseService):
-    async def get_schema(self) -> List[Dict[str, Any]]:
+    schema_fingerprint_query = """
+    SELECT
+        (SELECT COUNT(*) FROM sys.tables) as table_count,
+        (SELECT MAX(modify_date) FROM sys.objects WHERE type IN ('U', 'PK', 'F', 'UQ')) as last_modified,
+        (SELECT COUNT(*) FROM sys.columns c INNER JOIN sys.tables t ON t.object_id = c.object_id) as column_count
+    """
+
+    table_versions_query = """
+    SELECT
+        t.name as table_name,
+        CONVERT(varchar(33), MAX(t.modify_date), 126) as version
+    FROM sys.tables t
+    GROUP BY t.name
+    """
+
+    def page_query(self, query: str, limit: int, offset: int = 0) -> str:
+        fetch = f"OFFSET {offset} ROWS FETCH NEXT {limit} ROWS ONLY"
+        if pagination.split_order_by(query)[1] is not None and not pagination.has_row_limit(query):
+            return f"{query}\n{fetch}"
+        # OFFSET ... FETCH needs an ORDER BY, which SELECT DISTINCT would reject, so the
+        # first page uses TOP unless TOP would only apply to the first branch of a UNION
+        if offset == 0 and not pagination.has_row_limit(query) and not pagination.has_set_operation(query):
+            return pagination.insert_after_select(query, f"TOP ({limit})")
+        if pagination.has_row_limit(query) or pagination.has_distinct(query):
+            return f"SELECT * FROM ({query}\n) AS page ORDER BY (SELECT NULL) {fetch}"
+        return f"{query}\nORDER BY (SELECT NULL) {fetch}"
+
+    def keyset_query(self, query: str, column: str, descending: bool, limit: int) -> str:
+        body, _ = pagination.split_order_by(query)
+        key = f"page.{self._quote(column)}"
+        return (
+            f"SELECT TOP ({limit}) * FROM ({body}\n) AS page WHERE {key} {'<' if descending else '>'} :after "
+            f"ORDER BY {key} {'DESC' if descending else 'ASC'}"
+        )
+
+    async def get_schema(self, tables: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         if not self._engine:
             raise Exception("Not connected to database")
         
-        schema_query = """
+        table_filter = "WHERE t.name IN :tables" if tables is not None else ""
+        schema_query = f"""
         SELECT 
             SCHEMA_NAME(t.schema_id) as schema_name,
             t.name as table_name,
             c.name as column_name,
             ty.name as data_type,
-            c.is_nullable as is_nullable,
-            CASE WHEN pk.column_id IS NOT NULL THEN 'PRI' ELSE '' END as column_key
+            CASE WHEN c.is_nullable = 1 THEN 'YES' ELSE 'NO' END as is_nullable,
+            CASE
+                WHEN ix.is_primary = 1 THEN 'PRI'
+                WHEN ix.is_unique = 1 THEN 'UNI'
+                WHEN fk.foreign_key IS NOT NULL OR names.index_names IS NOT NULL THEN 'MUL'
+                ELSE ''
+            END as column_key,
+            fk.foreign_key,
+            names.index_names
         FROM sys.tables t
         INNER JOIN sys.columns c ON t.object_id = c.object_id
         INNER JOIN sys.types ty ON c.user_type_id = ty.user_type_id
+        -- Key columns only: INCLUDE columns are stored in the index but can't be searched
+        -- by it, and a unique index makes a column unique on its own only when it is the
+        -- index's single key column
         LEFT JOIN (
-            SELECT ic.column_id, ic.object_id
+            SELECT
+                ic.object_id,
+                ic.column_id,
+                MAX(CASE WHEN i.is_primary_key = 1 THEN 1 ELSE 0 END) as is_primary,
+                MAX(CASE WHEN i.is_unique = 1 AND keys.key_count = 1 THEN 1 ELSE 0 END) as is_unique
             FROM sys.index_columns ic
             INNER JOIN sys.indexes i ON ic.object_id = i.object_id AND ic.index_id = i.index_id
-            WHERE i.is_primary_key = 1
-        ) pk ON c.object_id = pk.object_id AND c.column_id = pk.column_id
+            INNER JOIN (
+                SELECT object_id, index_id, COUNT(*) as key_count
+                FROM sys.index_columns
+                WHERE is_included_column = 0
+                GROUP BY object_id, index_id
+            ) keys ON ic.object_id = keys.object_id AND ic.index_id = keys.index_id
+            WHERE i.name IS NOT NULL AND ic.is_included_column = 0
+            GROUP BY ic.object_id, ic.column_id
+        ) ix ON c.object_id = ix.object_id AND c.column_id = ix.column_id
+        -- FOR XML PATH rather than STRING_AGG, which needs SQL Server 2017
+        OUTER APPLY (
+            SELECT STUFF((
+                SELECT ',' + i.name
+                FROM sys.index_columns ic
+                INNER JOIN sys.indexes i ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+                WHERE ic.object_id = c.object_id AND ic.column_id = c.column_id
+                    AND i.name IS NOT NULL AND ic.is_included_column = 0
+                ORDER BY i.name
+                FOR XML PATH(''), TYPE
+            ).value('.', 'nvarchar(max)'), 1, 1, '') as index_names
+        ) names
+        LEFT JOIN (
+            SELECT
+                fkc.parent_object_id,
+                fkc.parent_column_id,
+                MIN(rt.name + '.' + rc.name) as foreign_key
+            FROM sys.foreign_key_columns fkc
+            INNER JOIN sys.tables rt ON rt.object_id = fkc.referenced_object_id
+            INNER JOIN sys.columns rc ON rc.object_id = fkc.referenced_object_id AND rc.column_id = fkc.referenced_column_id
+            GROUP BY fkc.parent_object_id, fkc.parent_column_id
+        ) fk ON c.object_id = fk.parent_object_id AND c.column_id = fk.parent_column_id
+        {table_filter}
         ORDER BY t.name, c.column_id
         """
         
-        return await self.execute_query(schema_query)
+        return await self.execute_query(schema_query, {"tables": tables} if tables is not None else None)
     
+    def _explain(self, query: str, params: Dict[str, Any]) -> Optional[Dict[str, Optional[float]]]:
+        # SET SHOWPLAN_XML has to be alone in its batch; while it is on, statements
+        # return their estimated plan instead of running
+        with self._engine.connect() as connection:
+            connection.exec_driver_sql("SET SHOWPLAN_XML ON")
+            try:
+                plan = connection.execute(self._statement(query, params), params).scalar()
+            finally:
+                connection.exec_driver_sql("SET SHOWPLAN_XML OFF")
+        statements = ElementTree.fromstring(plan).findall(".//{http://schemas.microsoft.com/sqlserver/2004/07/showplan}StmtSimple")
+        costs = [float(statement.get("StatementSubTreeCost")) for statement in statements if statement.get("StatementSubTreeCost")]
+        rows = [float(statement.get("StatementEstRows")) for statement in statements if statement.get("StatementEstRows")]
+        return {"cost": max(costs) if costs else None, "rows": max(rows) if rows else None}
+
+    def _set_statement_timeout(self, connection, seconds: int) -> None:
+        # SQL Server has no per-session statement timeout; the ODBC query timeout makes
+        # the driver send an attention that cancels the statement on the server
+        connection.connection.dbapi_connection.timeout = int(seconds)
+
+    def _clear_statement_timeout(self, connection) -> None:
+        connection.connection.dbapi_connection.timeout = 0
+
+    def _cancel_handle(self, connection) -> Any:
+        # The cursor only exists once the statement is sent, so the handle is the pooled
+        # connection's info dict where _track_cursor puts it
+        return connection.info
+
+    def _cancel(self, info: Dict[str, Any]) -> None:
+        cursor = info.get("cursor")
+        if cursor is not None:
+            # SQLCancel, safe to call from another thread while the statement runs
+            cursor.cancel()
+
+    @staticmethod
+    def _track_cursor(connection, cursor, statement, parameters, context, executemany) -> None:
+        connection.info["cursor"] = cursor
+
     async def connect(self, connection_string: str) -> None:
         # Ensure SQL Server specific connection string format
         if not connection_string.startswith("mssql+pyodbc://"):
             connection_string = f"mssql+pyodbc://{connection_string}"
-        await super().connect(connection_string) 
\ No newline at end of file
+        await super().connect(connection_string)
+        event.listen(self._engine, "before_cursor_execute", self._track_cursor)
+
+    def database_type(self) -> str: 
+        return "sqlserver"
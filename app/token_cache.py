@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+class CurrentUser:
+    """The fields of a user that authenticated requests need, detached from any session."""
+
+    __slots__ = ("id", "username", "email")
+
+    def __init__(self, id: int, username: str, email: str):
+        self.id = id
+        self.username = username
+        self.email = email
+
+class TokenCache:
+    """Bounded LRU of verified access tokens to the user they authenticate.
+
+    An entry lives until AUTH_CACHE_TTL seconds pass or the token expires, whichever
+    comes first, and is dropped as soon as its user is updated or deleted through the
+    ORM in this process. Changes made elsewhere (another worker, SQL run by hand) are
+    picked up once the TTL passes. A TTL of 0 turns the cache off.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("AUTH_CACHE_TTL", "60"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+        # Token -> (user, monotonic expiry)
+        self._entries: "OrderedDict[str, Tuple[CurrentUser, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[CurrentUser]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, user: CurrentUser, token_expires_at: Optional[float] = None) -> None:
+        """Remembers user for token; token_expires_at is the token's exp claim, in Unix time."""
+        lifetime = self.ttl
+        if token_expires_at is not None:
+            lifetime = min(lifetime, token_expires_at - time.time())
+        if lifetime <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (user, time.monotonic() + lifetime)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            stale = [token for token, (user, _) in self._entries.items() if user.id == user_id]
+            for token in stale:
+                del self._entries[token]
+            self.invalidations += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries)
+        }
@@ -0,0 +1,321 @@
+"""Offline end-to-end benchmark of the auth, /schema and /query endpoints.
+
+Drives the FastAPI app in-process over ASGI, with real authentication (bcrypt and
+JWT against a throwaway SQLite metadata database) and a stub LLM that returns canned
+SQL after a configurable delay, so no network access is needed. The target database
+is a SQLite stand-in built from the bundled Pagila or Sakila schema and filled with
+synthetic rows, or a real database with that schema loaded (see the docker-compose
+files in db/). Each scenario reports p50/p95/p99 latency, throughput and the peak
+RSS seen while it ran. Output is a single JSON document.
+
+    python -m benchmarks.end_to_end
+    python -m benchmarks.end_to_end --dataset sakila --llm-latency 0.2 --output run.json
+    python -m benchmarks.end_to_end --db-type postgres \\
+        --connection-string "postgres:123456@localhost:5433/postgres"
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import resource
+import sqlite3
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from app.supportedDBs.base import BaseDatabaseService
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_FILES = {
+    "pagila": os.path.join(ROOT, "db", "postgres-pagila-db", "pagila-schema.sql"),
+    "sakila": os.path.join(ROOT, "db", "mysql-sakila-db", "mysql-sakila-schema.sql"),
+}
+
+# Questions and the SQL the stub model answers with; valid on Pagila, Sakila and the stand-in
+CANNED_SQL = {
+    "List all actors": "SELECT actor_id, first_name, last_name FROM actor ORDER BY actor_id",
+    "Films with their language": (
+        "SELECT f.film_id, f.title, l.name AS language FROM film f "
+        "JOIN language l ON l.language_id = f.language_id ORDER BY f.film_id"
+    ),
+    "How many customers does each store have": "SELECT store_id, COUNT(*) AS customers FROM customer GROUP BY store_id ORDER BY store_id",
+    "Customers who rented the most": (
+        "SELECT c.customer_id, c.first_name, c.last_name, COUNT(r.rental_id) AS rentals FROM customer c "
+        "JOIN rental r ON r.customer_id = c.customer_id GROUP BY c.customer_id, c.first_name, c.last_name ORDER BY rentals DESC"
+    ),
+    "Total payments per staff member": "SELECT staff_id, SUM(amount) AS total FROM payment GROUP BY staff_id ORDER BY staff_id",
+}
+
+SCENARIOS = ["auth_register", "auth_token", "auth_verify", "schema", "schema_refresh", "query_cached", "query_generated"]
+
+# Leading words of table body lines that are constraints rather than columns
+CONSTRAINT_WORDS = {"PRIMARY", "KEY", "UNIQUE", "CONSTRAINT", "FOREIGN", "INDEX", "FULLTEXT", "SPATIAL", "CHECK"}
+
+def parse_schema(path: str) -> Dict[str, Dict[str, Any]]:
+    """Tables of a Postgres or MySQL dump as {name: {"columns": [(name, type)], "primary_key": [...]}}."""
+    with open(path, encoding="utf-8") as schema_file:
+        dump = schema_file.read()
+    tables: Dict[str, Dict[str, Any]] = {}
+    for match in re.finditer(r"^CREATE TABLE (?:public\.)?`?(\w+)`? \((.*?)\n\)", dump, re.MULTILINE | re.DOTALL):
+        columns, primary_key = [], []
+        for line in match.group(2).splitlines():
+            line = line.strip().rstrip(",")
+            if not line or line.startswith("--"):
+                continue
+            first = line.split()[0].strip("`\"")
+            if first.upper() in CONSTRAINT_WORDS:
+                if line.upper().startswith("PRIMARY KEY"):
+                    primary_key = [column.strip(" `\"") for column in re.search(r"\((.*)\)", line).group(1).split(",")]
+                continue
+            declared = re.split(r"\s+(?:NOT NULL|NULL|DEFAULT|AUTO_INCREMENT|COLLATE|CHARACTER SET|GENERATED|COMMENT)\b", line[len(line.split()[0]):].strip(), maxsplit=1)[0]
+            columns.append((first, declared.lower()))
+        tables[match.group(1)] = {"columns": columns, "primary_key": primary_key}
+    for match in re.finditer(r"ALTER TABLE ONLY (?:public\.)?(\w+)\s+ADD CONSTRAINT \w+ PRIMARY KEY \(([^)]+)\)", dump):
+        if match.group(1) in tables:
+            tables[match.group(1)]["primary_key"] = [column.strip() for column in match.group(2).split(",")]
+    return tables
+
+def sqlite_type(declared: str) -> str:
+    if "int" in declared or "year" in declared:
+        return "INTEGER"
+    if any(word in declared for word in ("numeric", "decimal", "float", "double", "real")):
+        return "REAL"
+    if "date" in declared or "time" in declared:
+        return "TIMESTAMP"
+    return "TEXT"
+
+def synthetic_value(column: str, column_type: str, row: int, rows: int, in_key: bool) -> Any:
+    # Key columns take the row number so composite keys stay unique; other integer
+    # columns (mostly foreign keys) spread over the same 1..rows range
+    if column_type == "INTEGER":
+        return row if in_key else (row * 7) % rows + 1
+    if column_type == "REAL":
+        return round((row * 37) % 10000 / 100, 2)
+    if column_type == "TIMESTAMP":
+        return f"2022-{row % 7 + 1:02d}-{row % 28 + 1:02d} {row % 24:02d}:{row % 60:02d}:00"
+    return f"{column}_{row}"
+
+def build_standin(dataset: str, rows: int, path: str) -> int:
+    """Creates the dataset's tables in a SQLite file with rows synthetic rows each; returns the table count."""
+    tables = parse_schema(SCHEMA_FILES[dataset])
+    connection = sqlite3.connect(path)
+    for name, table in tables.items():
+        columns = [(column, sqlite_type(declared)) for column, declared in table["columns"]]
+        definitions = [f'"{column}" {column_type}' for column, column_type in columns]
+        if table["primary_key"]:
+            definitions.append(f"PRIMARY KEY ({', '.join(table['primary_key'])})")
+        connection.execute(f'CREATE TABLE "{name}" ({", ".join(definitions)})')
+        key = set(table["primary_key"])
+        connection.executemany(
+            f'INSERT OR IGNORE INTO "{name}" VALUES ({", ".join("?" for _ in columns)})',
+            [[synthetic_value(column, column_type, row, rows, column in key) for column, column_type in columns] for row in range(1, rows + 1)]
+        )
+    connection.commit()
+    connection.close()
+    return len(tables)
+
+class SQLiteStandInService(BaseDatabaseService):
+    """Database service for the SQLite stand-in, registered under the "sqlite" type."""
+
+    schema_fingerprint_query = "PRAGMA schema_version"
+    table_versions_query = "SELECT name AS table_name, sql AS version FROM sqlite_master WHERE type = 'table'"
+
+    def database_type(self) -> str:
+        return "sqlite"
+
+    async def get_schema(self, tables=None):
+        table_filter = "AND m.name IN :tables" if tables is not None else ""
+        return await self.execute_query(
+            "SELECT 'main' AS schema_name, m.name AS table_name, p.name AS column_name, p.type AS data_type, "
+            "CASE p.\"notnull\" WHEN 1 THEN 'NO' ELSE 'YES' END AS is_nullable, "
+            "CASE WHEN p.pk > 0 THEN 'PRI' ELSE '' END AS column_key "
+            f"FROM sqlite_master m JOIN pragma_table_info(m.name) p WHERE m.type = 'table' {table_filter} ORDER BY m.name, p.cid",
+            {"tables": tables} if tables is not None else None
+        )
+
+def current_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+async def sample_peak_rss(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Highest RSS seen until stop is set; without /proc it falls back to the process high-water mark."""
+    peak = 0.0
+    while not stop.is_set():
+        rss = current_rss_mb()
+        if rss is None:
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            divisor = 1024 * 1024 if platform.system() == "Darwin" else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+        peak = max(peak, rss)
+        await asyncio.sleep(interval)
+    return peak
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest rank
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+async def run_scenario(make_request, requests: int, concurrency: int) -> Dict[str, Any]:
+    """Sends requests requests through make_request(n) from concurrency workers and summarizes them."""
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_peak_rss(stop))
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    queue = iter(range(requests))
+
+    async def worker():
+        for n in queue:
+            started = time.perf_counter()
+            response = await make_request(n)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    milliseconds = [latency * 1000 for latency in latencies]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(milliseconds, 0.50), 2),
+            "p95": round(percentile(milliseconds, 0.95), 2),
+            "p99": round(percentile(milliseconds, 0.99), 2),
+            "max": round(max(milliseconds), 2),
+        },
+        "peak_rss_mb": round(await sampler, 1),
+    }
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="dbchat_e2e_")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'meta.db')}")
+    os.environ.setdefault("MISTRAL_KEY", "benchmark")
+    import httpx
+    from app import main
+    from app.ai.base import BaseAIService
+    from app.ai.semantic_cache import SemanticQueryCache
+
+    class CannedAIService(BaseAIService):
+        """Answers the CANNED_SQL questions after a fixed delay; a "(run N)" suffix is ignored."""
+
+        def _setup_services(self):
+            self.latency = float(self.config.get("latency", 0))
+            self.calls = 0
+
+        async def generate_sql_query(self, natural_language, schema, databaseType):
+            self.calls += 1
+            prompt = self._build_prompt(natural_language, schema, databaseType)
+            await asyncio.sleep(self.latency)
+            self._observe_usage(prompt)
+            return CANNED_SQL[re.sub(r" \(run \d+\)$", "", natural_language)]
+
+    connection_string = args.connection_string
+    db_type = args.db_type
+    table_count = None
+    if db_type == "sqlite":
+        standin = os.path.join(workdir, f"{args.dataset}.db")
+        table_count = build_standin(args.dataset, args.rows, standin)
+        connection_string = f"sqlite:///{standin}"
+        main.db_manager._services["sqlite"] = SQLiteStandInService
+    ai_service = CannedAIService({"latency": args.llm_latency})
+    main.ai_service = ai_service
+
+    run_id = uuid.uuid4().hex[:8]
+    questions = list(CANNED_SQL)
+    results: Dict[str, Any] = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        password = "benchmark-password"
+        response = await client.post("/register", json={"email": f"bench-{run_id}@example.com", "username": f"bench-{run_id}", "password": password})
+        response.raise_for_status()
+        response = await client.post("/token", json={"username": f"bench-{run_id}", "password": password})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = await client.post("/connect", headers=headers, json={"db_type": db_type, "connection_string": connection_string})
+        response.raise_for_status()
+        connection_id = response.json()["connection_id"]
+
+        def query(question: str):
+            return client.post("/query", headers=headers, json={"natural_language": question, "connection_id": connection_id})
+
+        requests = {
+            "auth_register": lambda n: client.post("/register", json={
+                "email": f"bench-{run_id}-{n}@example.com", "username": f"bench-{run_id}-{n}", "password": password
+            }),
+            "auth_token": lambda n: client.post("/token", json={"username": f"bench-{run_id}", "password": password}),
+            "auth_verify": lambda n: client.get("/connection-strings/", headers=headers),
+            "schema": lambda n: client.get("/schema", headers=headers, params={"connection_id": connection_id}),
+            "schema_refresh": lambda n: client.post("/schema/refresh", headers=headers, params={"connection_id": connection_id}),
+            "query_cached": lambda n: query(questions[n % len(questions)]),
+            # Unique wording misses the exact cache, and the semantic cache is off for this one
+            "query_generated": lambda n: query(f"{questions[n % len(questions)]} (run {n})"),
+        }
+        for scenario in args.scenarios:
+            semantic_cache = main.semantic_cache
+            if scenario == "query_generated":
+                main.semantic_cache = SemanticQueryCache(max_entries=0)
+            try:
+                # Numbered after the measured requests so none of them is warmed up by accident
+                for n in range(args.requests, args.requests + args.warmup):
+                    await requests[scenario](n)
+                calls = ai_service.calls
+                results[scenario] = await run_scenario(requests[scenario], args.requests, args.concurrency)
+            finally:
+                main.semantic_cache = semantic_cache
+            if scenario.startswith("query"):
+                results[scenario]["llm_calls"] = ai_service.calls - calls
+    await main.db_manager.dispose_all()
+
+    return {
+        "benchmark": "end_to_end",
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "db_type": db_type,
+        "dataset": args.dataset if db_type == "sqlite" else None,
+        "tables": table_count,
+        "rows_per_table": args.rows if db_type == "sqlite" else None,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "llm_latency_ms": args.llm_latency * 1000,
+        "scenarios": results,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-type", default="sqlite", choices=["sqlite", "postgres", "mysql"], help="sqlite builds an offline stand-in")
+    parser.add_argument("--connection-string", help="Database with the Pagila/Sakila schema loaded, for postgres and mysql")
+    parser.add_argument("--dataset", default="pagila", choices=sorted(SCHEMA_FILES), help="Schema of the SQLite stand-in")
+    parser.add_argument("--rows", type=int, default=1000, help="Synthetic rows per stand-in table")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before each scenario")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds the stub model takes per generation")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--output", help="Also write the JSON to this file")
+    args = parser.parse_args()
+    args.scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.db_type != "sqlite" and not args.connection_string:
+        parser.error("--connection-string is required for postgres and mysql")
+    result = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(result + "\n")
+    print(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Schema introspection benchmark.
+
+Creates a synthetic schema (5,000 tables x 20 columns = 100,000 columns by default,
+every table with a primary key, a foreign key to the previous table and one secondary
+index) in the target database and reports how long full and incremental introspection
+take. Output is a single JSON document.
+
+    python -m benchmarks.introspection --db-type postgres \\
+        --connection-string "postgres:postgres@localhost:5432/bench" --setup --teardown
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from sqlalchemy import text
+
+from app.supportedDBs.manager import DatabaseManagerService
+
+TABLE_PREFIX = "bench_t"
+
+def table_ddl(index: int, columns: int):
+    name = f"{TABLE_PREFIX}{index}"
+    definitions = ["id INTEGER PRIMARY KEY"]
+    if index > 0:
+        definitions.append(f"parent_id INTEGER REFERENCES {TABLE_PREFIX}{index - 1}(id)")
+    while len(definitions) < columns:
+        definitions.append(f"c{len(definitions)} VARCHAR(64)")
+    return [
+        f"CREATE TABLE {name} ({', '.join(definitions)})",
+        f"CREATE INDEX {name}_c2_idx ON {name} (c2)",
+    ]
+
+def setup_schema(engine, tables: int, columns: int, batch_size: int = 100):
+    for start in range(0, tables, batch_size):
+        with engine.begin() as connection:
+            for index in range(start, min(start + batch_size, tables)):
+                for statement in table_ddl(index, columns):
+                    connection.execute(text(statement))
+
+def teardown_schema(engine, tables: int):
+    # Drop in reverse so foreign keys never point at a dropped table
+    for index in reversed(range(tables)):
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE {TABLE_PREFIX}{index}"))
+
+async def timed(coroutine_factory, repeat: int):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await coroutine_factory()
+        timings.append(time.perf_counter() - started)
+    return result, {
+        "min_s": round(min(timings), 4),
+        "median_s": round(statistics.median(timings), 4),
+        "max_s": round(max(timings), 4),
+    }
+
+async def run(args):
+    service = DatabaseManagerService().get_service(args.db_type)
+    await service.connect(args.connection_string)
+    report = {"db_type": args.db_type, "tables": args.tables, "columns_per_table": args.columns}
+    try:
+        if args.setup:
+            started = time.perf_counter()
+            setup_schema(service._engine, args.tables, args.columns)
+            report["setup_s"] = round(time.perf_counter() - started, 2)
+
+        schema, report["full_schema"] = await timed(service.get_schema, args.repeat)
+        report["columns_returned"] = len(schema)
+        report["foreign_keys_returned"] = sum(1 for row in schema if row.get("foreign_key"))
+        _, report["fingerprint_probe"] = await timed(service.get_schema_fingerprint, args.repeat)
+        versions, report["table_versions_probe"] = await timed(service.get_table_versions, args.repeat)
+        changed = sorted(versions or {})[:1]
+        _, report["incremental_schema_1_table"] = await timed(lambda: service.get_schema(tables=changed), args.repeat)
+
+        if args.teardown:
+            teardown_schema(service._engine, args.tables)
+    finally:
+        await service.disconnect()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-type", required=True, choices=["postgres", "mysql", "sqlserver", "oracle"])
+    parser.add_argument("--connection-string", required=True)
+    parser.add_argument("--tables", type=int, default=5000)
+    parser.add_argument("--columns", type=int, default=20, help="Columns per table")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--setup", action="store_true", help="Create the synthetic schema first")
+    parser.add_argument("--teardown", action="store_true", help="Drop the synthetic schema afterwards")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""The API in a single uvicorn worker with an event-loop stall monitor, for benchmarks.load_test.
+
+Registers the SQLite stand-in database type and adds two routes next to the API's:
+GET /_load/stalls reports event-loop lag, stalls and the stacks the loop was blocked
+in, and POST /_load/reset clears them after warmup. Configure the API through the
+environment as usual; AI_PROVIDER=ollama with OLLAMA_ENDPOINT pointing at
+benchmarks.stub_ollama keeps it offline.
+
+    AI_PROVIDER=ollama OLLAMA_ENDPOINT=http://127.0.0.1:11435 python -m benchmarks.load_server --port 8100
+"""
+import argparse
+
+from app import main as api
+from benchmarks.end_to_end import SQLiteStandInService
+from benchmarks.load_test import StallMonitor
+
+def install(threshold: float) -> StallMonitor:
+    monitor = StallMonitor(threshold=threshold)
+    api.db_manager._services["sqlite"] = SQLiteStandInService
+
+    @api.app.on_event("startup")
+    async def start_stall_monitor():
+        monitor.start()
+
+    @api.app.on_event("shutdown")
+    async def stop_stall_monitor():
+        monitor.stop()
+
+    @api.app.get("/_load/stalls", include_in_schema=False)
+    async def load_stalls():
+        return monitor.report()
+
+    @api.app.post("/_load/reset", include_in_schema=False)
+    async def load_reset():
+        monitor.reset()
+        return {"message": "Reset"}
+
+    return monitor
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--stall-threshold", type=float, default=0.05, help="Event-loop lag in seconds counted as a stall")
+    args = parser.parse_args()
+    install(args.stall_threshold)
+    uvicorn.run(api.app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""Load test of one uvicorn worker of the API, with latency histograms and stall detection.
+
+Starts a stub Ollama server (benchmarks.stub_ollama) and the API in a single uvicorn
+worker (benchmarks.load_server) against a SQLite stand-in of the bundled schema, then
+replays the question corpus in benchmarks/data/load_questions.json against /token,
+/connection-strings/, /schema and /query. Load is either closed (--concurrency
+clients sending back to back) or open (--rate arrivals per second, Poisson, with
+latency measured from the intended send time so a slow server can't hide queueing).
+Nothing leaves the machine.
+
+Reports throughput, error rates and HDR-style latency histograms per endpoint, and
+the server's event-loop stalls with the stacks the loop was blocked in. Output is a
+single JSON document.
+
+    python -m benchmarks.load_test --concurrency 32 --duration 30
+    python -m benchmarks.load_test --rate 50 --mix query=1 --llm-latency 1.0 --fail-on-stall
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ["token", "connection_strings", "schema", "query"]
+DEFAULT_MIX = "token=1,connection_strings=3,schema=3,query=5"
+
+class LatencyHistogram:
+    """Log-linear histogram of microseconds, like an HdrHistogram with two significant digits.
+
+    Each power of two is split into 64 sub-buckets, so any recorded value is off by
+    less than 1.6% whatever its magnitude, and memory stays a few hundred counters.
+    """
+    SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, seconds: float) -> None:
+        value = max(1, int(seconds * 1_000_000))
+        shift = max(0, value.bit_length() - self.SUB_BUCKET_BITS)
+        self.counts[(shift, value >> shift)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    @staticmethod
+    def _upper_bound(bucket: Tuple[int, int]) -> int:
+        shift, sub_bucket = bucket
+        return ((sub_bucket + 1) << shift) - 1
+
+    def percentile(self, fraction: float) -> float:
+        """Milliseconds at or below which fraction of the values fall."""
+        if not self.total:
+            return 0.0
+        rank, seen = max(1, math.ceil(fraction * self.total)), 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self._upper_bound(bucket), self.max) / 1000
+        return self.max / 1000
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "p50": round(self.percentile(0.5), 2),
+            "p90": round(self.percentile(0.9), 2),
+            "p99": round(self.percentile(0.99), 2),
+            "p99.9": round(self.percentile(0.999), 2),
+            "max": round(self.max / 1000, 2),
+            "mean": round(self.sum / self.total / 1000, 2) if self.total else 0.0,
+        }
+
+    def buckets(self) -> List[List[float]]:
+        """Non-empty buckets as [upper bound in ms, count], ascending."""
+        return [[round(self._upper_bound(bucket) / 1000, 3), self.counts[bucket]] for bucket in sorted(self.counts)]
+
+class StallMonitor:
+    """Measures event-loop lag and records what the loop was running when it stalled.
+
+    A task sleeps for interval and records how late it wakes up; waking more than
+    threshold late is a stall. With stacks on, a watchdog thread also snapshots the
+    loop thread's stack once per stall while it is still blocked, so the blocking
+    call shows up by name.
+    """
+
+    def __init__(self, interval: float = 0.005, threshold: float = 0.05, stacks: bool = True, max_stacks: int = 10):
+        self.interval = interval
+        self.threshold = threshold
+        self.stacks = stacks
+        self.max_stacks = max_stacks
+        self._beat = time.perf_counter()
+        self._reported = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+        self.reset()
+
+    def reset(self) -> None:
+        self.lag = LatencyHistogram()
+        self.stalls = 0
+        self.max_stall = 0.0
+        self.stall_stacks: Counter = Counter()
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        if self.stacks:
+            threading.Thread(target=self._watch, name="stall-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = self._beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.lag.record(lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+                self.max_stall = max(self.max_stall, lag)
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            if time.perf_counter() - beat < self.threshold or beat == self._reported:
+                continue
+            self._reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self.stall_stacks[self._format_stack(frame)] += 1
+
+    @staticmethod
+    def _format_stack(frame) -> Tuple[str, ...]:
+        # Innermost frames, where the blocking call is, with paths relative to the repo
+        return tuple(
+            f"{os.path.relpath(entry.filename, ROOT) if entry.filename.startswith(ROOT) else entry.filename}:{entry.lineno} in {entry.name}"
+            for entry in traceback.extract_stack(frame)[-8:]
+        )
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "stall_threshold_ms": self.threshold * 1000,
+            "stalls": self.stalls,
+            "max_stall_ms": round(self.max_stall * 1000, 1),
+            "lag_ms": self.lag.summary(),
+            "stall_stacks": [{"count": count, "stack": list(stack)} for stack, count in self.stall_stacks.most_common(self.max_stacks)],
+        }
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in --mix: {name.strip()}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+def start_process(module: str, arguments: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen([sys.executable, "-m", module, *arguments], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_until_ready(client, url: str, process: subprocess.Popen, log_path: str, timeout: float = 60) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            with open(log_path) as log:
+                raise Exception(f"{url} exited with {process.returncode}:\n{log.read()[-2000:]}")
+        try:
+            if (await client.get(url)).status_code < 500:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    raise Exception(f"{url} did not come up within {timeout}s")
+
+class LoadRun:
+    def __init__(self, client, args, credentials: Dict[str, str], headers: Dict[str, str], connection_id: str, questions: List[str]):
+        self.client = client
+        self.args = args
+        self.credentials = credentials
+        self.headers = headers
+        self.connection_id = connection_id
+        self.questions = questions
+        self.mix = parse_mix(args.mix)
+        self.random = random.Random(args.seed)
+        self.sent = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.histograms = {name: LatencyHistogram() for name in self.mix}
+        self.errors = {name: Counter() for name in self.mix}
+
+    def _request(self, endpoint: str):
+        self.sent += 1
+        if endpoint == "token":
+            return self.client.post("/token", json=self.credentials)
+        if endpoint == "connection_strings":
+            return self.client.get("/connection-strings/", headers=self.headers)
+        if endpoint == "schema":
+            return self.client.get("/schema", headers=self.headers, params={"connection_id": self.connection_id})
+        question = self.random.choice(self.questions)
+        if self.random.random() < self.args.cache_miss_ratio:
+            # A number the SQL caches haven't seen makes the question a cache miss
+            question = f"{question} (request {self.sent})"
+        return self.client.post("/query", headers=self.headers, json={"natural_language": question, "connection_id": self.connection_id})
+
+    async def _send(self, endpoint: str, scheduled: float) -> None:
+        try:
+            response = await self._request(endpoint)
+            if response.status_code >= 400:
+                self.errors[endpoint][str(response.status_code)] += 1
+        except Exception as e:
+            self.errors[endpoint][type(e).__name__] += 1
+        finally:
+            self.histograms[endpoint].record(time.perf_counter() - scheduled)
+
+    def _pick(self) -> str:
+        return self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+    async def closed(self, duration: float) -> float:
+        deadline = time.perf_counter() + duration
+
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                await self._send(self._pick(), time.perf_counter())
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop() for _ in range(self.args.concurrency)])
+        return time.perf_counter() - started
+
+    async def open(self, duration: float) -> float:
+        started = time.perf_counter()
+        scheduled, in_flight = started, set()
+        while scheduled < started + duration:
+            scheduled += self.random.expovariate(self.args.rate)
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            task = asyncio.ensure_future(self._send(self._pick(), scheduled))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.wait(in_flight)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        def summarize(histogram: LatencyHistogram, errors: Counter) -> Dict[str, Any]:
+            failed = sum(errors.values())
+            return {
+                "requests": histogram.total,
+                "errors": dict(errors),
+                "error_rate": round(failed / histogram.total, 4) if histogram.total else 0.0,
+                "throughput_rps": round(histogram.total / elapsed, 1),
+                "latency_ms": histogram.summary(),
+            }
+
+        total, total_errors = LatencyHistogram(), Counter()
+        endpoints = {}
+        for name, histogram in self.histograms.items():
+            total.merge(histogram)
+            total_errors.update(self.errors[name])
+            endpoints[name] = {**summarize(histogram, self.errors[name]), "histogram": histogram.buckets()}
+        return {"total": summarize(total, total_errors), "endpoints": endpoints}
+
+    async def run(self, duration: float) -> float:
+        return await (self.open(duration) if self.args.rate else self.closed(duration))
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+    from benchmarks.end_to_end import build_standin
+    from benchmarks.stub_ollama import CORPUS_PATH, load_corpus
+
+    workdir = tempfile.mkdtemp(prefix="dbchat_load_")
+    standin = os.path.join(workdir, f"{args.dataset}.db")
+    build_standin(args.dataset, args.rows, standin)
+    questions = list(load_corpus(CORPUS_PATH))
+    ollama_port, api_port = free_port(), free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'meta.db')}",
+        "AI_PROVIDER": "ollama",
+        "OLLAMA_ENDPOINT": f"http://127.0.0.1:{ollama_port}",
+        "OLLAMA_MAX_CONCURRENCY": str(args.llm_parallel),
+    }
+    processes = [
+        start_process("benchmarks.stub_ollama", [
+            "--port", str(ollama_port), "--latency", str(args.llm_latency), "--jitter", str(args.llm_jitter),
+            "--parallel", str(args.llm_parallel), "--seed", str(args.seed)
+        ], env, os.path.join(workdir, "stub_ollama.log")),
+        start_process("benchmarks.load_server", [
+            "--port", str(api_port), "--stall-threshold", str(args.stall_threshold)
+        ], env, os.path.join(workdir, "api.log")),
+    ]
+    client_loop = StallMonitor(threshold=args.stall_threshold, stacks=False)
+    client_loop.start()
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency if not args.rate else args.max_in_flight)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", timeout=args.timeout, limits=limits) as client:
+            await wait_until_ready(client, f"http://127.0.0.1:{ollama_port}/stats", processes[0], os.path.join(workdir, "stub_ollama.log"))
+            await wait_until_ready(client, "/openapi.json", processes[1], os.path.join(workdir, "api.log"))
+            credentials = {"username": "load", "password": "load-test-password"}
+            (await client.post("/register", json={"email": "load@example.com", **credentials})).raise_for_status()
+            token = (await client.post("/token", json=credentials)).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            saved = await client.post("/connection-strings/", headers=headers, json={
+                "database_type": "sqlite", "name": args.dataset, "connection_string": f"sqlite:///{standin}"
+            })
+            saved.raise_for_status()
+            connected = await client.post("/connect", headers=headers, json={"connection_string_id": saved.json()["id"]})
+            connected.raise_for_status()
+
+            load = LoadRun(client, args, credentials, headers, connected.json()["connection_id"], questions)
+            if args.warmup:
+                await load.run(args.warmup)
+            load.reset()
+            client_loop.reset()
+            (await client.post("/_load/reset")).raise_for_status()
+            llm_before = (await client.get(f"http://127.0.0.1:{ollama_port}/stats")).json()["requests"]
+            elapsed = await load.run(args.duration)
+            server_loop = (await client.get("/_load/stalls")).json()
+            llm_requests = (await client.get(f"http://127.0.0.1:{ollama_port}/stats")).json()["requests"] - llm_before
+    finally:
+        client_loop.stop()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    flags = []
+    if server_loop["stalls"]:
+        flags.append(f"server event loop stalls: {server_loop['stalls']}, up to {server_loop['max_stall_ms']} ms")
+    if client_loop.stalls:
+        flags.append(f"load generator event loop stalls: {client_loop.stalls}, latencies may be inflated")
+    return {
+        "benchmark": "load_test",
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mode": "open" if args.rate else "closed",
+        "concurrency": None if args.rate else args.concurrency,
+        "rate_rps": args.rate,
+        "duration_s": round(elapsed, 2),
+        "mix": parse_mix(args.mix),
+        "cache_miss_ratio": args.cache_miss_ratio,
+        "dataset": args.dataset,
+        "llm": {"latency_ms": args.llm_latency * 1000, "parallel": args.llm_parallel, "requests": llm_requests},
+        **load.report(elapsed),
+        "server_event_loop": server_loop,
+        "client_event_loop": {"stalls": client_loop.stalls, "max_stall_ms": round(client_loop.max_stall * 1000, 1)},
+        "flags": flags,
+        "logs": workdir,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16, help="Closed-loop clients")
+    parser.add_argument("--rate", type=float, help="Open-loop arrivals per second, instead of --concurrency")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Connection limit in open-loop mode")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds of load first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Endpoint weights, from {', '.join(ENDPOINTS)}")
+    parser.add_argument("--cache-miss-ratio", type=float, default=0.2, help="Share of /query questions reworded to miss the SQL caches")
+    parser.add_argument("--dataset", default="pagila", choices=["pagila", "sakila"])
+    parser.add_argument("--rows", type=int, default=1000, help="Synthetic rows per stand-in table")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds the stub Ollama takes per generation")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--llm-parallel", type=int, default=4, help="Generations the stub serves at once")
+    parser.add_argument("--stall-threshold", type=float, default=0.05, help="Event-loop lag in seconds counted as a stall")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON to this file")
+    parser.add_argument("--fail-on-stall", action="store_true", help="Exit with status 1 when the server's event loop stalled")
+    args = parser.parse_args()
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+    if args.fail_on_stall and result["server_event_loop"]["stalls"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
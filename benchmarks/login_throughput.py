@@ -0,0 +1,111 @@
+"""Login throughput and latency per bcrypt cost factor.
+
+Drives /token in-process over ASGI against a throwaway SQLite metadata database, once
+per cost factor, with the password hashing pool sized as it would be in the API
+(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE, or --workers and --max-queue). While
+the logins run, a probe keeps calling a cheap authenticated endpoint to show whether
+the rest of the API stays responsive. Logins turned away by backpressure (503) are
+counted separately. Output is a single JSON document.
+
+    python -m benchmarks.login_throughput
+    python -m benchmarks.login_throughput --costs 10,12,14 --requests 64 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmarks.end_to_end import percentile, run_scenario
+
+async def probe(client, headers: Dict[str, str], stop: asyncio.Event) -> List[float]:
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/schema/cache-stats", headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.01)
+    return latencies
+
+async def run(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="dbchat_login_")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'meta.db')}")
+    os.environ.setdefault("MISTRAL_KEY", "benchmark")
+    import httpx
+    from passlib.context import CryptContext
+    from app import auth, main
+    from app.password_hashing import PasswordHasher
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for cost in args.costs:
+            auth.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=cost)
+            auth.password_hasher = PasswordHasher(auth.pwd_context, args.workers, args.max_queue)
+            username, password = f"login-{cost}-{int(time.time())}", "benchmark-password"
+            started = time.perf_counter()
+            response = await client.post("/register", json={"email": f"{username}@example.com", "username": username, "password": password})
+            response.raise_for_status()
+            hash_ms = (time.perf_counter() - started) * 1000
+            response = await client.post("/token", json={"username": username, "password": password})
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            stop = asyncio.Event()
+            prober = asyncio.create_task(probe(client, headers, stop))
+            result = await run_scenario(
+                lambda n: client.post("/token", json={"username": username, "password": password}), args.requests, args.concurrency
+            )
+            stop.set()
+            probe_latencies = await prober
+            rejected = result["errors"].get("503", 0)
+            elapsed = result["requests"] / result["throughput_rps"] if result["throughput_rps"] else None
+            results[str(cost)] = {
+                "register_ms": round(hash_ms, 1),
+                "logins": result["requests"],
+                "rejected": rejected,
+                "successful_logins_per_s": round((result["requests"] - rejected) / elapsed, 1) if elapsed else None,
+                "latency_ms": result["latency_ms"],
+                "errors": result["errors"],
+                "probe_latency_ms": {
+                    "requests": len(probe_latencies),
+                    "p50": round(percentile(probe_latencies, 0.50), 2),
+                    "p99": round(percentile(probe_latencies, 0.99), 2),
+                    "max": round(max(probe_latencies), 2),
+                },
+            }
+            auth.password_hasher.shutdown()
+
+    return {
+        "benchmark": "login_throughput",
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "workers": auth.password_hasher.workers,
+        "max_queue": auth.password_hasher.max_queue,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "costs": results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--costs", default="10,11,12,13", help="Comma-separated bcrypt cost factors")
+    parser.add_argument("--requests", type=int, default=32, help="Logins per cost factor")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, help="Hashing threads (default: PASSWORD_HASH_WORKERS or the CPU count)")
+    parser.add_argument("--max-queue", type=int, help="Hashing calls allowed to wait (default: PASSWORD_HASH_MAX_QUEUE or 8 per worker)")
+    parser.add_argument("--output", help="Also write the JSON to this file")
+    args = parser.parse_args()
+    args.costs = [int(cost) for cost in args.costs.split(",") if cost.strip()]
+    result = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(result + "\n")
+    print(result)
+
+if __name__ == "__main__":
+    main()
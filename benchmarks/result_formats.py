@@ -0,0 +1,103 @@
+"""Payload size and client-side decode time of /query result formats.
+
+Runs one wide query through /query in-process with a stub LLM, once per result
+format, and reports response bytes, server time and the time a client takes to turn
+the body into a pandas DataFrame. Output is a single JSON document.
+
+    python -m benchmarks.result_formats --db-type postgres \\
+        --connection-string "postgres:postgres@localhost:5432/bench" --rows 100000 --columns 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+def wide_query(db_type: str, rows: int, columns: int) -> str:
+    if db_type != "postgres":
+        raise SystemExit("Pass --sql for databases other than postgres")
+    expressions = []
+    for index in range(columns):
+        kind = index % 4
+        if kind == 0:
+            expressions.append(f"g * {index + 1} AS int_column_{index}")
+        elif kind == 1:
+            expressions.append(f"(g * {index + 1})::float8 / 7 AS float_column_{index}")
+        elif kind == 2:
+            expressions.append(f"md5((g + {index})::text) AS text_column_{index}")
+        else:
+            expressions.append(f"timestamp '2024-01-01' + g * interval '1 second' AS timestamp_column_{index}")
+    return f"SELECT {', '.join(expressions)} FROM generate_series(1, {rows}) AS g"
+
+def decode(result_format: str, content: bytes):
+    import pandas as pd
+    if result_format == "records":
+        return pd.DataFrame(json.loads(content)["results"])
+    if result_format == "columnar":
+        payload = json.loads(content)
+        return pd.DataFrame(payload["rows"], columns=payload["columns"])
+    import pyarrow as pa
+    return pa.ipc.open_stream(content).read_pandas()
+
+async def run(args):
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/dbchat_benchmark_meta.db")
+    os.environ.setdefault("MISTRAL_KEY", "benchmark")
+    import httpx
+    from app import main, auth
+    from app.ai.base import BaseAIService
+
+    sql = args.sql or wide_query(args.db_type, args.rows, args.columns)
+
+    class StubAIService(BaseAIService):
+        def _setup_services(self):
+            pass
+
+        async def generate_sql_query(self, natural_language, schema, databaseType):
+            return sql
+
+    class BenchmarkUser:
+        id = 0
+        username = "benchmark"
+
+    main.ai_service = StubAIService({})
+    main.app.dependency_overrides[auth.get_current_user] = lambda: BenchmarkUser()
+    connection_id = main.db_manager.connection_key(args.db_type, args.connection_string)
+    await main.db_manager.connect(BenchmarkUser.id, connection_id, args.db_type, args.connection_string)
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for result_format in args.formats.split(","):
+            started = time.perf_counter()
+            response = await client.post(
+                "/query", params={"format": result_format},
+                json={"natural_language": "wide rows", "connection_id": connection_id}
+            )
+            response.raise_for_status()
+            server_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            frame = decode(result_format, response.content)
+            results.append({
+                "format": result_format,
+                "response_bytes": len(response.content),
+                "server_seconds": round(server_seconds, 2),
+                "client_decode_seconds": round(time.perf_counter() - started, 2),
+                "shape": list(frame.shape),
+            })
+    await main.db_manager.dispose_all()
+    return {"db_type": args.db_type, "rows": args.rows, "columns": args.columns, "results": results}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-type", required=True, choices=["postgres", "mysql", "sqlserver", "oracle"])
+    parser.add_argument("--connection-string", required=True)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--columns", type=int, default=40)
+    parser.add_argument("--sql", help="Query returning the rows (required for databases other than postgres)")
+    parser.add_argument("--formats", default="records,columnar,arrow")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Peak API memory for large query results, buffered vs streamed.
+
+Each endpoint runs in its own child process so that peak RSS (ru_maxrss) belongs to
+one run. The child drives the FastAPI app directly over ASGI with a stub LLM that
+returns a generated N-row query, and discards the response body as it arrives, as
+a client reading the stream would. Output is a single JSON document.
+
+    python -m benchmarks.result_memory --db-type postgres \\
+        --connection-string "postgres:postgres@localhost:5432/bench" --rows 10000000
+
+The buffered /query run holds the whole result in memory; pass --endpoints ndjson
+to skip it on machines with little RAM.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROW_QUERIES = {
+    "postgres": "SELECT g AS id, md5(g::text) AS payload, now() AS created_at FROM generate_series(1, {rows}) AS g",
+    "mysql": (
+        "WITH RECURSIVE g(id) AS (SELECT 1 UNION ALL SELECT id + 1 FROM g WHERE id < {rows}) "
+        "SELECT id, md5(id) AS payload, now() AS created_at FROM g"
+    ),
+}
+
+ENDPOINTS = {"json": "/query", "ndjson": "/query/ndjson", "sse": "/query/stream"}
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def drive(app, path: str, body: dict):
+    """Sends one request straight to the ASGI app and counts the response body without keeping it."""
+    payload = json.dumps(body).encode()
+    received = {"status": None, "bytes": 0, "lines": 0}
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            received["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            received["bytes"] += len(chunk)
+            received["lines"] += chunk.count(b"\n")
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("benchmark", 80),
+    }
+    await app(scope, receive, send)
+    return received
+
+async def run_child(args):
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/dbchat_benchmark_meta.db")
+    os.environ.setdefault("MISTRAL_KEY", "benchmark")
+    from app import main, auth
+    from app.ai.base import BaseAIService
+
+    sql = args.sql or ROW_QUERIES[args.db_type].format(rows=args.rows)
+
+    class StubAIService(BaseAIService):
+        def _setup_services(self):
+            pass
+
+        async def generate_sql_query(self, natural_language, schema, databaseType):
+            return sql
+
+    class BenchmarkUser:
+        id = 0
+        username = "benchmark"
+
+    main.ai_service = StubAIService({})
+    main.app.dependency_overrides[auth.get_current_user] = lambda: BenchmarkUser()
+    connection_id = main.db_manager.connection_key(args.db_type, args.connection_string)
+    await main.db_manager.connect(BenchmarkUser.id, connection_id, args.db_type, args.connection_string)
+    # Warm up the schema cache so the measured request is only the result path
+    await main.schema_cache.get((BenchmarkUser.id, connection_id), await main.db_manager.get_connection(BenchmarkUser.id, connection_id))
+
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    received = await drive(main.app, ENDPOINTS[args.child], {"natural_language": "benchmark rows", "connection_id": connection_id})
+    elapsed = time.perf_counter() - started
+    await main.db_manager.dispose_all()
+    return {
+        "endpoint": ENDPOINTS[args.child],
+        "status": received["status"],
+        "response_bytes": received["bytes"],
+        "response_lines": received["lines"],
+        "seconds": round(elapsed, 2),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-type", required=True, choices=["postgres", "mysql", "sqlserver", "oracle"])
+    parser.add_argument("--connection-string", required=True)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--sql", help="Query returning the rows (required for sqlserver and oracle)")
+    parser.add_argument("--endpoints", default="ndjson,sse,json", help="Comma-separated: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--child", choices=list(ENDPOINTS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_child(args))))
+        return
+
+    runs = []
+    for endpoint in args.endpoints.split(","):
+        command = [sys.executable, "-m", "benchmarks.result_memory", "--child", endpoint,
+                   "--db-type", args.db_type, "--connection-string", args.connection_string, "--rows", str(args.rows)]
+        if args.sql:
+            command += ["--sql", args.sql]
+        child = subprocess.run(command, capture_output=True, text=True)
+        if child.returncode != 0:
+            runs.append({"endpoint": ENDPOINTS[endpoint], "error": child.stderr.strip().splitlines()[-1:]})
+            continue
+        runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+    print(json.dumps({"db_type": args.db_type, "rows": args.rows, "runs": runs}, indent=2))
+
+if __name__ == "__main__":
+    main()
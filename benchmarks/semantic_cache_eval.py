@@ -0,0 +1,60 @@
+"""Semantic cache accuracy benchmark.
+
+Loads every cached question of a labelled set of (cached question, new question, same
+intent) pairs into one SemanticQueryCache, looks each new question up and reports, for
+each similarity threshold, the hit rate on true paraphrases and the false-hit rate on
+questions that need different SQL, including paraphrases answered with another
+question's entry. Output is a single JSON document.
+
+    python -m benchmarks.semantic_cache_eval
+"""
+import argparse
+import json
+import os
+
+from app.ai.semantic_cache import SemanticQueryCache
+
+DEFAULT_PAIRS = os.path.join(os.path.dirname(__file__), "data", "semantic_cache_pairs.json")
+
+def evaluate(pairs, threshold: float):
+    # Every cached question goes into one cache, as in a running connection, and its
+    # SQL stands in as the question itself; a lookup is correct only when it returns
+    # the entry of its own pair, or nothing for a question with a different intent
+    cached = list(dict.fromkeys(pair["cached"] for pair in pairs))
+    cache = SemanticQueryCache(threshold=threshold, max_entries=len(cached))
+    for question in cached:
+        cache.put("eval", question, "schema", question)
+    hits = false_hits = wrong_entries = same = different = 0
+    for pair in pairs:
+        found = cache.lookup("eval", pair["question"], "schema")
+        answer = found[0] if found else None
+        if pair["same"]:
+            same += 1
+            hits += answer == pair["cached"]
+            wrong_entries += answer not in (None, pair["cached"])
+        else:
+            different += 1
+            false_hits += answer is not None
+    return {
+        "threshold": threshold,
+        "paraphrase_hit_rate": round(hits / same, 3) if same else None,
+        "false_hit_rate": round(false_hits / different, 3) if different else None,
+        # Paraphrases answered with the entry of another cached question
+        "wrong_entry_rate": round(wrong_entries / same, 3) if same else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pairs", default=DEFAULT_PAIRS, help="JSON file of labelled question pairs")
+    parser.add_argument("--thresholds", default="0.7,0.75,0.8,0.85,0.9,0.95")
+    args = parser.parse_args()
+    with open(args.pairs) as f:
+        pairs = json.load(f)
+    thresholds = [float(value) for value in args.thresholds.split(",")]
+    print(json.dumps({
+        "pairs": len(pairs),
+        "results": [evaluate(pairs, threshold) for threshold in thresholds]
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
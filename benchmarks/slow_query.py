@@ -0,0 +1,118 @@
+"""Head-of-line blocking benchmark for /query.
+
+Drives the FastAPI app in-process with a stub LLM and measures /query throughput for
+fast statements twice: on its own, and while one slow statement runs on the same
+connection. With database calls off the event loop the two numbers should be close.
+Also reports the worst event-loop stall seen in each phase. Output is a single JSON
+document.
+
+    python -m benchmarks.slow_query --db-type postgres \\
+        --connection-string "postgres:postgres@localhost:5432/pagila"
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+SLOW_QUERIES = {
+    "postgres": "SELECT pg_sleep({seconds})",
+    "mysql": "SELECT SLEEP({seconds})",
+    "sqlserver": "WAITFOR DELAY '00:00:{seconds:02d}'; SELECT 1 AS done",
+}
+
+async def measure_loop_stall(stop: asyncio.Event, interval: float = 0.01) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+async def run_phase(client, connection_id: str, concurrency: int, duration: float, slow: bool):
+    stop = asyncio.Event()
+    stall = asyncio.create_task(measure_loop_stall(stop))
+    completed = 0
+    errors = 0
+
+    async def worker(deadline: float):
+        nonlocal completed, errors
+        while time.perf_counter() < deadline:
+            response = await client.post("/query", json={"natural_language": "fast", "connection_id": connection_id})
+            if response.status_code == 200:
+                completed += 1
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    slow_request = None
+    if slow:
+        slow_request = asyncio.create_task(
+            client.post("/query", json={"natural_language": "slow", "connection_id": connection_id})
+        )
+    await asyncio.gather(*[worker(started + duration) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    if slow_request:
+        await slow_request
+    stop.set()
+    return {
+        "requests": completed,
+        "errors": errors,
+        "throughput_rps": round(completed / elapsed, 1),
+        "max_loop_stall_ms": round(await stall * 1000, 1),
+    }
+
+async def run(args):
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/dbchat_benchmark_meta.db")
+    os.environ.setdefault("MISTRAL_KEY", "benchmark")
+    import httpx
+    from app import main, auth
+    from app.ai.base import BaseAIService
+
+    slow_sql = args.slow_sql or SLOW_QUERIES[args.db_type].format(seconds=args.slow_seconds)
+
+    class StubAIService(BaseAIService):
+        def _setup_services(self):
+            pass
+
+        async def generate_sql_query(self, natural_language, schema, databaseType):
+            return slow_sql if natural_language == "slow" else "SELECT 1 AS one"
+
+    class BenchmarkUser:
+        id = 0
+        username = "benchmark"
+
+    main.ai_service = StubAIService({})
+    main.app.dependency_overrides[auth.get_current_user] = lambda: BenchmarkUser()
+    connection_id = main.db_manager.connection_key(args.db_type, args.connection_string)
+    await main.db_manager.connect(BenchmarkUser.id, connection_id, args.db_type, args.connection_string)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        baseline = await run_phase(client, connection_id, args.concurrency, args.duration, slow=False)
+        with_slow = await run_phase(client, connection_id, args.concurrency, args.duration, slow=True)
+    await main.db_manager.dispose_all()
+    return {
+        "db_type": args.db_type,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "slow_query": slow_sql,
+        "baseline": baseline,
+        "with_slow_query": with_slow,
+        "throughput_ratio": round(with_slow["throughput_rps"] / baseline["throughput_rps"], 2) if baseline["throughput_rps"] else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-type", required=True, choices=["postgres", "mysql", "sqlserver", "oracle"])
+    parser.add_argument("--connection-string", required=True)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per phase")
+    parser.add_argument("--slow-seconds", type=int, default=5)
+    parser.add_argument("--slow-sql", help="Statement used as the slow query (required for oracle)")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
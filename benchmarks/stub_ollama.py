@@ -0,0 +1,88 @@
+"""Stand-in for Ollama's /api/chat, so load tests need neither a model nor network access.
+
+Answers with the SQL of the corpus question found in the prompt (a trailing
+"(request N)" is ignored) after a configurable latency, streamed piece by piece
+when the request asks for a stream. At most --parallel generations run at once and
+the rest queue, as they do in Ollama with OLLAMA_NUM_PARALLEL. GET /stats reports
+the number of requests served.
+
+    python -m benchmarks.stub_ollama --port 11435 --latency 0.5 --parallel 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+from typing import Any, Dict
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "load_questions.json")
+
+def load_corpus(path: str = CORPUS_PATH) -> Dict[str, str]:
+    with open(path) as corpus_file:
+        return {entry["question"]: entry["sql"] for entry in json.load(corpus_file)}
+
+def create_app(corpus: Dict[str, str], latency: float, jitter: float = 0.0, parallel: int = 4, seed: int = 0) -> FastAPI:
+    app = FastAPI(title="Stub Ollama")
+    slots = asyncio.Semaphore(parallel)
+    delays = random.Random(seed)
+    stats = {"requests": 0, "unknown_questions": 0}
+
+    def answer(body: Dict[str, Any]):
+        prompt = body["messages"][-1]["content"]
+        # The question is the rest of the line after "for the following:" in BaseAIService._build_prompt
+        match = re.search(r"for the following: (.*)", prompt)
+        question = re.sub(r" \(request \d+\)$", "", match.group(1).strip()) if match else ""
+        if question not in corpus:
+            stats["unknown_questions"] += 1
+        sql = corpus.get(question, "SELECT 1 AS one")
+        pieces = [f"{word} " for word in f"```sql\n{sql}\n```".split(" ")]
+        # Token counts as Ollama reports them, approximated at four characters per token
+        usage = {"prompt_eval_count": len(prompt) // 4, "eval_count": len(pieces)}
+        return pieces, usage
+
+    @app.post("/api/chat")
+    async def chat(body: Dict[str, Any]):
+        stats["requests"] += 1
+        pieces, usage = answer(body)
+        delay = max(0.0, latency + delays.uniform(-jitter, jitter))
+        if not body.get("stream", True):
+            async with slots:
+                await asyncio.sleep(delay)
+            return {"model": body.get("model"), "message": {"role": "assistant", "content": "".join(pieces)}, "done": True, **usage}
+
+        async def chunks():
+            async with slots:
+                for piece in pieces:
+                    await asyncio.sleep(delay / len(pieces))
+                    yield json.dumps({"model": body.get("model"), "message": {"role": "assistant", "content": piece}, "done": False}) + "\n"
+            yield json.dumps({"model": body.get("model"), "message": {"role": "assistant", "content": ""}, "done": True, **usage}) + "\n"
+
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per generation")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Generations take latency +/- up to this many seconds")
+    parser.add_argument("--parallel", type=int, default=4, help="Generations served at once, like OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    app = create_app(load_corpus(args.corpus), args.latency, args.jitter, args.parallel, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()